@@ -2,36 +2,124 @@
 # ChatGPT client for PicoCalc using gpt-5.1 model
 # This file should be placed directly in /apps/ folder
 
+import gc
 import ujson as json
-import urequests as requests
+import utime
+from io import IOBase
+from utime import localtime, ticks_ms, ticks_us, ticks_diff, ticks_add
 
-# Ensure ujson dumps properly
-def json_dumps_safe(obj):
-    """Safely dump JSON for urequests"""
-    try:
-        return json.dumps(obj)
-    except Exception as e:
-        log_error(f"JSON DUMP ERROR: {e}")
-        raise
+# Networking modules (usocket, ussl, uselect) are imported on the first
+# request and Picoware's in start(), so launching the app stays quick
 
 # API Configuration
 OPENAI_API_KEY = "YOUR_API_KEY_HERE"  # Replace with your OpenAI API key
 OPENAI_MODEL = "gpt-4o-mini"  # Using standard model that works
-API_URL = "https://api.openai.com/v1/chat/completions"  # Standard endpoint
+API_BASE = "https://api.openai.com/v1"  # Or an OpenAI-compatible server, like "http://192.168.1.20:8080/v1"
+API_BACKEND = "auto"  # "chat", "responses", "gateway" (gateway.py on your LAN), or "auto" to probe API_BASE once
+BACKEND_CACHE = "/picogpt_backend.json"  # Probe result, delete it to probe again
+STREAM_REPLIES = True  # Paint replies token by token via server-sent events
+STREAM_REDRAW_MS = 150  # Minimum time between redraws while a reply streams in
+IDLE_FRAMES = 30  # Frames with nothing to redraw before the loop starts sleeping
+IDLE_SLEEP_MS = 40  # Longest sleep per frame once idle, grows 1ms per idle frame
+HTTP_TIMEOUT = 30  # Socket timeout and longest wait for server data, in seconds
+HTTP_COMPRESSION = True  # Ask for gzip/deflate bodies, inflating one takes INFLATE_WINDOW of heap
+
+# Retries of transient failures (network errors, 429 and 5xx responses)
+RETRY_ATTEMPTS = 3  # Retries after the first attempt
+RETRY_BASE_MS = 500  # First backoff, doubled for each further retry
+RETRY_MAX_MS = 8000  # Longest backoff, unless Retry-After asks for more
+REQUEST_DEADLINE = 60  # Seconds a question may take, retries included
+BREAKER_FAILURES = 3  # Questions failing in a row before new ones fail fast
+BREAKER_COOLDOWN = 60  # Seconds questions fail fast once the breaker opened
+_RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504)
 
 HEADERS = {
     "Authorization": "Bearer " + OPENAI_API_KEY,
     "Content-Type": "application/json; charset=utf-8",
 }
 
+# Logging
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARN = 30
+LOG_ERROR = 40
+LOG_LEVEL = LOG_INFO  # Set to LOG_DEBUG for payload dumps and button traces
+LOG_PATH = "/error_log.txt"
+LOG_BUFFER_LINES = 32  # Lines held in RAM before they are written to flash
+LOG_MAX_BYTES = 32 * 1024  # Rotate LOG_PATH to LOG_PATH + ".1" past this size
+LOG_SERIAL = False  # Also print log lines to the serial console
+LOG_UDP_ADDR = None  # e.g. ("192.168.1.10", 5140) to send lines to a collector
+
 SYSTEM_INSTRUCTION = (
     "You are a helpful assistant running on a tiny calculator. "
     "Keep answers short (1–3 sentences) and avoid long lists."
 )
 
+# Response cache
+CACHE_ENABLED = True  # Answer repeated prompts from flash without using WiFi
+CACHE_DIR = "/picogpt_cache"
+CACHE_MAX_BYTES = 16 * 1024  # Least recently used replies are evicted past this
+CACHE_TTL = 0  # Seconds a cached reply stays valid, 0 keeps it until evicted
+SIMILAR_CACHE = True  # Also answer a conversation's first question worded like an earlier one from the cache
+SIMILAR_THRESHOLD = 0.85  # How alike (0-1, by character trigrams) a question must be to count
+SIMILAR_MAX_ENTRIES = 24  # Questions indexed, least recently used evicted past this (at most 30)
+SIMILAR_MIN_CHARS = 10  # Shorter questions ("why?") depend on the conversation, never matched
+
+# Offline queue
+QUEUE_PATH = "/picogpt_queue.txt"  # Questions asked offline, sent once WiFi is back
+ANSWERS_PATH = "/picogpt_answers.txt"  # Their answers, shown with DOWN on the start screen
+ANSWERS_MAX_BYTES = 8 * 1024  # The oldest answers are dropped past this
+QUEUE_RETRY = 30  # Seconds before a queued question is tried again after a failure
+
+# Conversation kept on flash, restored when the app starts again
+CHAT_LOG_ENABLED = True
+CHAT_LOG_PATH = "/picogpt_chat.log"  # Append-only messages, indexed by CHAT_LOG_PATH + ".idx"
+CHAT_LOG_MAX_BYTES = 32 * 1024  # Past this the oldest messages are dropped down to half of it
+CHAT_PAGE_MESSAGES = 6  # Messages read from flash per page of the conversation view
+
+# Request timing, shown with UP on the start screen
+STATS_SAMPLES = 32  # Newest samples kept per request phase for min/avg/p95
+
+# Text layout for the reply and error views
+TEXT_MARGIN = 5
+TEXT_CHAR_WIDTH = 8  # Pixel width of one character of the system font
+TEXT_LINE_HEIGHT = 12
+
+# Conversation history. OpenAI only caches prompts of 1024+ tokens, which
+# takes a budget of about 1500 and HISTORY_BYTES of 12288. Below that the
+# stable prefix still suits llama.cpp's KV cache and keeps prompts shorter.
+HISTORY_TOKEN_BUDGET = 500  # Estimated prompt tokens spent on earlier turns
+HISTORY_STABLE_PREFIX = True  # Compact only past the budget, so prompts share a prefix providers can cache
+HISTORY_REBASE_TOKENS = 250  # Stable mode compacts down to this, later turns then only append
+HISTORY_KEEP_FULL = 2  # Newest history messages that are never shortened
+HISTORY_CLIP_CHARS = 160  # Older assistant replies are cut to this length
+HISTORY_SUMMARY_CHARS = 400  # Longest running summary of folded-away turns
+HISTORY_BYTES = 4096  # History buffer size, the oldest messages are dropped past this
+HISTORY_SLOTS = 32  # Most messages kept in history
+_SUMMARY_PREFIX = "Earlier in this chat: "
+_HISTORY_ROLES = ("system", "user", "assistant")  # Role tags stored in _History
+
+# Messages after the system message, as encoded into request bodies
+_BODY_ROLES = {
+    "system": b',{"role":"system","content":',
+    "user": b',{"role":"user","content":',
+    "assistant": b',{"role":"assistant","content":',
+}
+BODY_HEADROOM = 384  # Bytes reserved in front of the body for the HTTP request head
+BODY_BUFFER_BYTES = HISTORY_BYTES + 1024  # Request body buffer allocated by start(), grown if ever short
+
+# Reply size, asked for as max_tokens
+REPLY_MAX_TOKENS = 1024  # Longest reply
+REPLY_MAX_SCREENS = 4  # Most reply view screens a reply may fill
+REPLY_MIN_TOKENS = 64  # A question isn't sent when the heap holds fewer tokens
+REPLY_HEAP_PER_TOKEN = 32  # Heap a reply token takes as it streams in, is copied and laid out
+HEAP_RESERVE = 16 * 1024  # Heap left for drawing and the request itself
+INFLATE_WINDOW = 32 * 1024  # Heap a compressed reply takes to inflate, servers send 15-bit windows
+TLS_RESERVE = 24 * 1024  # Heap a new TLS connection takes, mbedTLS's 16KB record buffer and handshake
+
 # Global state variables
 _chat_alert = None
-_chat_history = []
+_chat_history = None  # _History, allocated in start()
 _chat_user_input = ""
 _chat_waiting_for_input = False
 _chat_request_in_progress = False
@@ -39,138 +127,2333 @@ _chat_displaying_result = False
 _chat_last_reply = ""
 _chat_input_text = ""  # Current text being entered
 _chat_error_displaying = False  # Flag for error display mode
-_chat_error_lines = []  # Lines of error text
-_chat_error_scroll_offset = 0  # Current scroll position
+_chat_error_text = ""  # Error shown in the error display
+_chat_request = None  # In-flight request generator, advanced once per frame
+_chat_session = None  # Keep-alive connection to the API host
+_chat_backend = None  # _ChatBackend or a subclass for API_BASE, set on first use
+_chat_body = None  # Reusable request body buffer, allocated in start()
+_chat_raw_buf = None  # Read buffer for compressed bodies, allocated in start()
+_chat_screen_chars = 0  # Characters one reply view screen shows, 0 until start()
+_chat_screen_cols = 0  # Columns of the reply view, 0 until start()
+_chat_cache = None  # Response cache, loaded on first use
+_chat_similar = None  # _SimilarIndex of cached questions, loaded on first use
+_chat_match = None  # (question, percent alike) when the last asked was answered from a similar one
+_chat_last_match = None  # _chat_match of the reply on screen
+_chat_fresh = True  # No question asked since start() or a new conversation, a similar one may answer it
+_log_lines = []  # Formatted log lines not yet written to flash
+_log_size = -1  # Size of LOG_PATH, -1 until first checked
+_log_udp = None  # Socket for LOG_UDP_ADDR
+_chat_last_paint = 0  # ticks_ms of the last progress redraw
+_breaker_failures = 0  # Questions that failed in a row with a retryable error
+_breaker_until = 0  # ticks_ms until which questions fail fast
+_chat_dirty = True  # Screen is out of date, set whenever displayed state changes
+_chat_idle_frames = 0  # Frames in a row with nothing to redraw
+_chat_tokens = {"prompt": 0, "cached": 0, "completion": 0}  # Usage reported since start
+
+# Picoware names used every frame, imported once by start()
+Vector = None
+BUTTON_BACK = BUTTON_LEFT = BUTTON_RIGHT = BUTTON_CENTER = BUTTON_UP = BUTTON_DOWN = None
+_chat_queue = None  # _RequestQueue, loaded in start()
+_chat_drain = None  # Generator answering the oldest queued question in the background
+_chat_queue_wait = 0  # ticks_ms before which the queue and WiFi aren't looked at
+_chat_online = None  # WiFi state when last looked at
+_chat_answers_displaying = False  # Showing the answers to queued questions
+_chat_answers_text = ""
+_chat_log = None  # _ChatLog, opened by start()
+_chat_log_displaying = False  # Paging through the saved conversations
+_chat_log_text = ""
+_chat_log_page = 0  # First message of the page in the conversation view
+_chat_stats = None  # _Stats, made by start() and kept across launches
+_chat_stats_displaying = False  # Showing the request timings
+_chat_stats_text = ""
+_chat_paint_from = None  # ticks_us the shown question was sent, until its reply is first drawn
+_chat_parse_us = 0  # Time spent parsing the response body being read
+_chat_finish = None  # finish_reason of the last reply fetched
 
 
 def __reset_chat_state() -> None:
     """Reset chat state flags"""
     global _chat_waiting_for_input, _chat_request_in_progress, _chat_displaying_result
-    global _chat_error_displaying, _chat_error_lines, _chat_error_scroll_offset
+    global _chat_error_displaying, _chat_error_text, _chat_dirty
+    global _chat_answers_displaying, _chat_answers_text
+    global _chat_stats_displaying, _chat_stats_text, _chat_paint_from
+    global _chat_log_displaying, _chat_log_text
     _chat_waiting_for_input = False
     _chat_request_in_progress = False
     _chat_displaying_result = False
     _chat_error_displaying = False
-    _chat_error_lines = []
-    _chat_error_scroll_offset = 0
+    _chat_error_text = ""
+    _chat_answers_displaying = False
+    _chat_answers_text = ""
+    _chat_stats_displaying = False
+    _chat_stats_text = ""
+    _chat_paint_from = None
+    _chat_log_displaying = False
+    _chat_log_text = ""
+    _chat_dirty = True
+
+
+def _estimate_tokens(text) -> int:
+    """Rough token count of a message, about 4 characters per token plus overhead"""
+    return len(text) // 4 + 4
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+class _History:
+    """
+    Conversation messages kept JSON-encoded in one preallocated ring buffer,
+    with tables of where each message starts and ends and its role tag.
+    Messages are copied into request bodies as they are and dropping the
+    oldest only moves the head, so a turn allocates little beyond the
+    encoded text of its two new messages.
+    """
+
+    def __init__(self, size=HISTORY_BYTES, slots=HISTORY_SLOTS):
+        from array import array
+        
+        self.buf = bytearray(size)
+        self.starts = array("H", [0] * slots)
+        self.ends = array("H", [0] * slots)
+        self.roles = bytearray(slots)
+        self.first = 0  # Slot of the oldest message
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _slot(self, i):
+        return (self.first + i) % len(self.roles)
+
+    def _free(self):
+        """Bytes between the end of the newest message and the start of the oldest"""
+        if not self.count:
+            return len(self.buf)
+        return (self.starts[self.first] - self.ends[self._slot(self.count - 1)]) % len(self.buf)
+
+    def _put(self, pos, data):
+        """Copy data into the ring at pos, wrapping at the end, and return where it ends"""
+        size = len(self.buf)
+        n = min(len(data), size - pos)
+        data = memoryview(data)
+        self.buf[pos:pos + n] = data[:n]
+        self.buf[:len(data) - n] = data[n:]
+        return (pos + len(data)) % size
+
+    def _encode(self, text):
+        """JSON-encode text, clipped until it fits the buffer"""
+        data = json.dumps(text).encode()
+        while len(data) >= len(self.buf):
+            text = _clip(text, len(text) // 2)
+            data = json.dumps(text).encode()
+        return data
+
+    def role(self, i) -> str:
+        return _HISTORY_ROLES[self.roles[self._slot(i)]]
+
+    def text(self, i) -> str:
+        slot = self._slot(i)
+        start = self.starts[slot]
+        end = self.ends[slot]
+        if end < start:
+            return json.loads(bytes(self.buf[start:] + self.buf[:end]))
+        return json.loads(bytes(memoryview(self.buf)[start:end]))
+
+    def nbytes(self, i) -> int:
+        """Length of message i JSON-encoded, quotes included"""
+        slot = self._slot(i)
+        return (self.ends[slot] - self.starts[slot]) % len(self.buf)
+
+    def tokens(self, i) -> int:
+        """Estimated tokens of message i, as _estimate_tokens of its encoded text"""
+        return (self.nbytes(i) - 2) // 4 + 4
+
+    def append(self, role, text) -> None:
+        """Add a newest message, dropping the oldest ones to make room"""
+        data = self._encode(text)
+        while self.count and (self.count == len(self.roles) or self._free() < len(data)):
+            self.popleft()
+        pos = self.ends[self._slot(self.count - 1)] if self.count else 0
+        slot = self._slot(self.count)
+        self.starts[slot] = pos
+        self.ends[slot] = self._put(pos, data)
+        self.roles[slot] = _HISTORY_ROLES.index(role)
+        self.count += 1
+
+    def appendleft(self, role, text) -> None:
+        """Add an oldest message, dropping the oldest ones to make room"""
+        data = self._encode(text)
+        while self.count and (self.count == len(self.roles) or self._free() < len(data)):
+            self.popleft()
+        end = self.starts[self.first] if self.count else 0
+        self.first = (self.first - 1) % len(self.roles)
+        self.starts[self.first] = (end - len(data)) % len(self.buf)
+        self.ends[self.first] = self._put(self.starts[self.first], data)
+        self.roles[self.first] = _HISTORY_ROLES.index(role)
+        self.count += 1
+
+    def shrink(self, i, text) -> None:
+        """Replace message i in place with text that encodes no longer than it"""
+        data = json.dumps(text).encode()
+        if len(data) <= self.nbytes(i):
+            slot = self._slot(i)
+            self.ends[slot] = self._put(self.starts[slot], data)
+
+    def popleft(self) -> None:
+        self.first = self._slot(1)
+        self.count -= 1
+
+    def clear(self) -> None:
+        self.first = 0
+        self.count = 0
+
+    def write_to(self, body) -> None:
+        """Write the messages to a _BodyBuffer as chat/completions message objects"""
+        buf = memoryview(self.buf)
+        for i in range(self.count):
+            slot = self._slot(i)
+            start = self.starts[slot]
+            end = self.ends[slot]
+            body.write(_BODY_ROLES[_HISTORY_ROLES[self.roles[slot]]])
+            if end < start:
+                body.write(buf[start:])
+                start = 0
+            body.write(buf[start:end])
+            body.write(b"}")
+
+
+def _history_target() -> int:
+    """Tokens a turn's _compact_history shrinks the history to"""
+    return HISTORY_REBASE_TOKENS if HISTORY_STABLE_PREFIX else HISTORY_TOKEN_BUDGET
+
+
+def _compact_history(history, target=HISTORY_TOKEN_BUDGET) -> None:
+    """
+    Shrink a _History past HISTORY_TOKEN_BUDGET until it fits target. Older
+    assistant replies are clipped first, then the oldest messages are
+    folded into a running summary kept as a system message at the front.
+    A target below the budget leaves the history alone for a few turns.
+    History short of free slots is folded too, before the next turn would
+    push out its oldest message unsummarised.
+    """
+    total = 0
+    for i in range(len(history)):
+        total += history.tokens(i)
+    slots = len(history.roles)
+    full = len(history) > slots - 2
+    if total <= HISTORY_TOKEN_BUDGET and not full:
+        return
+    
+    # Clip older assistant replies, only decoding ones that may be too long
+    for i in range(len(history) - HISTORY_KEEP_FULL):
+        if history.role(i) == "assistant" and history.nbytes(i) > HISTORY_CLIP_CHARS + 2:
+            content = history.text(i)
+            if len(content) > HISTORY_CLIP_CHARS:
+                tokens = history.tokens(i)
+                history.shrink(i, _clip(content, HISTORY_CLIP_CHARS))
+                total += history.tokens(i) - tokens
+    if total <= target and not full:
+        return
+    
+    # Work out what folding the oldest messages into the summary gives first,
+    # short messages can cost more in the summary than they do as they are
+    before = total
+    summary = ""
+    folded = 0
+    if history and history.role(0) == "system":
+        total -= history.tokens(0)
+        summary = history.text(0)[len(_SUMMARY_PREFIX):]
+        folded = 1
+    while len(history) - folded > HISTORY_KEEP_FULL and (
+        total + _estimate_tokens(_SUMMARY_PREFIX + summary) > target or full and len(history) - folded > slots // 2
+    ):
+        total -= history.tokens(folded)
+        who = "User: " if history.role(folded) == "user" else "You: "
+        summary += ("; " if summary else "") + who + _clip(history.text(folded), 80)
+        folded += 1
+        if len(summary) > HISTORY_SUMMARY_CHARS:
+            summary = "..." + summary[-(HISTORY_SUMMARY_CHARS - 3):]
+    if not summary or not full and total + _estimate_tokens(_SUMMARY_PREFIX + summary) >= before:
+        return
+    for _ in range(folded):
+        history.popleft()
+    history.appendleft("system", _SUMMARY_PREFIX + summary)
+
+
+def log_enabled(level) -> bool:
+    """True if messages at level are recorded, check before building costly messages"""
+    return level >= LOG_LEVEL
+
+
+def _log(level, tag, msg) -> None:
+    """Buffer one log line, flushing when the buffer fills or on errors"""
+    if level < LOG_LEVEL:
+        return
+    try:
+        t = localtime()
+        line = "[{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}] {} {}\n".format(
+            t[0], t[1], t[2], t[3], t[4], t[5], tag, msg
+        )
+    except:
+        line = "[unknown] {} {}\n".format(tag, msg)
+    if LOG_SERIAL:
+        print(line, end="")
+    _log_lines.append(line)
+    if level >= LOG_ERROR or len(_log_lines) >= LOG_BUFFER_LINES:
+        log_flush()
+
+
+def log_debug(msg) -> None:
+    _log(LOG_DEBUG, "D", msg)
+
+
+def log_info(msg) -> None:
+    _log(LOG_INFO, "I", msg)
+
+
+def log_warn(msg) -> None:
+    _log(LOG_WARN, "W", msg)
+
+
+def log_error(msg) -> None:
+    """Log an error and flush everything buffered so far"""
+    _log(LOG_ERROR, "E", msg)
+
+
+def log_flush() -> None:
+    """Write buffered lines to LOG_PATH in one append, rotating it when too big"""
+    global _log_size, _log_udp
+    if not _log_lines:
+        return
+    try:
+        import uos as os
+
+        if _log_size < 0:
+            try:
+                _log_size = os.stat(LOG_PATH)[6]
+            except OSError:
+                _log_size = 0
+        if _log_size > LOG_MAX_BYTES:
+            try:
+                os.remove(LOG_PATH + ".1")
+            except OSError:
+                pass
+            os.rename(LOG_PATH, LOG_PATH + ".1")
+            _log_size = 0
+        data = "".join(_log_lines)
+        with open(LOG_PATH, "a") as f:
+            f.write(data)
+        _log_size += len(data)
+    except:
+        # Keep only the newest lines if flash can't be written
+        del _log_lines[:-LOG_BUFFER_LINES]
+        return
+    if LOG_UDP_ADDR:
+        try:
+            if _log_udp is None:
+                import usocket as socket
+
+                _log_udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                _log_udp_addr = socket.getaddrinfo(LOG_UDP_ADDR[0], LOG_UDP_ADDR[1])[0][-1]
+                _log_udp.connect(_log_udp_addr)
+            for line in _log_lines:
+                _log_udp.send(line.encode())
+        except:
+            _log_udp = None
+    _log_lines.clear()
+
+
+class _Stats:
+    """
+    Rolling samples per request phase, the newest STATS_SAMPLES of each:
+    microseconds for the phases in TIMES, bytes for those in SIZES. Plus
+    running totals of the events in EVENTS, like cache hits.
+    """
+
+    TIMES = ("build", "lookup", "dns", "connect", "tls", "write", "ttfb", "body", "parse", "paint", "total")
+    SIZES = ("sent", "recv", "heap")
+    EVENTS = ("cache_hit", "cache_similar", "cache_miss")
+
+    def __init__(self, samples=STATS_SAMPLES):
+        self.samples = samples
+        self.counts = {}  # Samples added per phase, kept ones or not
+        self.events = {}  # Totals per event since the stats were made
+        self._values = {}  # Kept samples per phase, used as a ring once full
+
+    def count(self, name):
+        self.events[name] = self.events.get(name, 0) + 1
+
+    def add(self, name, value):
+        values = self._values.get(name)
+        if values is None:
+            values = self._values[name] = []
+            self.counts[name] = 0
+        if len(values) < self.samples:
+            values.append(value)
+        else:
+            values[self.counts[name] % self.samples] = value
+        self.counts[name] += 1
+
+    def summary(self, name):
+        """(count, min, avg, p95, max) of name's kept samples, None without any"""
+        values = self._values.get(name)
+        if not values:
+            return None
+        ordered = sorted(values)
+        n = len(ordered)
+        return self.counts[name], ordered[0], sum(ordered) // n, ordered[n * 95 // 100], ordered[-1]
+
+    def line(self):
+        """Export as one line: STATS phase=count,min,avg,p95,max ..."""
+        parts = ["STATS"]
+        for name in self.TIMES + self.SIZES:
+            summary = self.summary(name)
+            if summary:
+                parts.append(name + "=" + ",".join([str(v) for v in summary]))
+        for name in self.EVENTS:
+            if name in self.events:
+                parts.append("{}={}".format(name, self.events[name]))
+        return " ".join(parts)
+
+    def text(self):
+        """Table for the stats screen, times in ms"""
+        rows = ["Request phases, newest {}".format(self.samples), "", "{:<8}{:>4}{:>8}{:>8}{:>8}".format("ms", "n", "min", "avg", "p95")]
+        for name in self.TIMES:
+            summary = self.summary(name)
+            if summary:
+                rows.append("{:<8}{:>4}{:>8.1f}{:>8.1f}{:>8.1f}".format(
+                    name, summary[0], summary[1] / 1000, summary[2] / 1000, summary[3] / 1000))
+        rows.append("")
+        rows.append("{:<8}{:>4}{:>8}{:>8}{:>8}".format("bytes", "n", "min", "avg", "p95"))
+        for name in self.SIZES:
+            summary = self.summary(name)
+            if summary:
+                rows.append("{:<8}{:>4}{:>8}{:>8}{:>8}".format(name, summary[0], summary[1], summary[2], summary[3]))
+        events = self.events
+        if events:
+            rows.append("")
+            rows.append("Cache: {} hits, {} similar, {} misses".format(
+                events.get("cache_hit", 0), events.get("cache_similar", 0), events.get("cache_miss", 0)))
+        return "\n".join(rows)
+
+
+def _stat(name, value) -> None:
+    """Add a sample to _chat_stats once start() made it"""
+    if _chat_stats is not None:
+        _chat_stats.add(name, value)
+
+
+def _count(name) -> None:
+    """Count an event in _chat_stats once start() made it"""
+    if _chat_stats is not None:
+        _chat_stats.count(name)
+
+
+def _mem_free() -> int:
+    """Free heap in bytes, 0 where gc can't tell (CPython)"""
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return 0
+
+
+class _HttpResponse:
+    """Minimal HTTP/1.1 response reader for chunked, sized and close-delimited bodies"""
+
+    def __init__(self, sock, poller, timeout=HTTP_TIMEOUT):
+        self._sock = sock
+        self._poller = poller
+        self._timeout = timeout  # Longest wait for server data, in seconds
+        self.status_code = 0
+        self.headers = {}
+        self.keep_alive = False  # Connection can be reused once the body is read
+        self._chunked = False
+        self._left = -1  # Bytes left in the body or current chunk, -1 until close
+        self._eof = False
+        self._raw = None  # _RawBody feeding _inflate for compressed bodies
+        self._inflate = None
+        self.received = 0  # Bytes read from the socket, head included
+
+    def wait(self):
+        """Yield until data can be read without blocking, raise OSError after the timeout"""
+        if self._raw is not None and self._raw.pending():
+            # Inflating can't tell if a read will block, so let a frame through first
+            yield
+            return
+        started = ticks_ms()
+        while not self._eof and not self._poller.poll(0):
+            if ticks_diff(ticks_ms(), started) > self._timeout * 1000:
+                raise OSError("Timed out waiting for server")
+            yield
+
+    def read_head(self):
+        """Read the status line and headers"""
+        line = self._sock.readline()
+        if not line:
+            raise OSError("Connection closed")
+        self.received += len(line)
+        self.status_code = int(line.split(None, 2)[1])
+        while True:
+            line = self._sock.readline()
+            self.received += len(line)
+            if not line or line == b"\r\n":
+                break
+            key, _, value = line.decode().partition(":")
+            self.headers[key.strip().lower()] = value.strip()
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            self._chunked = True
+            self._left = 0
+        elif "content-length" in self.headers:
+            self._left = int(self.headers["content-length"])
+            self._eof = self._left == 0
+        self.keep_alive = self._left >= 0 and self.headers.get("connection", "").lower() != "close"
+        encoding = self.headers.get("content-encoding", "").lower()
+        if encoding in ("gzip", "deflate") and not self._eof:
+            self._raw = _RawBody(self)
+            self._inflate = _inflater(self._raw, encoding)
+            if self._inflate is None:
+                raise OSError("Can't decode " + encoding)
+
+    def _fill(self):
+        """Make sure body bytes are pending, returns False at end of body"""
+        if self._eof:
+            return False
+        if self._chunked and self._left == 0:
+            size = int(self._sock.readline().split(b";")[0].strip().decode(), 16)
+            if size == 0:
+                # Skip trailers up to the final blank line
+                while True:
+                    line = self._sock.readline()
+                    if not line or line == b"\r\n":
+                        break
+                self._eof = True
+                return False
+            self._left = size
+        return True
+
+    def _consumed(self, count):
+        if self._left > 0:
+            self._left -= count
+            if self._left == 0:
+                if self._chunked:
+                    self._sock.readline()  # CRLF closing the chunk
+                else:
+                    self._eof = True
+
+    def read(self, size=512):
+        """
+        Read up to size body bytes, b"" at end of body. Compressed bodies are
+        inflated a line at a time, as servers flush whole lines (like
+        server-sent events) and may pause between them, so a read blocks
+        for at most one pause.
+        """
+        if self._inflate is None:
+            return self._read_raw(size)
+        data = self._inflate.readline(size)
+        if not data:
+            # Past the end of the compressed data, drain the rest of the body
+            while self._read_raw(size):
+                pass
+        return data
+
+    def _read_raw(self, size):
+        """Read up to size bytes of the body as sent"""
+        if not self._fill():
+            return b""
+        if self._left > 0:
+            size = min(size, self._left)
+        data = self._sock.read(size)
+        if not data:
+            self._eof = True
+            return b""
+        self.received += len(data)
+        self._consumed(len(data))
+        return data
+
+    def _read_raw_into(self, buf):
+        """Read body bytes as sent into buf, returns their count, 0 at end of body"""
+        if not self._fill():
+            return 0
+        size = len(buf)
+        if self._left > 0:
+            size = min(size, self._left)
+        count = self._sock.readinto(buf, size)
+        if not count:
+            self._eof = True
+            return 0
+        self.received += count
+        self._consumed(count)
+        return count
+
+
+class _RawBody(IOBase):
+    """The still compressed body of a _HttpResponse, as a stream for the inflater"""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self._data = _chat_raw_buf or bytearray(512)  # Read into, allocated once by start()
+        self._end = 0
+        self._pos = 0
+
+    def pending(self):
+        """Bytes read from the socket but not yet inflated"""
+        return self._end - self._pos
+
+    def readinto(self, buf):
+        if self._pos == self._end:
+            self._end = self._resp._read_raw_into(self._data)
+            self._pos = 0
+            if not self._end:
+                return 0
+        # The inflater mostly reads a byte at a time
+        if len(buf) == 1:
+            buf[0] = self._data[self._pos]
+            self._pos += 1
+            return 1
+        count = min(len(buf), self._end - self._pos)
+        buf[:count] = memoryview(self._data)[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+
+def _inflater(raw, encoding):
+    """Stream inflating raw (gzip or deflate), None if the firmware can't"""
+    try:
+        import deflate
+
+        return deflate.DeflateIO(raw, deflate.GZIP if encoding == "gzip" else deflate.ZLIB)
+    except ImportError:
+        pass
+    try:
+        import zlib
+
+        return zlib.DecompIO(raw, 31 if encoding == "gzip" else 15)
+    except (ImportError, AttributeError):
+        return None
+
+
+def _can_inflate() -> bool:
+    """True if the firmware has deflate (or the older zlib.DecompIO)"""
+    try:
+        import deflate
+
+        return True
+    except ImportError:
+        pass
+    try:
+        import zlib
+
+        return hasattr(zlib, "DecompIO")
+    except ImportError:
+        return False
+
+
+class _BodyBuffer:
+    """
+    Growable byte buffer reused for every request body. Space is kept in front
+    of the body so the request head can be placed there and both sent in one
+    write without copying the body.
+    """
+
+    def __init__(self, size=1024):
+        self.buf = bytearray(BODY_HEADROOM + size)
+        self.end = BODY_HEADROOM
+        self.prompt_end = BODY_HEADROOM  # End of the prompt, before options like stream
+
+    def reset(self):
+        self.end = BODY_HEADROOM
+        self.prompt_end = BODY_HEADROOM
+
+    def __len__(self):
+        return self.end - BODY_HEADROOM
+
+    def write(self, data):
+        end = self.end + len(data)
+        if end > len(self.buf):
+            grown = bytearray(max(end, 2 * len(self.buf)))
+            grown[:self.end] = memoryview(self.buf)[:self.end]
+            self.buf = grown
+        self.buf[self.end:end] = data
+        self.end = end
+
+    def body(self):
+        return memoryview(self.buf)[BODY_HEADROOM:self.end]
+
+    def prompt(self):
+        """The model and messages part of the body, identical for the same prompt"""
+        return memoryview(self.buf)[BODY_HEADROOM:self.prompt_end]
+
+    def with_head(self, head):
+        """Place head right before the body and return both as one buffer"""
+        start = BODY_HEADROOM - len(head)
+        if start < 0:
+            return head + self.body()
+        self.buf[start:BODY_HEADROOM] = head
+        return memoryview(self.buf)[start:self.end]
+
+
+class _HttpSession:
+    """
+    Keep-alive HTTP/1.1 connection to one host, reused across requests.
+    The socket is reopened on demand after the server closes it or an error.
+    """
+
+    def __init__(self, url):
+        proto, _, host = url.split("/", 3)[:3]
+        self.origin = proto + "//" + host
+        self.tls = proto == "https:"
+        self.port = 443 if self.tls else 80
+        if ":" in host:
+            host, port = host.split(":", 1)
+            self.port = int(port)
+        self.host = host
+        self.reused = False  # Last open() returned an already connected socket
+        self.inflates = HTTP_COMPRESSION and _can_inflate()
+        self.compress = self.inflates  # Ask for a compressed body, turned off when the heap is short
+        self._sock = None
+        self._poller = None
+
+    def open(self, timeout=HTTP_TIMEOUT):
+        """Connect if needed (DNS, TCP and TLS block for up to timeout seconds each)"""
+        if self._sock is not None and self._poller.poll(0):
+            # An idle keep-alive socket only turns readable when the server closed it
+            self.close()
+        self.reused = self._sock is not None
+        if self._sock is not None:
+            self._sock.settimeout(timeout)
+            return
+
+        import usocket as socket
+        import uselect as select
+
+        started = ticks_us()
+        addr = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0]
+        resolved = ticks_us()
+        _stat("dns", ticks_diff(resolved, started))
+        sock = socket.socket(addr[0], socket.SOCK_STREAM, addr[2])
+        try:
+            sock.settimeout(timeout)
+            sock.connect(addr[-1])
+            connected = ticks_us()
+            _stat("connect", ticks_diff(connected, resolved))
+            if self.tls:
+                import ussl as ssl
+                sock = ssl.wrap_socket(sock, server_hostname=self.host)
+                _stat("tls", ticks_diff(ticks_us(), connected))
+        except:
+            sock.close()
+            raise
+        self._sock = sock
+        self._poller = select.poll()
+        self._poller.register(sock, select.POLLIN)
+
+    def reserve(self):
+        """Heap a request needs besides its reply: the inflate window and, to connect, TLS buffers"""
+        return (INFLATE_WINDOW if self.compress else 0) + (TLS_RESERVE if self.tls and self._sock is None else 0)
+
+    def send(self, path, headers, body, method="POST", timeout=HTTP_TIMEOUT):
+        """Write a request with body (bytes or _BodyBuffer) and return its response reader"""
+        head = "{} /{} HTTP/1.1\r\nHost: {}\r\n".format(method, path, self.host)
+        for key in headers:
+            head += "{}: {}\r\n".format(key, headers[key])
+        if self.compress:
+            head += "Accept-Encoding: gzip, deflate\r\n"
+        head += "Content-Length: {}\r\nConnection: keep-alive\r\n\r\n".format(len(body))
+        head = head.encode()
+        # One write, a separate small body write stalls on Nagle and delayed ACKs
+        started = ticks_us()
+        if isinstance(body, _BodyBuffer):
+            self._sock.write(body.with_head(head))
+        else:
+            self._sock.write(head + body)
+        _stat("write", ticks_diff(ticks_us(), started))
+        _stat("sent", len(head) + len(body))
+        return _HttpResponse(self._sock, self._poller, timeout)
+
+    def release(self, resp):
+        """Keep the connection for the next request only if resp was read to the end"""
+        _stat("recv", resp.received)
+        if not (resp.keep_alive and resp._eof):
+            self.close()
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except:
+                pass
+            self._sock = None
+            self._poller = None
+
+
+def _get_session(url):
+    """Return the shared session for the host in url, replacing one for another host"""
+    global _chat_session
+    if _chat_session is None or not (url + "/").startswith(_chat_session.origin + "/"):
+        _close_session()
+        _chat_session = _HttpSession(url)
+    return _chat_session
+
+
+def _close_session() -> None:
+    """Close the shared keep-alive connection"""
+    global _chat_session
+    if _chat_session is not None:
+        _chat_session.close()
+        _chat_session = None
+
+
+# _JsonPicker scanner states
+_J_VALUE = 0  # Expecting a value (or "]" in an empty array)
+_J_KEY = 1  # Expecting a key (or "}" in an empty object)
+_J_COLON = 2  # Expecting ":" after a key
+_J_NEXT = 3  # Expecting "," or a closing bracket after a value
+_J_STR = 4  # Inside a string value
+_J_KEYSTR = 5  # Inside a key
+_J_LIT = 6  # Inside a number, true, false or null
+
+# Fields kept from response bodies, per backend
+_CHAT_FIELDS = {
+    ("choices", 0, "message", "content"): "content",
+    ("choices", 0, "finish_reason"): "finish_reason",
+    ("usage",): "usage",
+    ("error", "message"): "error",
+    ("error", "code"): "error_code",
+}
+_RESPONSES_FIELDS = {
+    ("output", 0, "content", 0, "text"): "content",
+    ("output", 1, "content", 0, "text"): "content",  # After a reasoning item
+    ("status",): "finish_reason",
+    ("usage",): "usage",
+    ("error", "message"): "error",
+    ("error", "code"): "error_code",
+}
+_GATEWAY_FIELDS = {
+    ("content",): "content",
+    ("finish_reason",): "finish_reason",
+    ("usage",): "usage",
+    ("error", "message"): "error",
+    ("error", "code"): "error_code",
+}
+_MODEL_FIELDS = {
+    ("id",): "id",
+    ("data", 0, "id"): "first",
+    ("error", "message"): "error",
+    ("error", "code"): "error_code",
+}
+
+
+class _JsonPicker:
+    """
+    Incremental JSON scanner that keeps only the values found at given paths.
+    Feed it a body chunk by chunk, everything else is skipped without being
+    built into objects, so memory is bounded by the picked values.
+    Paths are tuples of keys and array indices mapped to names in found.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.found = {}
+        self._mode = _J_VALUE
+        self._stack = []  # Open containers, "{" or "["
+        self._path = []  # Current key or index in each open container
+        self._esc = False  # Previous string byte was a backslash
+        self._key = None  # Raw bytes of the key being read
+        self._cap = None  # Raw bytes of the value being picked
+        self._cap_name = None
+        self._cap_depth = 0
+
+    def _start_value(self, data, i):
+        name = self.paths.get(tuple(self._path))
+        if name is not None:
+            self._cap = bytearray()
+            self._cap_name = name
+            self._cap_depth = len(self._stack)
+            return i
+        return -1
+
+    def _end_value(self, data, cap_from, end):
+        """A value ended at end (exclusive), finish a capture of it"""
+        self._mode = _J_NEXT
+        if self._cap is not None and len(self._stack) == self._cap_depth:
+            self._cap += data[cap_from:end]
+            self.found[self._cap_name] = json.loads(bytes(self._cap).decode("utf-8"))
+            self._cap = None
+
+    def feed(self, data):
+        i = 0
+        n = len(data)
+        cap_from = 0
+        while i < n:
+            mode = self._mode
+            if mode == _J_STR or mode == _J_KEYSTR:
+                start = i
+                if self._esc:
+                    self._esc = False
+                    i += 1
+                else:
+                    quote = data.find(b'"', i)
+                    slash = data.find(b"\\", i)
+                    if slash >= 0 and (quote < 0 or slash < quote):
+                        self._esc = True
+                        i = slash + 1
+                    elif quote < 0:
+                        i = n
+                    else:
+                        i = quote
+                        if mode == _J_KEYSTR:
+                            self._key += data[start:i]
+                            self._path[-1] = bytes(self._key).decode("utf-8")
+                            self._key = None
+                            self._mode = _J_COLON
+                        else:
+                            self._end_value(data, cap_from, i + 1)
+                        i += 1
+                        continue
+                if mode == _J_KEYSTR:
+                    self._key += data[start:i]
+                continue
+
+            c = data[i]
+            if c == 0x20 or c == 0x0A or c == 0x0D or c == 0x09:
+                i += 1
+                continue
+
+            if mode == _J_LIT:
+                if c == 0x2C or c == 0x7D or c == 0x5D:
+                    self._end_value(data, cap_from, i)
+                else:
+                    i += 1
+                continue
+
+            if mode == _J_VALUE or mode == _J_KEY:
+                if c == 0x5D or c == 0x7D:  # "]" or "}" closing an empty container
+                    mode = _J_NEXT  # Closed below
+                elif mode == _J_KEY:
+                    if c != 0x22:
+                        raise ValueError("Bad JSON key at byte {}".format(i))
+                    self._key = bytearray()
+                    self._mode = _J_KEYSTR
+                    i += 1
+                    continue
+                else:
+                    start = self._start_value(data, i)
+                    if start >= 0:
+                        cap_from = start
+                    if c == 0x7B or c == 0x5B:  # "{" or "["
+                        self._stack.append(c)
+                        self._path.append(None if c == 0x7B else 0)
+                        self._mode = _J_KEY if c == 0x7B else _J_VALUE
+                    elif c == 0x22:
+                        self._mode = _J_STR
+                    else:
+                        self._mode = _J_LIT
+                    i += 1
+                    continue
+
+            if mode == _J_COLON:
+                if c != 0x3A:
+                    raise ValueError("Bad JSON, expected ':' at byte {}".format(i))
+                self._mode = _J_VALUE
+                i += 1
+                continue
+
+            # _J_NEXT
+            if c == 0x2C:  # ","
+                if not self._stack:
+                    raise ValueError("Bad JSON, stray ',' at byte {}".format(i))
+                if self._stack[-1] == 0x7B:
+                    self._mode = _J_KEY
+                else:
+                    self._path[-1] += 1
+                    self._mode = _J_VALUE
+            elif c == 0x7D or c == 0x5D:
+                if not self._stack:
+                    raise ValueError("Bad JSON, stray bracket at byte {}".format(i))
+                self._stack.pop()
+                self._path.pop()
+                self._end_value(data, cap_from, i + 1)
+            else:
+                raise ValueError("Bad JSON at byte {}".format(i))
+            i += 1
+
+        if self._cap is not None:
+            self._cap += data[cap_from:n]
+
+
+def _read_reply_fields(resp, fields=_CHAT_FIELDS):
+    """Scan a JSON body chunk by chunk, returning only the values of fields"""
+    global _chat_parse_us
+    picker = _JsonPicker(fields)
+    while True:
+        yield from resp.wait()
+        data = resp.read()
+        if not data:
+            break
+        started = ticks_us()
+        picker.feed(data)
+        _chat_parse_us += ticks_diff(ticks_us(), started)
+    return picker.found
+
+
+class _ChatBackend:
+    """
+    /chat/completions, spoken by OpenAI and by OpenAI-compatible servers like
+    llama.cpp, Ollama, LM Studio and vLLM
+    """
+
+    name = "chat"
+    path = "chat/completions"
+    fields = _CHAT_FIELDS  # Reply fields of a plain response
+    stream_opts = b',"stream":true,"stream_options":{"include_usage":true}'
+    max_field = b',"max_tokens":'
+    _messages = "messages"
+
+    def __init__(self, model):
+        self.model = model
+        # OpenAI's newer models only take max_completion_tokens, other servers know max_tokens
+        if self.name == "chat" and API_BASE.startswith("https://api.openai.com/"):
+            self.max_field = b',"max_completion_tokens":'
+        # Request bodies always start with the model and system message, encode them once
+        self.prefix = (
+            '{"model":' + json.dumps(model) + ',"' + self._messages
+            + '":[{"role":"system","content":' + json.dumps(SYSTEM_INSTRUCTION) + "}"
+        ).encode()
+
+    def probe_body(self):
+        """Smallest request that shows the endpoint works"""
+        return self.prefix + b',{"role":"user","content":"hi"}],"max_tokens":1}'
+
+    def delta(self, event):
+        """Reply text in a streamed event, if any"""
+        if "error" in event:
+            raise RuntimeError("Stream error: {}".format(event["error"].get("message")))
+        choices = event.get("choices")
+        if choices:
+            return choices[0].get("delta", {}).get("content")
+
+    def usage(self, event):
+        """Token usage in a streamed event, if any"""
+        return event.get("usage")
+
+    def finish(self, event):
+        """Why the reply ended, in a streamed event that says so"""
+        choices = event.get("choices")
+        if choices:
+            return choices[0].get("finish_reason")
+
+
+class _ResponsesBackend(_ChatBackend):
+    """/responses, OpenAI's newer API, taking the same messages under "input" """
+
+    name = "responses"
+    path = "responses"
+    fields = _RESPONSES_FIELDS
+    stream_opts = b',"stream":true'  # Usage always comes with response.completed (or .incomplete)
+    max_field = b',"max_output_tokens":'
+    _messages = "input"
+
+    def probe_body(self):
+        return self.prefix + b',{"role":"user","content":"hi"}],"max_output_tokens":16}'
+
+    def delta(self, event):
+        kind = event.get("type")
+        if kind == "response.output_text.delta":
+            return event.get("delta")
+        if kind == "error":
+            raise RuntimeError("Stream error: {}".format(event.get("message")))
+        if kind == "response.failed":
+            error = event.get("response", {}).get("error") or {}
+            raise RuntimeError("Stream error: {}".format(error.get("message")))
+
+    def usage(self, event):
+        if event.get("type") in ("response.completed", "response.incomplete"):
+            return event.get("response", {}).get("usage")
+
+    def finish(self, event):
+        if event.get("type") in ("response.completed", "response.incomplete"):
+            return event.get("response", {}).get("status")
+
+
+def _note_usage(usage) -> None:
+    """Log a reply's token usage, cached prompt tokens included, and add it to _chat_tokens"""
+    if not usage:
+        return
+    # chat/completions and responses name the same counts differently
+    prompt = usage.get("prompt_tokens", usage.get("input_tokens")) or 0
+    completion = usage.get("completion_tokens", usage.get("output_tokens")) or 0
+    details = usage.get("prompt_tokens_details") or usage.get("input_tokens_details") or {}
+    cached = details.get("cached_tokens") or 0
+    _chat_tokens["prompt"] += prompt
+    _chat_tokens["cached"] += cached
+    _chat_tokens["completion"] += completion
+    log_info(f"USAGE: prompt={prompt} cached={cached} completion={completion} (cached {_chat_tokens['cached']} of {_chat_tokens['prompt']} since start)")
+
+
+class _GatewayBackend(_ChatBackend):
+    """
+    gateway.py on the LAN, which keeps the API key and the TLS connections
+    to the API. It takes chat/completions requests over plain HTTP and
+    answers with just the reply text, already wrapped for the reply view.
+    """
+
+    name = "gateway"
+    path = "picogpt/chat"
+    fields = _GATEWAY_FIELDS
+    stream_opts = b',"stream":true'  # The gateway always asks for usage
+
+    def __init__(self, model):
+        super().__init__(model)
+        if _chat_screen_cols:
+            # The reply's first line starts after "AI: "
+            self.path += "?cols={}&col=4".format(_chat_screen_cols)
+
+    def delta(self, event):
+        if "error" in event:
+            raise RuntimeError("Stream error: {}".format(event["error"].get("message")))
+        return event.get("delta")
+
+    def finish(self, event):
+        return event.get("finish_reason")
+
+
+_BACKENDS = {"chat": _ChatBackend, "responses": _ResponsesBackend, "gateway": _GatewayBackend}
+_CUT_SHORT = ("length", "incomplete")  # finish_reason (or /responses status) of a reply ended by max_tokens
+
+
+def _api_path(path):
+    """Request path of path under API_BASE, without the leading slash"""
+    parts = API_BASE.rstrip("/").split("/", 3)
+    return (parts[3] + "/" if len(parts) > 3 else "") + path
+
+
+def _probe_request(session, method, path, body, fields):
+    """One probe request, returns its status and the picked fields. Generator."""
+    resp = None
+    try:
+        session.open()
+        yield
+        resp = session.send(path, HEADERS, body, method)
+        yield from resp.wait()
+        resp.read_head()
+        try:
+            found = yield from _read_reply_fields(resp, fields)
+        except ValueError:
+            found = {}  # Not JSON, like a plain 404 page
+        return resp.status_code, found
+    finally:
+        if resp is not None:
+            session.release(resp)
+
+
+def _probe_backend():
+    """
+    Find out which API API_BASE speaks and, on self-hosted servers, which
+    model to ask for. The answer is kept in BACKEND_CACHE so this only runs
+    once per API_BASE and OPENAI_MODEL. Generator, returns the backend.
+    """
+    try:
+        with open(BACKEND_CACHE) as f:
+            saved = json.loads(f.read())
+        if saved["base"] == API_BASE and saved["wanted"] == OPENAI_MODEL:
+            return _BACKENDS[saved["backend"]](saved["model"])
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    log_info(f"PROBE: Detecting the API at {API_BASE}")
+    session = _get_session(API_BASE)
+    model = OPENAI_MODEL
+    if not API_BASE.startswith("https://api.openai.com/"):
+        # Self-hosted servers only have the models they were given, fall back to their first
+        status, found = yield from _probe_request(session, "GET", _api_path("models/" + model), b"", _MODEL_FIELDS)
+        if status != 200:
+            status, found = yield from _probe_request(session, "GET", _api_path("models"), b"", _MODEL_FIELDS)
+            if status == 200 and found.get("first"):
+                model = found["first"]
+                log_warn(f"PROBE: {OPENAI_MODEL} isn't served, using {model}")
+    
+    # Only 404/405 mean the endpoint is missing, a 400 or a busy server still show it's there
+    names = ("chat", "responses")
+    if not API_BASE.startswith("https://"):
+        names = ("gateway",) + names  # gateway.py only speaks plain HTTP
+    for name in names:
+        backend = _BACKENDS[name](model)
+        status, found = yield from _probe_request(session, "POST", _api_path(backend.path), backend.probe_body(), backend.fields)
+        log_info(f"PROBE: {backend.path} answered {status}")
+        if status in (401, 403):
+            raise HttpError(status, found.get("error") or "Probe failed", found.get("error_code"))
+        if status not in (404, 405):
+            break
+    else:
+        raise RuntimeError("No chat/completions or responses API at " + API_BASE)
+    
+    # Probe again next start if the answer was only a busy server's
+    if status == 429 or status >= 500:
+        return backend
+    try:
+        with open(BACKEND_CACHE, "w") as f:
+            f.write(json.dumps({"base": API_BASE, "wanted": OPENAI_MODEL, "backend": backend.name, "model": model}))
+    except OSError as e:
+        log_warn(f"PROBE: Could not save {BACKEND_CACHE}: {e}")
+    return backend
+
+
+def _get_backend():
+    """The backend for API_BASE, probed on first use with API_BACKEND "auto". Generator."""
+    global _chat_backend
+    if _chat_backend is None:
+        if API_BACKEND == "auto":
+            _chat_backend = yield from _probe_backend()
+        else:
+            _chat_backend = _BACKENDS[API_BACKEND](OPENAI_MODEL)
+        log_info(f"BACKEND: {_chat_backend.path} at {API_BASE}, model {_chat_backend.model}")
+    return _chat_backend
+
+
+def _encode_request(backend, history, user_text, stream, max_tokens=0):
+    """
+    Encode a request body for backend with a _History plus user_text into
+    the shared _BodyBuffer in a single pass, only user_text is JSON-escaped.
+    A max_tokens of 0 leaves the reply length to the server.
+    """
+    global _chat_body
+    if _chat_body is None:
+        _chat_body = _BodyBuffer(BODY_BUFFER_BYTES)
+    body = _chat_body
+    body.reset()
+    body.write(backend.prefix)
+    if history:
+        history.write_to(body)
+    body.write(_BODY_ROLES["user"])
+    body.write(json.dumps(user_text).encode())
+    body.prompt_end = body.end
+    body.write(b"}]")
+    if max_tokens:
+        body.write(backend.max_field)
+        body.write(str(max_tokens).encode())
+    if stream:
+        body.write(backend.stream_opts)
+    body.write(b"}")
+    return body
+
+
+class _ResponseCache:
+    """
+    Replies kept on flash, one file per prompt hash under CACHE_DIR. The
+    index (hash -> [size, created, last used]) is held in RAM and saved to
+    CACHE_DIR/index.json, entries are evicted least recently used first.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._bytes = 0
+        self._clock = 0  # Use counter for LRU order, independent of the RTC
+        self._dirty = False
+
+    def _load(self):
+        import uos as os
+
+        self._index = {}
+        try:
+            os.mkdir(CACHE_DIR)
+        except OSError:
+            pass
+        try:
+            with open(CACHE_DIR + "/index.json") as f:
+                self._index = json.loads(f.read())
+        except:
+            pass
+        # Drop entries whose file is gone and files the index doesn't know
+        names = [name for name in os.listdir(CACHE_DIR) if not name.endswith(".json")]
+        for key in list(self._index):
+            if key not in names:
+                del self._index[key]
+        for name in names:
+            if name not in self._index:
+                try:
+                    os.remove(CACHE_DIR + "/" + name)
+                except OSError:
+                    pass
+        self._bytes = 0
+        for key in self._index:
+            entry = self._index[key]
+            self._bytes += entry[0]
+            self._clock = max(self._clock, entry[2])
+
+    @staticmethod
+    def key(prompt):
+        """Short hex hash of the prompt bytes"""
+        import uhashlib
+        import ubinascii
+
+        return ubinascii.hexlify(uhashlib.sha256(prompt).digest()[:10]).decode()
+
+    def get(self, key):
+        """Return the cached reply for key or None"""
+        if self._index is None:
+            self._load()
+        entry = self._index.get(key)
+        if entry is not None and CACHE_TTL and utime.time() - entry[1] > CACHE_TTL:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            return None
+        try:
+            with open(CACHE_DIR + "/" + key, "rb") as f:
+                reply = f.read().decode("utf-8")
+        except OSError:
+            self._remove(key)
+            return None
+        self._clock += 1
+        entry[2] = self._clock
+        self._dirty = True
+        return reply
+
+    def put(self, key, reply):
+        """Store reply for key, evicting old entries to stay under CACHE_MAX_BYTES"""
+        if self._index is None:
+            self._load()
+        data = reply.encode("utf-8")
+        if len(data) > CACHE_MAX_BYTES:
+            return
+        if key in self._index:
+            self._remove(key)
+        while self._index and self._bytes + len(data) > CACHE_MAX_BYTES:
+            oldest = None
+            for name in self._index:
+                if oldest is None or self._index[name][2] < self._index[oldest][2]:
+                    oldest = name
+            self._remove(oldest)
+        try:
+            with open(CACHE_DIR + "/" + key, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            log_warn(f"CACHE: Write failed: {e}")
+            return
+        self._clock += 1
+        self._index[key] = [len(data), utime.time(), self._clock]
+        self._bytes += len(data)
+        self._dirty = True
+        self.save()
+
+    def _remove(self, key):
+        import uos as os
+
+        entry = self._index.pop(key)
+        self._bytes -= entry[0]
+        self._dirty = True
+        try:
+            os.remove(CACHE_DIR + "/" + key)
+        except OSError:
+            pass
+
+    def save(self):
+        """Write the index if it changed"""
+        if not self._dirty:
+            return
+        try:
+            with open(CACHE_DIR + "/index.json", "w") as f:
+                f.write(json.dumps(self._index))
+            self._dirty = False
+        except OSError as e:
+            log_warn(f"CACHE: Index write failed: {e}")
+
+
+def _get_cache():
+    global _chat_cache
+    if _chat_cache is None:
+        _chat_cache = _ResponseCache()
+    return _chat_cache
+
+
+# Words written differently that mean the same, after dropping apostrophes
+_SIMILAR_WORDS = {
+    "whats": "what is", "hows": "how is", "whos": "who is", "wheres": "where is",
+    "whens": "when is", "whys": "why is", "im": "i am", "u": "you", "r": "are",
+    "isnt": "is not", "arent": "are not", "dont": "do not", "doesnt": "does not",
+    "cant": "can not", "cannot": "can not", "wont": "will not", "wasnt": "was not",
+    "didnt": "did not", "shouldnt": "should not",
+    "a": "", "an": "", "the": "", "please": "", "pls": "", "plz": "",
+}
+# Words that change nothing a question asks, like "is" in "what are cats"/"what is cat"
+_SIMILAR_FILLER = ("is", "are", "am", "do", "does")
+
+
+def _normalize_question(text):
+    """Lower case words without punctuation, so "Whats 2 + 2" reads like "What is 2+2?" """
+    words = []
+    word = ""
+    for c in text.lower() + " ":
+        if c.isalpha() or c.isdigit():
+            word += c
+        elif c != "'":
+            if word:
+                word = _SIMILAR_WORDS.get(word, word)
+                if word:
+                    words.append(word)
+                word = ""
+    return " ".join(words)[:96]
+
+
+def _content_words(normalized):
+    """
+    Words of a normalized question that carry its meaning, in order and
+    plurals folded. Questions alike in trigrams but not in these ask
+    something else: a number, "not", "ii" for "i" or the order changed.
+    """
+    words = []
+    for word in normalized.split():
+        if word not in _SIMILAR_FILLER:
+            if len(word) > 3 and word[-1] == "s" and word[-2] != "s":
+                word = word[:-1]
+            words.append(word)
+    return words
+
+
+class _SimilarIndex:
+    """
+    Cached questions indexed by hashed character trigrams of their
+    normalized text, to answer a question worded like an earlier one from
+    the _ResponseCache. The inverted index is one bitmask of entry slots
+    per trigram bucket, so it takes 4KB whatever is in it and a lookup
+    only touches the query's own buckets. Entries point at cache keys, with
+    the hash of the model and system prompt they were answered under, and
+    are kept in CACHE_DIR/similar.json.
+    """
+
+    BUCKETS = 1024
+
+    def __init__(self):
+        self._entries = None  # Per slot [question, cache key, last used, prefix key] or None
+        self._postings = None  # Bitmask of slots per trigram bucket
+        self._sizes = None  # Distinct trigrams per slot
+        self._clock = 0
+        self._dirty = False
+
+    def _load(self):
+        from array import array
+
+        self._entries = [None] * min(SIMILAR_MAX_ENTRIES, 30)  # Masks stay small ints
+        self._postings = array("I", [0] * self.BUCKETS)
+        self._sizes = bytearray(len(self._entries))
+        try:
+            with open(CACHE_DIR + "/similar.json") as f:
+                saved = json.loads(f.read())
+        except:
+            saved = []
+        for entry in saved[:len(self._entries)]:
+            if len(entry) < 4:
+                continue  # Saved before entries had their prefix
+            self._insert(self._free_slot(), entry)
+            self._clock = max(self._clock, entry[2])
+
+    def _grams(self, normalized):
+        """Trigram buckets of normalized text, spaces around it so word edges count"""
+        data = (" " + normalized + " ").encode()
+        grams = set()
+        for i in range(len(data) - 2):
+            grams.add(((data[i] * 31 + data[i + 1]) * 31 + data[i + 2]) % self.BUCKETS)
+        return grams
+
+    def _insert(self, slot, entry):
+        grams = self._grams(_normalize_question(entry[0]))
+        bit = 1 << slot
+        for gram in grams:
+            self._postings[gram] |= bit
+        self._sizes[slot] = min(len(grams), 255)
+        self._entries[slot] = entry
+
+    def _remove(self, slot):
+        keep = ~(1 << slot)
+        for gram in self._grams(_normalize_question(self._entries[slot][0])):
+            self._postings[gram] &= keep
+        self._entries[slot] = None
+        self._dirty = True
+
+    def _free_slot(self):
+        """An empty slot, evicting the least recently used entry if there is none"""
+        oldest = 0
+        for slot in range(len(self._entries)):
+            entry = self._entries[slot]
+            if entry is None:
+                return slot
+            if entry[2] < self._entries[oldest][2]:
+                oldest = slot
+        self._remove(oldest)
+        return oldest
+
+    def find(self, question, prefix):
+        """
+        (cache key, question, percent alike) of the closest entry asked under
+        prefix past SIMILAR_THRESHOLD with the same content words, or None
+        """
+        if self._entries is None:
+            self._load()
+        normalized = _normalize_question(question)
+        if len(normalized) < SIMILAR_MIN_CHARS:
+            return None
+        grams = self._grams(normalized)
+        # Count the trigrams each entry shares with the question, one set bit at a time
+        counts = bytearray(len(self._entries))
+        postings = self._postings
+        for gram in grams:
+            mask = postings[gram]
+            while mask:
+                low = mask & -mask
+                counts[_SLOT_OF_BIT[low]] += 1
+                mask ^= low
+        # Cosine of the trigram sets, compared squared to skip the root. A
+        # changed word barely changes the trigrams but does the answer.
+        words = _content_words(normalized)
+        best = None
+        best_score = SIMILAR_THRESHOLD * SIMILAR_THRESHOLD
+        for slot in range(len(counts)):
+            shared = counts[slot]
+            if shared:
+                score = shared * shared / (len(grams) * self._sizes[slot])
+                entry = self._entries[slot]
+                if score >= best_score and entry[3] == prefix and _content_words(_normalize_question(entry[0])) == words:
+                    best, best_score = slot, score
+        if best is None:
+            return None
+        entry = self._entries[best]
+        self._clock += 1
+        entry[2] = self._clock
+        self._dirty = True
+        return entry[1], entry[0], int(best_score ** 0.5 * 100)
+
+    def add(self, question, key, prefix):
+        """Index question as answered by the cached reply under key, asked under prefix"""
+        if self._entries is None:
+            self._load()
+        if len(_normalize_question(question)) < SIMILAR_MIN_CHARS:
+            return
+        self._clock += 1
+        self._insert(self._free_slot(), [_clip(question, 80), key, self._clock, prefix])
+        self._dirty = True
+
+    def forget(self, key):
+        """Drop entries whose reply left the cache"""
+        for slot in range(len(self._entries)):
+            if self._entries[slot] is not None and self._entries[slot][1] == key:
+                self._remove(slot)
+
+    def save(self):
+        """Write the entries if they changed"""
+        if not self._dirty:
+            return
+        try:
+            with open(CACHE_DIR + "/similar.json", "w") as f:
+                f.write(json.dumps([entry for entry in self._entries if entry is not None]))
+            self._dirty = False
+        except OSError as e:
+            log_warn(f"CACHE: Similar index write failed: {e}")
+
+
+# Slot of each single-bit mask, for walking _SimilarIndex postings
+_SLOT_OF_BIT = {1 << slot: slot for slot in range(30)}
+
+
+def _get_similar():
+    global _chat_similar
+    if _chat_similar is None:
+        _chat_similar = _SimilarIndex()
+    return _chat_similar
+
+
+class _RequestQueue:
+    """
+    Questions waiting for the network, one JSON line each in QUEUE_PATH so
+    they survive a restart. Answered questions move with their answer (or
+    an error that waiting won't fix) to ANSWERS_PATH.
+    """
+
+    def __init__(self):
+        self.pending = []  # Questions, oldest first
+        clean = True
+        try:
+            with open(QUEUE_PATH) as f:
+                for line in f:
+                    try:
+                        self.pending.append(json.loads(line))
+                    except ValueError:
+                        clean = False  # Cut short by a power loss
+        except OSError:
+            pass
+        if not clean:
+            self._save()
+        # Count answers by their line ends, parsing them all would slow down start()
+        self.answers = 0
+        self._answer_bytes = 0
+        try:
+            with open(ANSWERS_PATH, "rb") as f:
+                while True:
+                    data = f.read(512)
+                    if not data:
+                        break
+                    self.answers += data.count(b"\n")
+                    self._answer_bytes += len(data)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _write_lines(path, lines):
+        """Replace path with lines, written to a temporary file first"""
+        import uos as os
+
+        with open(path + ".tmp", "w") as f:
+            for line in lines:
+                f.write(line)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        os.rename(path + ".tmp", path)
+
+    def _save(self):
+        import uos as os
+
+        try:
+            if self.pending:
+                self._write_lines(QUEUE_PATH, [json.dumps(q) + "\n" for q in self.pending])
+            else:
+                try:
+                    os.remove(QUEUE_PATH)
+                except OSError:
+                    pass
+        except OSError as e:
+            log_warn(f"QUEUE: Write failed: {e}")
+
+    def _read_answers(self):
+        entries = []
+        try:
+            with open(ANSWERS_PATH) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        pass
+        except OSError:
+            pass
+        return entries
+
+    def push(self, question):
+        """Add question to the end of the queue, raises OSError if flash can't take it"""
+        with open(QUEUE_PATH, "a") as f:
+            f.write(json.dumps(question) + "\n")
+        self.pending.append(question)
+
+    def done(self, reply=None, error=None):
+        """Move the oldest question to the answers with its reply or error"""
+        entry = {"q": self.pending[0]}
+        if error is None:
+            entry["a"] = reply
+        else:
+            entry["e"] = error
+        line = json.dumps(entry) + "\n"
+        try:
+            with open(ANSWERS_PATH, "a") as f:
+                f.write(line)
+            self.answers += 1
+            self._answer_bytes += len(line.encode())
+            if self._answer_bytes > ANSWERS_MAX_BYTES:
+                # Keep the newest answers within three quarters of the limit
+                lines = [json.dumps(e) + "\n" for e in self._read_answers()]
+                size = sum(len(l.encode()) for l in lines)
+                while lines and size > ANSWERS_MAX_BYTES * 3 // 4:
+                    size -= len(lines.pop(0).encode())
+                self._write_lines(ANSWERS_PATH, lines)
+                self.answers = len(lines)
+                self._answer_bytes = size
+        except OSError as e:
+            log_warn(f"QUEUE: Answer write failed: {e}")
+        self.pending.pop(0)
+        self._save()
+
+    def answers_text(self):
+        """All answers, newest first, for the answers view"""
+        parts = []
+        for entry in reversed(self._read_answers()):
+            if "a" in entry:
+                parts.append("You: {}\n\nAI: {}".format(entry.get("q"), entry["a"]))
+            else:
+                parts.append("You: {}\n\nFailed: {}".format(entry.get("q"), entry.get("e")))
+        return "\n\n----\n\n".join(parts) or "No answers yet"
+
+
+# _ChatLog index entry: log offset, conversation and role of a message, and a zero pad byte
+_LOG_ENTRY = "<IHBB"
+_LOG_ENTRY_SIZE = 8
+
+
+class _ChatLog:
+    """
+    Conversations kept across launches. Messages are appended to
+    CHAT_LOG_PATH as JSON lines and indexed in CHAT_LOG_PATH + ".idx" by
+    fixed-size entries, so any message is found with one seek and the
+    newest ones without reading the log. The index is written after the
+    log and rebuilt from it when they don't match, like after a power loss.
+    A history summary is logged as a system message with the number of
+    messages it kept, so a resumed conversation has it too.
+    """
+
+    def __init__(self):
+        self.path = CHAT_LOG_PATH
+        self.count = 0  # Messages in the log
+        self.conv = 0  # Conversation new messages go to
+        self._size = 0  # Bytes in the log
+        self._newline = True  # Log ends with a whole line
+        self._summary = None  # Last summary logged
+        self._open()
+
+    def _open(self):
+        """Find the size of the log and index, rebuilding the index if they don't match"""
+        import uos as os
+
+        try:
+            self._size = os.stat(self.path)[6]
+        except OSError:
+            self._size = 0
+        try:
+            index = os.stat(self.path + ".idx")[6]
+        except OSError:
+            index = 0
+        self.count = index // _LOG_ENTRY_SIZE
+        if index % _LOG_ENTRY_SIZE or not self._matches():
+            log_warn("CHAT LOG: Index doesn't match the log, rebuilding it")
+            self._rebuild()
+        if self.count:
+            self.conv = self.entries(self.count - 1, self.count)[0][1]
+
+    def entries(self, start, end):
+        """Index entries of messages start..end-1 as (offset, conversation, role)"""
+        import struct
+
+        if start >= end:
+            return []
+        with open(self.path + ".idx", "rb") as f:
+            f.seek(start * _LOG_ENTRY_SIZE)
+            data = f.read((end - start) * _LOG_ENTRY_SIZE)
+        return [struct.unpack_from(_LOG_ENTRY, data, i)[:3] for i in range(0, len(data) - _LOG_ENTRY_SIZE + 1, _LOG_ENTRY_SIZE)]
+
+    def _matches(self):
+        """True if the last index entry points at the last whole line of the log"""
+        if not self.count:
+            return self._size == 0
+        try:
+            offset = self.entries(self.count - 1, self.count)[0][0]
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                line = f.readline()
+        except (OSError, IndexError):
+            return False
+        return line.endswith(b"\n") and offset + len(line) == self._size
+
+    def _rebuild(self):
+        """Index the log again, skipping lines a power loss cut short"""
+        import struct
+
+        self.count = 0
+        offset = 0
+        try:
+            with open(self.path, "rb") as log, open(self.path + ".idx", "wb") as index:
+                while True:
+                    line = log.readline()
+                    if not line:
+                        break
+                    try:
+                        conv, role = json.loads(line.decode())[:2]
+                        index.write(struct.pack(_LOG_ENTRY, offset, conv, role, 0))
+                        self.count += 1
+                    except (ValueError, TypeError):
+                        pass
+                    offset += len(line)
+                    self._newline = line.endswith(b"\n")
+        except OSError:
+            self._size = 0
+            self._newline = True
+            self._remove()
+            return
+        self._size = offset
+
+    def _remove(self):
+        import uos as os
+
+        for name in (self.path, self.path + ".idx"):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    def append(self, role, text, kept=None):
+        """Add a message to the current conversation, compacting the log past CHAT_LOG_MAX_BYTES"""
+        import struct
+
+        code = _HISTORY_ROLES.index(role)
+        fields = [self.conv, code, text]
+        if kept is not None:
+            fields.append(kept)
+        line = (json.dumps(fields) + "\n").encode()
+        try:
+            with open(self.path, "ab") as f:
+                if not self._newline:
+                    # Finish a line cut short so this message starts its own
+                    f.write(b"\n")
+                    self._size += 1
+                    self._newline = True
+                f.write(line)
+            with open(self.path + ".idx", "ab") as f:
+                f.write(struct.pack(_LOG_ENTRY, self._size, self.conv, code, 0))
+        except OSError as e:
+            log_warn(f"CHAT LOG: Write failed: {e}")
+            try:
+                self._open()
+            except OSError:
+                pass
+            return
+        self._size += len(line)
+        self.count += 1
+        if self._size > CHAT_LOG_MAX_BYTES:
+            self._compact()
+
+    def read(self, start, end):
+        """Messages start..end-1 as (conversation, role, text), read in one pass from the first"""
+        messages = []
+        entries = self.entries(start, end)
+        if not entries:
+            return messages
+        with open(self.path, "rb") as f:
+            f.seek(entries[0][0])
+            for offset, conv, role in entries:
+                if f.tell() != offset:
+                    f.seek(offset)
+                try:
+                    messages.append((conv, _HISTORY_ROLES[role], json.loads(f.readline().decode())[2]))
+                except (ValueError, IndexError):
+                    pass
+        return messages
+
+    def _resume_point(self, entries):
+        """
+        (first, summary) indexes into entries, a stretch ending with the
+        newest message, of what restore needs: the messages the newest
+        summary of the current conversation kept, or else the conversation's
+        first message, and that summary (None without one)
+        """
+        first = len(entries)
+        for i in range(len(entries) - 1, -1, -1):
+            offset, conv, role = entries[i]
+            if conv != self.conv:
+                break
+            if role != 0:
+                first = i
+                continue
+            try:
+                with open(self.path, "rb") as f:
+                    f.seek(offset)
+                    kept = json.loads(f.readline().decode())[3]
+            except (OSError, ValueError, IndexError):
+                break
+            first = i
+            while kept and first and entries[first - 1][1] == self.conv:
+                first -= 1
+                if entries[first][2]:
+                    kept -= 1
+            return first, i
+        return first, None
+
+    def restore(self, history, target=HISTORY_TOKEN_BUDGET):
+        """
+        Fill a _History with the current conversation as it was: its newest
+        summary, the messages the summary kept and the messages after it,
+        compacted to target after each reply like the turns were
+        """
+        slots = len(history.roles)
+        # Compaction logs a new summary at least every slots messages
+        first = max(0, self.count - 2 * slots)
+        entries = self.entries(first, self.count)
+        start, summary = self._resume_point(entries)
+        if summary is None:
+            start = max(start, len(entries) - slots)
+            summary = start - 1
+        else:
+            fields = self.read(first + summary, first + summary + 1)
+            if not fields:
+                return
+            self._summary = fields[0][2]
+            history.append("system", self._summary)
+            kept = [(role, text) for conv, role, text in self.read(first + start, first + summary) if role != "system"]
+            for n in range(len(kept)):
+                role, text = kept[n]
+                # Replies older than the newest few were clipped before the summary was made
+                if role == "assistant" and n < len(kept) - HISTORY_KEEP_FULL:
+                    text = _clip(text, HISTORY_CLIP_CHARS)
+                history.append(role, text)
+        for conv, role, text in self.read(first + summary + 1, self.count):
+            history.append(role, text)
+            if role == "assistant":
+                _compact_history(history, target)
+
+    def save_summary(self, history):
+        """Log the summary at the front of history if it changed since last logged"""
+        if history and history.role(0) == "system":
+            summary = history.text(0)
+            if summary != self._summary:
+                self._summary = summary
+                self.append("system", summary, len(history) - 1)
+
+    def new_conversation(self):
+        """Send the next messages to a new conversation, unless the current one is still empty"""
+        self._summary = None
+        if self.count and self.entries(self.count - 1, self.count)[0][1] == self.conv:
+            self.conv = (self.conv + 1) & 0xFFFF
+
+    def _compact(self):
+        """
+        Drop the oldest messages until the log fits half of CHAT_LOG_MAX_BYTES,
+        short of those restore needs to resume the current conversation
+        """
+        import struct
+        import uos as os
+
+        entries = self.entries(0, self.count)
+        # Never past what restore needs to resume the current conversation
+        needed = self._resume_point(entries)[0]
+        first = 0
+        while first < min(needed, len(entries) - 1) and self._size - entries[first][0] > CHAT_LOG_MAX_BYTES // 2:
+            first += 1
+        if not first:
+            return
+        cut = entries[first][0]
+        try:
+            # The kept messages are copied as they are, without parsing them
+            with open(self.path, "rb") as src, open(self.path + ".tmp", "wb") as dst:
+                src.seek(cut)
+                while True:
+                    data = src.read(512)
+                    if not data:
+                        break
+                    dst.write(data)
+            with open(self.path + ".idx.tmp", "wb") as f:
+                for offset, conv, role in entries[first:]:
+                    f.write(struct.pack(_LOG_ENTRY, offset - cut, conv, role, 0))
+            for name in (self.path, self.path + ".idx"):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+                os.rename(name + ".tmp", name)
+        except OSError as e:
+            log_warn(f"CHAT LOG: Compaction failed: {e}")
+            return
+        log_info(f"CHAT LOG: Compacted {self._size} to {self._size - cut} bytes, {len(entries) - first} messages kept")
+        self._size -= cut
+        self.count -= first
+
+
+def _read_body(resp):
+    """Read the whole response body, yielding while the server is quiet"""
+    parts = []
+    while True:
+        yield from resp.wait()
+        data = resp.read()
+        if not data:
+            break
+        parts.append(data)
+    return b"".join(parts)
+
+
+def _read_stream_reply(resp, on_delta, backend):
+    """
+    Collect a streamed reply, passing each text delta backend finds to on_delta.
+    The body is read a chunk at a time (servers write each chunk whole, so this
+    never waits mid-event) and split into lines on raw bytes. Lines are only
+    decoded once complete, so multi-byte UTF-8 characters split across network
+    chunks are reassembled before decoding. Yields while waiting for data.
+    Sets _chat_finish from the event that says why the reply ended.
+    """
+    global _chat_parse_us, _chat_finish
+    parts = []
+    pending = b""
+    done = False
+    while not done:
+        yield from resp.wait()
+        data = resp.read()
+        if not data:
+            break
+        pending += data
+        while not done:
+            end = pending.find(b"\n")
+            if end < 0:
+                break
+            line = pending[:end].strip()
+            pending = pending[end + 1:]
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                done = True
+                break
+            started = ticks_us()
+            event = json.loads(data.decode("utf-8"))
+            text = backend.delta(event)
+            _chat_parse_us += ticks_diff(ticks_us(), started)
+            if text:
+                parts.append(text)
+                on_delta(text)
+            else:
+                _note_usage(backend.usage(event))
+                _chat_finish = backend.finish(event) or _chat_finish
+    # Drain the terminating chunk so the connection can be reused
+    yield from _read_body(resp)
+    return "".join(parts)
+
+
+class ApiUnreachable(RuntimeError):
+    """Raised without a request while the circuit breaker is open"""
+
+
+class LowMemory(MemoryError):
+    """Raised before a request when the heap can't hold even a short reply"""
+
+
+class HttpError(RuntimeError):
+    """Non-200 API response, with what's needed to decide on a retry"""
+
+    def __init__(self, status, message, code=None, retry_after=None):
+        super().__init__("HTTP {}: {}".format(status, message))
+        self.status = status
+        self.code = code  # error.code of the body, like "insufficient_quota"
+        self.retry_after = retry_after  # Seconds from the Retry-After header
+
 
+def _retryable(e) -> bool:
+    """True for errors that may go away: network trouble, rate limits and server errors"""
+    if isinstance(e, HttpError):
+        # Running out of quota is also a 429 but won't pass by waiting
+        return e.status in _RETRY_STATUSES and e.code != "insufficient_quota"
+    return isinstance(e, OSError)
 
-def log_error(error_msg):
-    """Log error to file for debugging"""
-    try:
-        with open("/error_log.txt", "a") as f:
-            from utime import localtime
-            try:
-                t = localtime()
-                timestamp = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
-                    t[0], t[1], t[2], t[3], t[4], t[5]
-                )
-            except:
-                timestamp = "unknown"
-            f.write(f"[{timestamp}] {error_msg}\n")
-    except:
-        pass  # Silently fail if logging doesn't work
+
+def _queueable(e) -> bool:
+    """True for failures worth queueing the question for, rather than showing"""
+    return _retryable(e) or isinstance(e, (ApiUnreachable, MemoryError))
+
+
+def _backoff_ms(retry, e) -> int:
+    """Delay before retry number retry: exponential with jitter, at least Retry-After"""
+    from random import getrandbits
+    
+    delay = min(RETRY_MAX_MS, RETRY_BASE_MS << (retry - 1))
+    delay = delay // 2 + delay // 2 * getrandbits(8) // 255
+    if isinstance(e, HttpError) and e.retry_after:
+        delay = max(delay, e.retry_after * 1000)
+    return delay
 
 
-def ask_model(user_text, history=None):
+def _fetch_with_retry(backend, body, on_delta=None):
     """
-    Send a prompt to the OpenAI API and return the reply.
-    Uses standard /v1/chat/completions endpoint.
+    _fetch_reply, retrying transient errors with backoff within
+    REQUEST_DEADLINE, which also bounds every network wait of an attempt.
+    Once BREAKER_FAILURES questions failed in a row new ones fail fast for
+    BREAKER_COOLDOWN seconds. Generator like _fetch_reply.
     """
-    # Build messages array (standard format)
-    messages = [{"role": "system", "content": SYSTEM_INSTRUCTION}]
-    
-    # Add recent conversation history if provided
-    if history and isinstance(history, list) and len(history) > 0:
-        recent = history[-6:] if len(history) > 6 else history
-        messages.extend(recent)
+    global _breaker_failures, _breaker_until
+    started = ticks_ms()
+    if _breaker_failures >= BREAKER_FAILURES and ticks_diff(_breaker_until, started) > 0:
+        wait = (ticks_diff(_breaker_until, started) + 999) // 1000
+        log_warn(f"RETRY: Failing fast, {_breaker_failures} questions failed in a row")
+        raise ApiUnreachable("API unreachable, try again in {}s".format(wait))
+    deadline = ticks_add(started, REQUEST_DEADLINE * 1000)
     
-    # Add current user message
-    messages.append({"role": "user", "content": user_text})
+    # Text already streamed to the screen can't be taken back, so no retry then
+    streamed = []
+    forward = None
+    if on_delta is not None:
+        def forward(text):
+            streamed.append(True)
+            on_delta(text)
     
-    # Construct payload (standard chat/completions format)
-    payload = {
-        "model": OPENAI_MODEL,
-        "messages": messages
-    }
-    
-    # Log the request details
-    try:
-        log_error(f"REQUEST: URL={API_URL}, Model={OPENAI_MODEL}")
-        log_error(f"REQUEST: Payload={json.dumps(payload)}")
-    except:
-        pass
+    attempt = 1
+    while True:
+        try:
+            reply = yield from _fetch_reply(backend, body, forward, deadline)
+            break
+        except Exception as e:
+            elapsed = ticks_diff(ticks_ms(), started)
+            delay = _backoff_ms(attempt, e)
+            retryable = _retryable(e)
+            if retryable and not streamed and attempt <= RETRY_ATTEMPTS and elapsed + delay <= REQUEST_DEADLINE * 1000:
+                log_warn(f"RETRY: Attempt {attempt} failed ({type(e).__name__}: {e}), retrying in {delay}ms")
+                until = ticks_add(ticks_ms(), delay)
+                while ticks_diff(until, ticks_ms()) > 0:
+                    yield
+                attempt += 1
+                continue
+            if attempt > 1:
+                log_error(f"RETRY: Giving up after {attempt} attempts in {elapsed}ms")
+            if retryable:
+                _breaker_failures += 1
+                if _breaker_failures >= BREAKER_FAILURES:
+                    _breaker_until = ticks_add(ticks_ms(), BREAKER_COOLDOWN * 1000)
+                    log_warn(f"RETRY: {_breaker_failures} questions failed in a row, failing fast for {BREAKER_COOLDOWN}s")
+            raise
     
-    # Send POST request
+    _breaker_failures = 0
+    if attempt > 1:
+        log_info(f"RETRY: Succeeded on attempt {attempt} after {ticks_diff(ticks_ms(), started)}ms")
+    return reply
+
+
+def _reply_budget(reserve=0) -> int:
+    """
+    max_tokens for the next reply: no more than REPLY_MAX_SCREENS screens
+    of the reply view show, or the heap past HEAP_RESERVE and reserve holds
+    """
+    tokens = REPLY_MAX_TOKENS
+    if _chat_screen_chars:
+        tokens = min(tokens, _chat_screen_chars * REPLY_MAX_SCREENS // 4)
+    gc.collect()
+    free = _mem_free()
+    if free:
+        tokens = min(tokens, (free - HEAP_RESERVE - reserve) // REPLY_HEAP_PER_TOKEN)
+    return tokens
+
+
+def _free_heap() -> None:
+    """Drop what is loaded again on demand, to make room for a reply"""
+    global _chat_cache, _chat_similar
+    if _chat_cache is not None:
+        _chat_cache.save()
+        _chat_cache = None
+    if _chat_similar is not None:
+        _chat_similar.save()
+        _chat_similar = None
+    gc.collect()
+
+
+def ask_model(user_text, history=None, on_delta=None):
+    """
+    Send a prompt to the OpenAI API and return the reply.
+    Uses the API found at API_BASE, see _get_backend.
+    If on_delta is given the reply is streamed and each text fragment is
+    passed to it as soon as it arrives.
+    If history (a _History) is given the exchange is added to it.
+    Transient failures are retried, see _fetch_with_retry.
+    Blocks until done, run() uses _ask_steps directly to stay responsive.
+    """
+    steps = _ask_steps(user_text, history, on_delta)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as e:
+            return e.value
+
+
+def _time_left(deadline) -> float:
+    """Socket timeout in seconds for the next step, HTTP_TIMEOUT at most"""
+    if deadline is None:
+        return HTTP_TIMEOUT
+    left = ticks_diff(deadline, ticks_ms())
+    if left <= 0:
+        raise OSError("Request deadline passed")
+    return min(HTTP_TIMEOUT, left / 1000)
+
+
+def _fetch_reply(backend, body, on_delta=None, deadline=None):
+    """
+    Send an encoded request body to backend under API_BASE and return the
+    reply text. Network waits end by deadline (ticks_ms) when given.
+    Failures are logged as warnings, the caller logs the one it gives up on.
+    Generator, yields while waiting on the network.
+    """
+    global _chat_parse_us, _chat_finish
     resp = None
+    _chat_finish = None
+    session = _get_session(API_BASE)
     try:
-        # urequests doesn't support json= parameter, need to use data= with json.dumps
-        # ujson.dumps returns a string
-        payload_str = json_dumps_safe(payload)
+        # Let a frame be drawn before a possibly blocking connect
+        yield
+        
+        # Send over the kept-alive connection, reconnecting once if it went stale
+        path = _api_path(backend.path)
+        while True:
+            session.open(_time_left(deadline))
+            yield
+            try:
+                resp = session.send(path, HEADERS, body, timeout=_time_left(deadline))
+                sent = ticks_us()
+                yield from resp.wait()
+                resp.read_head()
+                break
+            except OSError as e:
+                session.close()
+                if not session.reused:
+                    raise
+                log_warn(f"REQUEST: Reused connection failed ({e}), reconnecting")
         
-        # Log the actual JSON string to verify it's valid
-        log_error(f"REQUEST: Payload JSON string (len={len(payload_str)})")
-        log_error(f"REQUEST: First 300 chars: {payload_str[:300]}")
+        head = ticks_us()
+        _stat("ttfb", ticks_diff(head, sent))
+        _chat_parse_us = 0
+        log_info(f"RESPONSE: Status={resp.status_code}")
         
-        # Verify it's valid JSON by trying to parse it back
-        try:
-            test_parse = json.loads(payload_str)
-            log_error(f"REQUEST: JSON validation passed")
-        except Exception as parse_err:
-            log_error(f"REQUEST: JSON validation FAILED: {parse_err}")
-            log_error(f"REQUEST: Invalid JSON string: {payload_str}")
-            raise RuntimeError(f"Invalid JSON payload: {parse_err}")
+        # Check status code
+        if resp.status_code != 200:
+            error_text = (yield from _read_body(resp)).decode("utf-8")
+            log_warn(f"ERROR: Response text={error_text}")
+            # Show just error.message when the body is an API error object
+            code = None
+            try:
+                picker = _JsonPicker(backend.fields)
+                picker.feed(error_text.encode())
+                error_text = picker.found.get("error") or error_text
+                code = picker.found.get("error_code")
+            except ValueError:
+                pass
+            retry_after = resp.headers.get("retry-after", "")
+            error = HttpError(resp.status_code, error_text, code, int(retry_after) if retry_after.isdigit() else None)
+            log_warn(f"ERROR: {error}")
+            raise error
         
-        # urequests.post() with data= parameter
-        # Some versions of urequests need bytes, not string
-        # Convert to bytes for proper encoding
-        if isinstance(payload_str, str):
-            payload_bytes = payload_str.encode('utf-8')
+        if on_delta is not None:
+            # Read server-sent events as they arrive
+            reply = yield from _read_stream_reply(resp, on_delta, backend)
+            if not reply:
+                error_msg = "Empty streamed reply"
+                log_warn(f"ERROR: {error_msg}")
+                raise RuntimeError(error_msg)
+            log_info(f"SUCCESS: Got streamed reply (len={len(reply)}, finish={_chat_finish})")
         else:
-            payload_bytes = payload_str
+            # Pick the answer out of the JSON response as it arrives
+            try:
+                fields = yield from _read_reply_fields(resp, backend.fields)
+                log_debug(f"RESPONSE: Successfully parsed JSON")
+            except ValueError as e:
+                log_warn(f"ERROR: Failed to parse JSON: {e}")
+                raise
         
-        log_error(f"REQUEST: Sending as bytes (len={len(payload_bytes)})")
+            # Extract answer text
+            reply = fields.get("content")
+            _chat_finish = fields.get("finish_reason")
+            if reply:
+                log_info(f"SUCCESS: Got reply (len={len(reply)}, finish={fields.get('finish_reason')})")
+                _note_usage(fields.get("usage"))
+            else:
+                error_msg = fields.get("error") or "No reply text in response"
+                log_warn(f"ERROR: {error_msg}")
+                log_warn(f"ERROR: Response fields={fields}")
+                raise RuntimeError(error_msg)
         
-        # Send the request with bytes
-        resp = requests.post(API_URL, headers=HEADERS, data=payload_bytes)
+        # Download time without the parsing done as the body came in
+        _stat("body", ticks_diff(ticks_us(), head) - _chat_parse_us)
+        _stat("parse", _chat_parse_us)
+        return reply
+    finally:
+        # Keep the connection only if the response was fully read
+        if resp is not None:
+            session.release(resp)
+
+
+def _ask_steps(user_text, history=None, on_delta=None):
+    """
+    Generator form of ask_model, returns the reply via StopIteration.
+    Yields whenever the next step would wait on the network, so the caller can
+    advance it one step per frame and cancel it with close().
+    """
+    # Conversation history is kept within budget by _compact_history
+    # The system instruction itself is part of the backend's body prefix
+    global _chat_match, _chat_fresh
+    _chat_match = None
+    try:
+        started = ticks_us()
+        free = _mem_free()
+        backend = yield from _get_backend()
         
-        log_error(f"RESPONSE: Status={resp.status_code}")
+        # Log the request details
+        log_info(f"REQUEST: URL={API_BASE}/{backend.path}, Model={backend.model}")
         
-        # Check status code
-        if resp.status_code != 200:
-            error_text = resp.text if hasattr(resp, 'text') else str(resp.status_code)
-            error_msg = "HTTP {}: {}".format(resp.status_code, error_text)
-            log_error(f"ERROR: {error_msg}")
-            log_error(f"ERROR: Response text={error_text}")
-            raise RuntimeError(error_msg)
+        # Ask for no longer a reply than the heap holds, past what the
+        # connection needs. A plain reply needs no inflate window.
+        session = _get_session(API_BASE)
+        session.compress = session.inflates
+        max_tokens = _reply_budget(session.reserve())
+        shortest = min(REPLY_MIN_TOKENS, REPLY_MAX_TOKENS)
+        if max_tokens < shortest and session.compress:
+            session.compress = False
+            max_tokens = _reply_budget(session.reserve())
+            log_warn(f"MEMORY: Asking for an uncompressed reply, {max_tokens} tokens fit")
         
-        # Parse JSON response
-        try:
-            data = resp.json()
-            log_error(f"RESPONSE: Successfully parsed JSON")
-        except Exception as e:
-            log_error(f"ERROR: Failed to parse JSON: {e}")
-            log_error(f"ERROR: Response text={resp.text}")
-            raise
+        # Encode the body in one pass
+        encoding = ticks_us()
+        body = _encode_request(backend, history, user_text, on_delta is not None, max(max_tokens, shortest))
+        _stat("build", ticks_diff(ticks_us(), encoding))
+        log_debug(f"REQUEST: Body (len={len(body)})")
+        if log_enabled(LOG_DEBUG):
+            log_debug(f"REQUEST: Payload={bytes(body.body()).decode()}")
         
-        # Extract answer text (standard chat/completions format)
-        if "choices" in data and len(data["choices"]) > 0:
-            reply = data["choices"][0]["message"]["content"]
-            log_error(f"SUCCESS: Got reply (len={len(reply)})")
+        # Repeated prompts are answered from the cache, and with SIMILAR_CACHE
+        # so are questions worded like one asked before. Only a conversation's
+        # first question, later ones depend on what was said before them. A
+        # resumed conversation starts again, though its history came along.
+        cache_key = None
+        reply = None
+        similar = SIMILAR_CACHE and (not history or _chat_fresh)
+        if CACHE_ENABLED:
+            cache_key = _ResponseCache.key(body.prompt())
+            # Similar entries are kept per model and system prompt, in the body prefix
+            prefix_key = _ResponseCache.key(backend.prefix)
+            reply = _get_cache().get(cache_key)
+            if reply is None and similar:
+                looking = ticks_us()
+                match = _get_similar().find(user_text, prefix_key)
+                _stat("lookup", ticks_diff(ticks_us(), looking))
+                if match is not None:
+                    reply = _get_cache().get(match[0])
+                    if reply is None:
+                        _get_similar().forget(match[0])  # Evicted from the cache since
+                    else:
+                        _chat_match = match[1:]
+        if CACHE_ENABLED:
+            _count("cache_miss" if reply is None else "cache_hit" if _chat_match is None else "cache_similar")
+        if reply is not None:
+            if _chat_match is not None:
+                log_info(f"CACHE: Similar hit, {_chat_match[1]}% like '{_chat_match[0]}' (len={len(reply)})")
+            else:
+                log_info(f"CACHE: Hit {cache_key} (len={len(reply)})")
+            if on_delta is not None:
+                on_delta(reply)
         else:
-            error_msg = "No 'choices' field in response"
-            log_error(f"ERROR: {error_msg}")
-            log_error(f"ERROR: Response data={json.dumps(data)}")
-            raise RuntimeError(error_msg)
+            if max_tokens < shortest:
+                # Make room only after the lookup, which loads the cache index
+                _free_heap()
+                max_tokens = _reply_budget(session.reserve())
+                if max_tokens < shortest:
+                    raise LowMemory("Only {}KB free, too little for a reply".format(_mem_free() // 1024))
+                log_warn(f"MEMORY: Freed the cache index, reply limited to {max_tokens} tokens and not cached")
+                cache_key = None
+                body = _encode_request(backend, history, user_text, on_delta is not None, max_tokens)
+            reply = yield from _fetch_with_retry(backend, body, on_delta)
+            # A reply cut short by max_tokens would be served where a longer one fits
+            if cache_key is not None and _chat_finish in _CUT_SHORT:
+                log_info(f"CACHE: Not saving a reply cut short ({_chat_finish})")
+            elif cache_key is not None:
+                _get_cache().put(cache_key, reply)
+                if similar:
+                    _get_similar().add(user_text, cache_key, prefix_key)
         
         # Update history if provided
-        if history is not None and isinstance(history, list):
-            history.append({"role": "user", "content": user_text})
-            history.append({"role": "assistant", "content": reply})
-            # Trim history to keep only last 8 messages (4 exchanges)
-            if len(history) > 8:
-                history[:] = history[-8:]
+        if history is not None:
+            _chat_fresh = False
+            history.append("user", user_text)
+            history.append("assistant", reply)
+            # Keep the next prompt within the history token budget
+            _compact_history(history, _history_target())
         
+        _stat("total", ticks_diff(ticks_us(), started))
+        if free:
+            _stat("heap", free - _mem_free())
         return reply
         
     except Exception as e:
@@ -185,10 +2468,389 @@ def ask_model(user_text, history=None):
         except:
             pass
         raise
-    finally:
-        # Always close the response
-        if resp is not None:
-            resp.close()
+
+
+class _TextView:
+    """
+    Text word-wrapped once into a cached list of lines and drawn a window of
+    lines at a time. Text that only grows (a streaming reply) is rewrapped
+    from its last line instead of from the start.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.offset = 0  # First visible line
+        self._starts = []  # Index in the text where each line begins
+        self._text = ""
+        self._cols = 0
+        self.changed_from = 0  # First line the last layout() changed
+        self.shown = -1  # Offset on screen, -1 while another screen is shown
+
+    def layout(self, text, cols) -> None:
+        """Wrap text to cols characters per line, keeping lines that can't change"""
+        if text == self._text and cols == self._cols:
+            self.changed_from = len(self.lines)
+            return
+        keep = 0
+        if cols == self._cols and self.lines and text.startswith(self._text):
+            keep = len(self.lines) - 1
+        else:
+            self.offset = 0
+        start = self._starts[keep] if keep else 0
+        del self.lines[keep:]
+        del self._starts[keep:]
+        self.changed_from = keep
+        self._text = text
+        self._cols = cols
+        
+        i = start
+        n = len(text)
+        while i < n:
+            end = text.find("\n", i)
+            if end < 0:
+                end = n
+            if end - i > cols:
+                # Break at the last space that fits, or split a long word
+                cut = text.rfind(" ", i, i + cols + 1)
+                if cut > i:
+                    end = cut
+                    following = cut + 1
+                else:
+                    end = following = i + cols
+            else:
+                following = end + 1
+            self.lines.append(text[i:end])
+            self._starts.append(i)
+            i = following
+
+    def scroll(self, delta, rows) -> bool:
+        """Move the window by delta lines, returns True if it moved"""
+        offset = max(0, min(self.offset + delta, len(self.lines) - rows))
+        if offset == self.offset:
+            return False
+        self.offset = offset
+        return True
+
+    def at_end(self, rows) -> bool:
+        return self.offset + rows >= len(self.lines)
+
+    def draw(self, draw, rows, color, first=0) -> None:
+        """Draw the visible lines only, starting first rows into the window"""
+        y = TEXT_MARGIN + first * TEXT_LINE_HEIGHT
+        for i in range(self.offset + first, min(self.offset + rows, len(self.lines))):
+            draw.text(Vector(TEXT_MARGIN, y), self.lines[i], color)
+            y += TEXT_LINE_HEIGHT
+
+
+_chat_view = _TextView()  # Layout shared by the reply and error views
+
+
+def _text_geometry(draw):
+    """Columns and rows of text that fit the screen, leaving room for scroll marks and a footer"""
+    cols = (draw.size.x - 2 * TEXT_MARGIN) // TEXT_CHAR_WIDTH - 2
+    rows = (draw.size.y - 2 * TEXT_MARGIN) // TEXT_LINE_HEIGHT - 2
+    return cols, rows
+
+
+def _draw_text_view(view_manager, text, footer, follow=False) -> None:
+    """
+    Lay out text in _chat_view if it changed and draw its visible window with
+    a footer. With follow the window stays on the last lines as text grows,
+    otherwise UP/DOWN hints are added to the footer. When the view is already
+    on screen and didn't scroll, only the rows from the first changed line
+    down are redrawn.
+    """
+    draw = view_manager.get_draw()
+    color = view_manager.get_foreground_color()
+    cols, rows = _text_geometry(draw)
+    was_at_end = _chat_view.at_end(rows)
+    _chat_view.layout(text, cols)
+    if follow and was_at_end:
+        _chat_view.scroll(len(_chat_view.lines), rows)
+    
+    # Rows above the first changed line are still correct on screen, the
+    # last text row is always included since it holds the down mark
+    first = 0
+    if _chat_view.shown == _chat_view.offset:
+        first = max(0, min(_chat_view.changed_from - _chat_view.offset, rows - 1))
+    y = TEXT_MARGIN + first * TEXT_LINE_HEIGHT if first else 0
+    draw.clear(Vector(0, y), Vector(draw.size.x, draw.size.y - y), view_manager.get_background_color())
+    _chat_view.draw(draw, rows, color, first)
+    _chat_view.shown = _chat_view.offset
+    
+    # Scroll marks on the right, footer below the text window
+    right = draw.size.x - TEXT_MARGIN - TEXT_CHAR_WIDTH
+    footer_y = TEXT_MARGIN + (rows + 1) * TEXT_LINE_HEIGHT
+    if _chat_view.offset > 0:
+        draw.text(Vector(right, TEXT_MARGIN), "▲", color)
+    if not _chat_view.at_end(rows):
+        draw.text(Vector(right, footer_y - 2 * TEXT_LINE_HEIGHT), "▼", color)
+    if not follow:
+        footer = _scroll_hint(rows) + footer
+    draw.text(Vector(TEXT_MARGIN, footer_y), footer, color)
+    draw.swap()
+
+
+def _scroll_hint(rows) -> str:
+    """UP/DOWN hint for the footer depending on where the window is"""
+    if _chat_view.offset > 0 and not _chat_view.at_end(rows):
+        return "UP/DOWN | "
+    if _chat_view.offset > 0:
+        return "UP | "
+    if not _chat_view.at_end(rows):
+        return "DOWN | "
+    return ""
+
+
+def _draw_result(view_manager, streaming=False) -> None:
+    """Draw the question and the (possibly partial) reply"""
+    global _chat_paint_from
+    text = "You: " + _chat_user_input + "\n\nAI: " + _chat_last_reply
+    if _chat_last_match is not None:
+        text += '\n\n[Saved answer to "{}", {}% alike]'.format(*_chat_last_match)
+    if streaming:
+        _draw_text_view(view_manager, text, "... LEFT: Cancel", True)
+    else:
+        _draw_text_view(view_manager, text, "CENTER: New | LEFT: Back")
+    if _chat_paint_from is not None:
+        _stat("paint", ticks_diff(ticks_us(), _chat_paint_from))
+        _chat_paint_from = None
+
+
+def _draw_error(view_manager) -> None:
+    """Draw the scrollable error display"""
+    _draw_text_view(view_manager, _chat_error_text, "LEFT: Exit")
+
+
+def _stats_text() -> str:
+    """Stats screen text: request timings and token use since start"""
+    return _chat_stats.text() + "\n\nTokens: prompt {}, cached {}, completion {}".format(
+        _chat_tokens["prompt"], _chat_tokens["cached"], _chat_tokens["completion"]
+    )
+
+
+def _show_log_page(start, draw, at_end=False) -> None:
+    """
+    Show the saved messages from start on in the conversation view, only
+    this page of them is read from flash. With at_end the view opens on
+    the last lines of the page, for paging back.
+    """
+    global _chat_log_page, _chat_log_text, _chat_log_displaying, _chat_dirty
+    
+    end = min(start + CHAT_PAGE_MESSAGES, _chat_log.count)
+    parts = ["Messages {}-{} of {}".format(start + 1, end, _chat_log.count)]
+    previous = None
+    for conv, role, text in _chat_log.read(start, end):
+        if role == "system":
+            continue  # A summary of messages the log still has
+        if previous is not None and conv != previous:
+            parts.append("---- New chat ----")
+        previous = conv
+        parts.append(("You: " if role == "user" else "AI: ") + text)
+    _chat_log_page = start
+    _chat_log_text = "\n\n".join(parts)
+    _chat_view.shown = -1  # Another page, so redraw all of it
+    _chat_log_displaying = True
+    _chat_dirty = True
+    cols, rows = _text_geometry(draw)
+    _chat_view.layout(_chat_log_text, cols)
+    _chat_view.offset = 0
+    if at_end:
+        _chat_view.scroll(len(_chat_view.lines), rows)
+
+
+def _append_delta(text) -> None:
+    """on_delta callback that grows the reply shown while streaming"""
+    global _chat_last_reply, _chat_dirty
+    _chat_last_reply += text
+    _chat_dirty = True
+
+
+def _show_error(e) -> None:
+    """Switch to the scrollable error display for exception e"""
+    global _chat_error_displaying, _chat_error_text
+    global _chat_request_in_progress, _chat_displaying_result, _chat_waiting_for_input
+    
+    # Log error to file
+    try:
+        log_error(f"UI ERROR: {type(e).__name__}: {str(e)}")
+    except:
+        pass
+    
+    # Set up scrollable error display, wrapped by _chat_view when drawn
+    _chat_error_text = "API ERROR:\n\nType: {}\n\n{}\n\nCheck {}".format(
+        type(e).__name__, str(e), LOG_PATH
+    )
+    _chat_view.offset = 0
+    _chat_error_displaying = True
+    
+    # Reset other states
+    _chat_request_in_progress = False
+    _chat_displaying_result = False
+    _chat_waiting_for_input = False
+
+
+def _queue_question(question, reason) -> None:
+    """Queue question to be answered once online and say so in the reply view"""
+    global _chat_last_reply, _chat_request_in_progress, _chat_displaying_result
+    
+    try:
+        _chat_queue.push(question)
+    except OSError as e:
+        _show_error(e)
+        return
+    log_info(f"QUEUE: Queued question ({reason}), {len(_chat_queue.pending)} waiting")
+    _chat_last_reply = "[{} Queued as number {} in line, the answer will be under DOWN on the start screen.]".format(
+        reason, len(_chat_queue.pending)
+    )
+    _chat_view.offset = 0
+    _chat_request_in_progress = False
+    _chat_displaying_result = True
+
+
+def _draw_ready(view_manager) -> None:
+    """Draw the start screen with the state of the offline queue"""
+    draw = view_manager.get_draw()
+    _chat_view.shown = -1
+    draw.clear(Vector(0, 0), draw.size, view_manager.get_background_color())
+    draw.text(Vector(5, 5), "PicoGPT Ready!" if _chat_online else "PicoGPT Offline")
+    draw.text(Vector(5, 20), "Press CENTER to ask")
+    draw.text(Vector(5, 35), "Press LEFT to go back")
+    y = 55
+    if _chat_queue.pending:
+        draw.text(Vector(5, y), "{} queued for when online".format(len(_chat_queue.pending)))
+        y += 15
+    if _chat_queue.answers:
+        draw.text(Vector(5, y), "Press DOWN for answers ({})".format(_chat_queue.answers))
+        y += 15
+    if _chat_log is not None and _chat_log.count:
+        draw.text(Vector(5, y), "Press RIGHT for saved chats")
+    draw.swap()
+
+
+def _poll_request() -> None:
+    """Advance the in-flight request by one step and pick up its result"""
+    global _chat_request, _chat_last_reply, _chat_dirty, _chat_last_match
+    global _chat_request_in_progress, _chat_displaying_result
+    
+    try:
+        next(_chat_request)
+        return
+    except StopIteration as e:
+        _chat_request = None
+        _chat_last_reply = e.value
+        _chat_last_match = _chat_match
+        _chat_request_in_progress = False
+        _chat_displaying_result = True
+        if _chat_log is not None:
+            _chat_log.append("user", _chat_user_input)
+            _chat_log.append("assistant", _chat_last_reply)
+            _chat_log.save_summary(_chat_history)
+    except MemoryError as e:
+        # Show what arrived and why it stopped instead of the error screen
+        _chat_request = None
+        _close_session()
+        gc.collect()
+        note = str(e) or "Out of memory"
+        log_error(f"MEMORY: {note}, {_mem_free()} bytes free")
+        if _chat_last_reply:
+            _chat_last_reply += "\n\n[{}, the reply was cut short.]".format(note)
+        else:
+            _chat_last_reply = "[{}. Ask a shorter question or restart the app.]".format(note)
+        _chat_request_in_progress = False
+        _chat_displaying_result = True
+    except Exception as e:
+        _chat_request = None
+        if _queueable(e):
+            _queue_question(_chat_user_input, "Not sent: {}.".format(e))
+        else:
+            _show_error(e)
+    _chat_dirty = True
+
+
+def _drain_steps():
+    """Ask the oldest queued question and file its answer. Generator."""
+    log_info(f"QUEUE: Asking queued question, {len(_chat_queue.pending)} waiting")
+    try:
+        reply = yield from _ask_steps(_chat_queue.pending[0])
+    except Exception as e:
+        if _queueable(e):
+            raise
+        _chat_queue.done(error="{}: {}".format(type(e).__name__, e))
+        return
+    _chat_queue.done(reply)
+
+
+def _poll_queue(view_manager) -> None:
+    """
+    Answer queued questions one at a time in the background while WiFi is
+    up, called on frames without a request of the user's in flight
+    """
+    global _chat_drain, _chat_queue_wait, _chat_online, _chat_dirty
+    if _chat_drain is None:
+        now = ticks_ms()
+        if ticks_diff(_chat_queue_wait, now) > 0:
+            return
+        _chat_queue_wait = ticks_add(now, 1000)  # Look at WiFi once a second
+        wifi = view_manager.get_wifi()
+        online = bool(wifi and wifi.is_connected())
+        if online != _chat_online:
+            _chat_online = online
+            _chat_dirty = True
+            log_info(f"QUEUE: WiFi {'up' if online else 'down'}, {len(_chat_queue.pending)} queued")
+        if not online or not _chat_queue.pending:
+            return
+        _chat_drain = _drain_steps()
+    
+    try:
+        next(_chat_drain)
+    except StopIteration:
+        _chat_drain = None
+        _chat_dirty = True
+    except Exception as e:
+        _chat_drain = None
+        _chat_queue_wait = ticks_add(ticks_ms(), QUEUE_RETRY * 1000)
+        log_warn(f"QUEUE: {type(e).__name__}: {e}, trying again in {QUEUE_RETRY}s")
+
+
+def _cancel_drain() -> None:
+    """Stop answering a queued question, it stays first in the queue"""
+    global _chat_drain
+    
+    if _chat_drain is not None:
+        drain = _chat_drain
+        _chat_drain = None
+        try:
+            drain.close()
+        except:
+            pass
+
+
+def _idle() -> None:
+    """Back off when a frame had nothing to draw, sleeping longer the longer it lasts"""
+    global _chat_idle_frames
+    
+    if _chat_idle_frames < IDLE_FRAMES + IDLE_SLEEP_MS:
+        _chat_idle_frames += 1
+    if _chat_idle_frames > IDLE_FRAMES:
+        utime.sleep_ms(_chat_idle_frames - IDLE_FRAMES)
+
+
+def _cancel_request() -> None:
+    """Drop the in-flight request, closing its connection"""
+    global _chat_request
+    
+    if _chat_request is not None:
+        request = _chat_request
+        _chat_request = None
+        try:
+            request.close()
+        except:
+            pass
+        try:
+            log_info("CANCEL: Request cancelled by user")
+        except:
+            pass
 
 
 def start(view_manager) -> bool:
@@ -218,36 +2880,58 @@ def start(view_manager) -> bool:
             sleep(2)
             return False
         
-        # Check if WiFi is connected
-        if not wifi.is_connected():
+        # Without a connection questions are queued until it's back
+        global _chat_online, _chat_queue, _chat_queue_wait
+        _chat_online = wifi.is_connected()
+        if not _chat_online:
             from picoware.applications.wifi.utils import connect_to_saved_wifi
-            from picoware.gui.alert import Alert
-            from time import sleep
             
-            _chat_alert = Alert(
-                draw,
-                "WiFi not connected yet",
-                view_manager.get_foreground_color(),
-                view_manager.get_background_color(),
-            )
-            _chat_alert.draw("Error")
-            sleep(2)
+            log_info("START: WiFi not connected, questions will be queued")
             connect_to_saved_wifi(view_manager)
-            return False
         
+        global Vector, BUTTON_BACK, BUTTON_LEFT, BUTTON_RIGHT, BUTTON_CENTER, BUTTON_UP, BUTTON_DOWN
         from picoware.system.vector import Vector
+        from picoware.system.buttons import (
+            BUTTON_BACK,
+            BUTTON_LEFT,
+            BUTTON_RIGHT,
+            BUTTON_CENTER,
+            BUTTON_UP,
+            BUTTON_DOWN,
+        )
+        
+        # Request buffers are allocated once, before the heap fragments
+        global _chat_body, _chat_raw_buf, _chat_screen_chars, _chat_screen_cols
+        if _chat_body is None:
+            _chat_body = _BodyBuffer(BODY_BUFFER_BYTES)
+        if _chat_raw_buf is None:
+            _chat_raw_buf = bytearray(512)
+        cols, rows = _text_geometry(draw)
+        _chat_screen_chars = cols * rows
+        _chat_screen_cols = cols
         
         # Reset state for fresh start
         __reset_chat_state()
-        global _chat_history
-        _chat_history = []
+        global _chat_history, _chat_stats, _chat_log, _chat_fresh
+        _chat_history = _History()
+        _chat_fresh = True
+        if CHAT_LOG_ENABLED:
+            # Carry on with the last conversation, from its newest messages in the index
+            _chat_log = _ChatLog()
+            _chat_log.restore(_chat_history, _history_target())
+            _compact_history(_chat_history, _history_target())
+            _chat_log.save_summary(_chat_history)
+            if _chat_history:
+                log_info(f"CHAT LOG: Resumed conversation {_chat_log.conv} with {len(_chat_history)} messages")
+        if _chat_stats is None:
+            _chat_stats = _Stats()
+        _chat_queue = _RequestQueue()
+        _chat_queue_wait = ticks_ms()
         
-        # Show welcome screen
-        draw.clear(Vector(0, 0), draw.size, view_manager.get_background_color())
-        draw.text(Vector(5, 5), "PicoGPT Ready!")
-        draw.text(Vector(5, 20), "Press CENTER to ask")
-        draw.text(Vector(5, 35), "Press LEFT to go back")
-        draw.swap()
+        # Show welcome screen, run() redraws only once something changes
+        _draw_ready(view_manager)
+        global _chat_dirty
+        _chat_dirty = False
         
         return True
     except Exception as e:
@@ -272,43 +2956,36 @@ def start(view_manager) -> bool:
 
 def run(view_manager) -> None:
     """Run the app"""
-    from picoware.system.vector import Vector
-    from picoware.system.buttons import (
-        BUTTON_BACK,
-        BUTTON_LEFT,
-        BUTTON_RIGHT,
-        BUTTON_CENTER,
-        BUTTON_UP,
-        BUTTON_DOWN,
-    )
-    
     global _chat_alert, _chat_history
     global _chat_user_input, _chat_waiting_for_input, _chat_input_text
-    global _chat_request_in_progress, _chat_displaying_result, _chat_last_reply
-    global _chat_error_displaying, _chat_error_lines, _chat_error_scroll_offset
+    global _chat_request_in_progress, _chat_displaying_result, _chat_last_reply, _chat_last_match
+    global _chat_error_displaying, _chat_error_text
+    global _chat_request, _chat_last_paint, _chat_dirty, _chat_idle_frames
+    global _chat_answers_displaying, _chat_answers_text
+    global _chat_stats_displaying, _chat_stats_text, _chat_paint_from, _chat_fresh
     
     input_manager = view_manager.get_input_manager()
     button = input_manager.get_last_button()
     draw = view_manager.get_draw()
     
-    # Log button presses for debugging
+    # Log button presses for debugging, any press may change the screen
     if button is not None:
-        try:
-            log_error(f"BUTTON: Detected button={button}")
-        except:
-            pass
+        log_debug(f"BUTTON: Detected button={button}")
+        _chat_dirty = True
     
     # Handle back button
     if button in (BUTTON_LEFT, BUTTON_BACK):
         input_manager.reset()
-        # If showing error, exit error display
-        if _chat_error_displaying:
-            _chat_error_displaying = False
-            _chat_error_lines = []
-            _chat_error_scroll_offset = 0
+        # If a request is running, cancel it and return to the ready screen
+        if _chat_request is not None:
+            _cancel_request()
+            __reset_chat_state()
+            return
+        # If showing error, queued answers, stats or saved chats, go back to the start screen
+        if _chat_error_displaying or _chat_answers_displaying or _chat_stats_displaying or _chat_log_displaying:
             __reset_chat_state()
             try:
-                log_error(f"ERROR: Exited error display")
+                log_debug(f"ERROR: Exited error display")
             except:
                 pass
             return
@@ -321,29 +2998,68 @@ def run(view_manager) -> None:
         view_manager.back()
         return
     
-    # Handle scroll buttons if showing error (before other button handlers)
-    if _chat_error_displaying:
-        if button == BUTTON_DOWN:  # Scroll down
-            input_manager.reset()
-            max_lines = len(_chat_error_lines)
-            max_visible = 25  # Approximate lines visible on screen
-            if _chat_error_scroll_offset + max_visible < max_lines:
-                _chat_error_scroll_offset += 1
-                try:
-                    log_error(f"SCROLL: Down to offset {_chat_error_scroll_offset}")
-                except:
-                    pass
-            return
-        elif button == BUTTON_UP:  # Scroll up
+    # Advance the in-flight request, other buttons are ignored until it ends
+    if _chat_request is not None:
+        if button is not None:
             input_manager.reset()
-            if _chat_error_scroll_offset > 0:
-                _chat_error_scroll_offset -= 1
-                try:
-                    log_error(f"SCROLL: Up to offset {_chat_error_scroll_offset}")
-                except:
-                    pass
+        _poll_request()
+        if _chat_request is not None:
+            now = ticks_ms()
+            if _chat_dirty and ticks_diff(now, _chat_last_paint) >= STREAM_REDRAW_MS:
+                _chat_last_paint = now
+                _chat_dirty = False
+                if _chat_last_reply:
+                    _draw_result(view_manager, True)
+                else:
+                    _chat_view.shown = -1
+                    draw.clear(Vector(0, 0), draw.size, view_manager.get_background_color())
+                    draw.text(Vector(5, 5), "Thinking...")
+                    draw.text(Vector(5, 20), "Press LEFT to cancel")
+                    draw.swap()
             return
     
+    # Queued questions are answered while the user's own aren't
+    _poll_queue(view_manager)
+    
+    # Handle scroll buttons for the error, reply, answers, stats and saved chat views (before other button handlers)
+    if (_chat_error_displaying or _chat_displaying_result or _chat_answers_displaying or _chat_stats_displaying or _chat_log_displaying) and button in (BUTTON_UP, BUTTON_DOWN):
+        input_manager.reset()
+        rows = _text_geometry(draw)[1]
+        step = rows - 1 if button == BUTTON_DOWN else 1 - rows  # A page at a time
+        if _chat_view.scroll(step, rows):
+            log_debug(f"SCROLL: To offset {_chat_view.offset}")
+        elif _chat_log_displaying:
+            # Past the end of the page, read the next or previous one from flash
+            if button == BUTTON_DOWN and _chat_log_page + CHAT_PAGE_MESSAGES < _chat_log.count:
+                _show_log_page(_chat_log_page + CHAT_PAGE_MESSAGES, draw)
+            elif button == BUTTON_UP and _chat_log_page > 0:
+                _show_log_page(max(0, _chat_log_page - CHAT_PAGE_MESSAGES), draw, True)
+        return
+    
+    # DOWN on the start screen shows the answers to queued questions
+    if button == BUTTON_DOWN and not (_chat_waiting_for_input or _chat_error_displaying):
+        input_manager.reset()
+        _chat_answers_text = _chat_queue.answers_text()
+        _chat_view.offset = 0
+        _chat_answers_displaying = True
+        return
+    
+    # UP on the start screen shows request timings, on purpose not listed there
+    if button == BUTTON_UP and not (_chat_waiting_for_input or _chat_error_displaying):
+        input_manager.reset()
+        _chat_stats_text = _stats_text()
+        _chat_view.offset = 0
+        _chat_stats_displaying = True
+        return
+    
+    # CENTER on the stats screen writes them to the log as one line
+    if _chat_stats_displaying and button in (BUTTON_RIGHT, BUTTON_CENTER):
+        input_manager.reset()
+        log_info(_chat_stats.line())
+        log_flush()
+        _chat_stats_text = _stats_text() + "\n\nExported to " + LOG_PATH
+        return
+    
     # Handle center/right button - start new question
     if button in (BUTTON_RIGHT, BUTTON_CENTER):
         input_manager.reset()
@@ -351,14 +3067,22 @@ def run(view_manager) -> None:
         # If showing error, allow retry
         if _chat_error_displaying:
             _chat_error_displaying = False
-            _chat_error_lines = []
-            _chat_error_scroll_offset = 0
+            _chat_error_text = ""
             _chat_waiting_for_input = True
             _chat_input_text = ""
             return
         
-        # If we're displaying a result, start new question
-        if _chat_displaying_result:
+        # RIGHT in the saved chats starts a new conversation
+        if _chat_log_displaying and button == BUTTON_RIGHT:
+            _chat_log.new_conversation()
+            _chat_history.clear()
+            _chat_fresh = True
+            log_info(f"CHAT LOG: New conversation {_chat_log.conv}")
+            __reset_chat_state()
+            return
+        
+        # If we're displaying a result, answers or saved chats, start new question
+        if _chat_displaying_result or _chat_answers_displaying or _chat_log_displaying:
             __reset_chat_state()
             _chat_waiting_for_input = True
             _chat_input_text = ""  # Reset input text
@@ -367,7 +3091,7 @@ def run(view_manager) -> None:
         # If waiting for input, handle text input submission
         if _chat_waiting_for_input:
             try:
-                log_error(f"BUTTON: CENTER pressed, waiting_for_input=True, input_text='{_chat_input_text}'")
+                log_debug(f"BUTTON: CENTER pressed, waiting_for_input=True, input_text='{_chat_input_text}'")
             except:
                 pass
             
@@ -377,97 +3101,71 @@ def run(view_manager) -> None:
                 _chat_input_text = ""
                 _chat_waiting_for_input = False
                 _chat_request_in_progress = True
+                _chat_last_match = None
                 
                 try:
-                    log_error(f"SUBMIT: Sending question: {_chat_user_input}")
+                    log_info(f"SUBMIT: Sending question: {_chat_user_input}")
                 except:
                     pass
                 
-                # Start API request
-                try:
-                    reply = ask_model(_chat_user_input, _chat_history)
-                    _chat_last_reply = reply
-                    _chat_displaying_result = True
-                    _chat_request_in_progress = False
-                except Exception as e:
-                    # Log error to file
-                    try:
-                        log_error(f"UI ERROR: {type(e).__name__}: {str(e)}")
-                    except:
-                        pass
-                    
-                    # Set up scrollable error display
-                    error_msg = str(e)
-                    error_type = type(e).__name__
-                    
-                    # Build display text with word wrapping
-                    display_lines = ["API ERROR:", "", f"Type: {error_type}", ""]
-                    
-                    # Split error message into lines that fit on screen
-                    words = error_msg.split()
-                    current_line = ""
-                    max_width = 30  # Characters per line
-                    
-                    for word in words:
-                        if len(current_line) + len(word) + 1 <= max_width:
-                            current_line += (" " if current_line else "") + word
-                        else:
-                            if current_line:
-                                display_lines.append(current_line)
-                            current_line = word
-                    if current_line:
-                        display_lines.append(current_line)
-                    
-                    display_lines.extend(["", "Check /error_log.txt"])
-                    
-                    # Store error lines and reset scroll
-                    global _chat_error_displaying, _chat_error_lines, _chat_error_scroll_offset
-                    _chat_error_lines = display_lines
-                    _chat_error_scroll_offset = 0
-                    _chat_error_displaying = True
-                    
-                    # Reset other states
-                    _chat_request_in_progress = False
-                    _chat_displaying_result = False
-                    _chat_waiting_for_input = False
+                # Offline questions wait in the queue
+                wifi = view_manager.get_wifi()
+                if not (wifi and wifi.is_connected()):
+                    _queue_question(_chat_user_input, "Offline.")
                     return
+                
+                # The network is the user's until they have their answer
+                _cancel_drain()
+                
+                # Start API request, advanced from the frame loop
+                _chat_last_reply = ""
+                _chat_last_paint = ticks_add(ticks_ms(), -STREAM_REDRAW_MS)
+                _chat_paint_from = ticks_us()
+                if STREAM_REPLIES:
+                    _chat_request = _ask_steps(_chat_user_input, _chat_history, _append_delta)
+                else:
+                    _chat_request = _ask_steps(_chat_user_input, _chat_history)
+                return
             else:
                 # No input text yet - this shouldn't happen if display section set it
                 # But just in case, set it now
                 _chat_input_text = "Hello, how are you?"
                 try:
-                    log_error(f"INPUT: No input text, setting default")
+                    log_debug(f"INPUT: No input text, setting default")
                 except:
                     pass
                 return
         else:
+            # RIGHT on the start screen pages back from the newest saved messages
+            if button == BUTTON_RIGHT and _chat_log is not None and _chat_log.count:
+                _show_log_page(max(0, _chat_log.count - CHAT_PAGE_MESSAGES), draw, True)
+                return
+            
             # Initial state (or after error) - start waiting for input
             _chat_waiting_for_input = True
             _chat_input_text = ""  # Will be set to default in display section
             try:
-                log_error(f"BUTTON: CENTER pressed from initial state, setting waiting_for_input=True")
+                log_debug(f"BUTTON: CENTER pressed from initial state, setting waiting_for_input=True")
             except:
                 pass
             return
     
+    # Buttons this screen ignores stay pressed until reset, redrawing every frame
+    if button is not None:
+        input_manager.reset()
+    
+    # Redraw only when something on screen changed, otherwise back off
+    if not _chat_dirty:
+        if _chat_drain is None:
+            _idle()
+        return
+    _chat_dirty = False
+    _chat_idle_frames = 0
+    
     # Display result if available
     if _chat_displaying_result and _chat_last_reply:
         # Show conversation history and latest reply
-        display_text = "You: " + _chat_user_input + "\n\n"
-        display_text += "AI: " + _chat_last_reply + "\n\n"
-        display_text += "Press CENTER for new question\n"
-        display_text += "Press LEFT to go back"
-        
-        draw.clear(Vector(0, 0), draw.size, view_manager.get_background_color())
-        draw.text(Vector(0, 5), display_text, view_manager.get_foreground_color())
-        draw.swap()
-        return
-    
-    # Show thinking indicator if request in progress
-    if _chat_request_in_progress:
-        draw.clear(Vector(0, 0), draw.size, view_manager.get_background_color())
-        draw.text(Vector(5, 5), "Thinking...")
-        draw.swap()
+        _draw_result(view_manager)
         return
     
     # Show input screen if waiting for input
@@ -478,7 +3176,7 @@ def run(view_manager) -> None:
             # Use a default test question for now
             _chat_input_text = "Hello, how are you?"
             try:
-                log_error(f"INPUT: Set default question: {_chat_input_text}")
+                log_debug(f"INPUT: Set default question: {_chat_input_text}")
             except:
                 pass
         
@@ -486,6 +3184,7 @@ def run(view_manager) -> None:
         display_text += _chat_input_text
         display_text += "\n\nCENTER: Send this\nLEFT: Cancel"
         
+        _chat_view.shown = -1
         draw.clear(Vector(0, 0), draw.size, view_manager.get_background_color())
         draw.text(Vector(5, 5), display_text, view_manager.get_foreground_color())
         draw.swap()
@@ -493,68 +3192,55 @@ def run(view_manager) -> None:
     
     # Show error display if in error mode
     if _chat_error_displaying:
-        from picoware.system.vector import Vector
-        draw.clear(Vector(0, 0), draw.size, view_manager.get_background_color())
-        
-        # Calculate which lines to show based on scroll offset
-        max_visible = 25  # Approximate lines visible on screen
-        start_line = _chat_error_scroll_offset
-        end_line = min(start_line + max_visible, len(_chat_error_lines))
-        
-        # Display visible lines
-        y_pos = 5
-        for i in range(start_line, end_line):
-            if y_pos > 300:  # Screen limit
-                break
-            line = _chat_error_lines[i]
-            draw.text(Vector(5, y_pos), line, view_manager.get_foreground_color())
-            y_pos += 12
-        
-        # Show scroll indicators on right side
-        if start_line > 0:
-            draw.text(Vector(220, 5), "▲", view_manager.get_foreground_color())
-        if end_line < len(_chat_error_lines):
-            draw.text(Vector(220, 295), "▼", view_manager.get_foreground_color())
-        
-        # Show controls at bottom (only once, no overlay)
-        controls_y = 295
-        if end_line >= len(_chat_error_lines):
-            # At bottom, show controls
-            draw.text(Vector(5, controls_y), "UP: Scroll | LEFT: Exit", view_manager.get_foreground_color())
-        elif start_line == 0:
-            # At top, show controls
-            draw.text(Vector(5, controls_y), "DOWN: Scroll | LEFT: Exit", view_manager.get_foreground_color())
-        else:
-            # In middle, show both
-            draw.text(Vector(5, controls_y), "UP/DOWN: Scroll | LEFT: Exit", view_manager.get_foreground_color())
-        
-        draw.swap()
+        _draw_error(view_manager)
+        return
+    
+    # Show the answers to queued questions
+    if _chat_answers_displaying:
+        _draw_text_view(view_manager, _chat_answers_text, "CENTER: New | LEFT: Back")
+        return
+    
+    # Show a page of the saved conversations
+    if _chat_log_displaying:
+        _draw_text_view(view_manager, _chat_log_text, "CENTER: Ask | RIGHT: New")
+        return
+    
+    # Show request timings
+    if _chat_stats_displaying:
+        _draw_text_view(view_manager, _chat_stats_text, "CENTER: Export | LEFT: Back")
         return
     
     # Show initial prompt if nothing is happening
     if not _chat_waiting_for_input and not _chat_request_in_progress and not _chat_displaying_result:
         # Log state for debugging
-        try:
-            log_error(f"STATE: Showing ready screen (waiting={_chat_waiting_for_input}, in_progress={_chat_request_in_progress}, displaying={_chat_displaying_result})")
-        except:
-            pass
+        if log_enabled(LOG_DEBUG):
+            log_debug(f"STATE: Showing ready screen (waiting={_chat_waiting_for_input}, in_progress={_chat_request_in_progress}, displaying={_chat_displaying_result})")
         
-        draw.clear(Vector(0, 0), draw.size, view_manager.get_background_color())
-        draw.text(Vector(5, 5), "PicoGPT Ready!")
-        draw.text(Vector(5, 20), "Press CENTER to ask")
-        draw.text(Vector(5, 35), "Press LEFT to go back")
-        draw.swap()
+        _draw_ready(view_manager)
 
 
 def stop(view_manager) -> None:
     """Stop the app"""
+    _cancel_request()
+    _cancel_drain()
+    _close_session()
     __reset_chat_state()
+    if _chat_cache is not None:
+        _chat_cache.save()
+    if _chat_similar is not None:
+        _chat_similar.save()
+    if _chat_stats is not None and _chat_stats.counts:
+        log_info(_chat_stats.line())
+    log_flush()
     
-    global _chat_alert, _chat_history, _chat_last_reply
+    global _chat_alert, _chat_history, _chat_last_reply, _chat_queue, _chat_log, _chat_last_match
     
     if _chat_alert:
         del _chat_alert
         _chat_alert = None
     
-    _chat_history = []
+    _chat_history = None
+    _chat_queue = None
+    _chat_log = None
     _chat_last_reply = ""
+    _chat_last_match = None
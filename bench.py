@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# bench.py
+# Benchmark the real PicoGPT.ask_model under CPython against mock_server.py
+#
+# Starts the mock in its own process (so its allocations stay out of the
+# numbers), sends --requests prompts per mode and prints latency, bytes on
+# the wire and after decompression, and peak Python heap use per request
+# (--phases adds the app's own timings of each request phase).
+# Example:
+#
+#   python3 bench.py --requests 50 --latency 80 --chunk 64 --words 120
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import host_shims
+import mock_server
+
+host_shims.install()
+import PicoGPT  # noqa: E402 - needs the shims in place
+
+
+def percentile(values, p):
+    """p-th percentile of values, nearest rank"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def summarize(values):
+    """min/avg/p95/max of values"""
+    if not values:
+        return {"min": 0, "avg": 0, "p95": 0, "max": 0}
+    return {
+        "min": min(values),
+        "avg": sum(values) / len(values),
+        "p95": percentile(values, 95),
+        "max": max(values),
+    }
+
+
+def run_mode(args, stream):
+    """Send args.requests prompts and return one result dict per request"""
+    history = PicoGPT._History(size=args.history_bytes) if args.history else None
+    PicoGPT._chat_stats = PicoGPT._Stats(args.requests)
+    results = []
+    for i in range(args.requests):
+        first = []
+
+        def on_delta(text):
+            if not first:
+                first.append(time.perf_counter())
+
+        tokens = dict(PicoGPT._chat_tokens)
+        host_shims.reset_traffic()
+        if not args.no_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        error = None
+        started = time.perf_counter()
+        try:
+            PicoGPT.ask_model("Question number {}?".format(i), history, on_delta if stream else None)
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        done = time.perf_counter()
+        results.append({
+            "latency": (done - started) * 1000,
+            "first": ((first[0] if first else done) - started) * 1000,
+            "sent": host_shims.traffic["sent"],
+            "received": host_shims.traffic["received"],
+            # What was received with compressed bodies counted inflated
+            "decoded": host_shims.traffic["received"] - host_shims.traffic["inflated_in"]
+            + host_shims.traffic["inflated_out"],
+            "connections": host_shims.traffic["connections"],
+            "prompt_tokens": PicoGPT._chat_tokens["prompt"] - tokens["prompt"],
+            "cached_tokens": PicoGPT._chat_tokens["cached"] - tokens["cached"],
+            "peak": 0 if args.no_memory else tracemalloc.get_traced_memory()[1] - base,
+            "error": error,
+        })
+    return results
+
+
+def report(name, results, args):
+    ok = [r for r in results if not r["error"]]
+    latency = summarize([r["latency"] for r in ok])
+    first = summarize([r["first"] for r in ok])
+    print("{} ({} requests, {} errors, {} connections)".format(
+        name, len(results), len(results) - len(ok), sum(r["connections"] for r in results)))
+    print("  latency ms     min {min:8.1f}  avg {avg:8.1f}  p95 {p95:8.1f}  max {max:8.1f}".format(**latency))
+    if name == "stream":
+        print("  first text ms  min {min:8.1f}  avg {avg:8.1f}  p95 {p95:8.1f}  max {max:8.1f}".format(**first))
+    print("  bytes/request  sent {:6.0f}  received {:6.0f}  decoded {:6.0f}".format(
+        summarize([r["sent"] for r in results])["avg"],
+        summarize([r["received"] for r in results])["avg"],
+        summarize([r["decoded"] for r in results])["avg"]))
+    prompt = sum(r["prompt_tokens"] for r in results)
+    cached = sum(r["cached_tokens"] for r in results)
+    print("  prompt tokens  avg {:8.1f}  cached {:8.1f}  ({:.0f}% cached)".format(
+        prompt / len(results), cached / len(results), cached * 100 / prompt if prompt else 0))
+    print("  peak heap KB   avg {avg:8.1f}  max {max:8.1f}".format(
+        **summarize([r["peak"] / 1024 for r in results])))
+    if args.phases:
+        for line in PicoGPT._chat_stats.text().split("\n")[2:]:
+            print(("  " + line).rstrip())
+    errors = sorted(set(r["error"] for r in results if r["error"]))
+    for error in errors[:5]:
+        print("  error: " + error)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PicoGPT.ask_model against a mock API")
+    parser.add_argument("--requests", "-n", type=int, default=20, help="requests per mode")
+    parser.add_argument("--mode", choices=["plain", "stream", "both"], default="both")
+    parser.add_argument("--url", help="use a running server at this base URL instead of starting the mock")
+    parser.add_argument("--backend", choices=["auto", "chat", "responses", "gateway"], default="auto", help="API_BACKEND to use")
+    parser.add_argument("--history", action="store_true", help="carry conversation history between requests")
+    parser.add_argument("--history-budget", type=int, help="HISTORY_TOKEN_BUDGET, rebasing to half of it")
+    parser.add_argument("--history-bytes", type=int, default=PicoGPT.HISTORY_BYTES, help="history buffer size")
+    parser.add_argument("--sliding", action="store_true", help="compact history every turn (HISTORY_STABLE_PREFIX off)")
+    parser.add_argument("--cache", action="store_true", help="leave the reply cache enabled")
+    parser.add_argument("--no-gzip", action="store_true", help="don't send Accept-Encoding (HTTP_COMPRESSION off)")
+    parser.add_argument("--max-tokens", type=int, default=PicoGPT.REPLY_MAX_TOKENS, help="REPLY_MAX_TOKENS, the longest reply asked for")
+    parser.add_argument("--phases", action="store_true", help="also print the app's per-phase timings")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, it slows requests down")
+    parser.add_argument("--keep", action="store_true", help="keep the log and cache files instead of removing them")
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    proc = None
+    base = args.url
+    if base is None:
+        proc, base = mock_server.spawn(args)
+
+    # Keep logs and cache out of the device paths
+    scratch = tempfile.mkdtemp(prefix="picogpt-bench-")
+    PicoGPT.LOG_PATH = os.path.join(scratch, "log.txt")
+    PicoGPT.CACHE_DIR = os.path.join(scratch, "cache")
+    PicoGPT.CACHE_ENABLED = args.cache
+    PicoGPT.HTTP_COMPRESSION = not args.no_gzip
+    PicoGPT.REPLY_MAX_TOKENS = args.max_tokens
+    PicoGPT.HISTORY_STABLE_PREFIX = not args.sliding
+    if args.history_budget:
+        PicoGPT.HISTORY_TOKEN_BUDGET = args.history_budget
+        PicoGPT.HISTORY_REBASE_TOKENS = args.history_budget // 2
+    PicoGPT.API_BASE = base.rstrip("/") + "/v1"
+    PicoGPT.API_BACKEND = args.backend
+    PicoGPT.BACKEND_CACHE = os.path.join(scratch, "backend.json")
+
+    if not args.no_memory:
+        tracemalloc.start()
+    try:
+        print("PicoGPT benchmark against " + PicoGPT.API_BASE)
+        modes = ["plain", "stream"] if args.mode == "both" else [args.mode]
+        for mode in modes:
+            PicoGPT._close_session()
+            report(mode, run_mode(args, mode == "stream"), args)
+    finally:
+        PicoGPT._close_session()
+        PicoGPT.log_flush()
+        if proc is not None:
+            print("mock: " + mock_server.stop(proc))
+        if args.keep:
+            print("log: " + PicoGPT.LOG_PATH)
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
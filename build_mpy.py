@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# build_mpy.py
+# Precompile PicoGPT.py to MicroPython bytecode with mpy-cross
+#
+# Launched as source, the app is compiled on the device every time it
+# starts, which takes most of the launch time and a burst of heap. The
+# build has two files to copy instead of PicoGPT.py:
+#
+#   build/lib/picogpt.mpy    the compiled app, goes to /lib/
+#   build/apps/PicoGPT.py    a three line loader, goes to /apps/
+#
+# mpy-cross has to match the firmware's MicroPython version. Example:
+#
+#   pip install mpy-cross==1.24.1
+#   python3 build_mpy.py --arch armv6m     # RP2040, armv7emsp for the RP2350
+#
+# Settings like OPENAI_API_KEY are compiled in, edit PicoGPT.py first.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+LOADER = """# PicoGPT.py
+# Loader for the precompiled app in /lib/picogpt.mpy, built by build_mpy.py
+from picogpt import start, run, stop
+"""
+
+
+def find_mpy_cross(path=None):
+    """Command line that runs mpy-cross: path, the executable on PATH or the pip module"""
+    if path:
+        return [path]
+    found = shutil.which("mpy-cross")
+    if found:
+        return [found]
+    try:
+        import mpy_cross  # noqa: F401
+
+        return [sys.executable, "-m", "mpy_cross"]
+    except ImportError:
+        raise SystemExit("mpy-cross not found, install it with pip install mpy-cross or pass --mpy-cross")
+
+
+def build(source, out_dir, arch=None, opt=None, mpy_cross=None):
+    """Compile source into out_dir/lib/picogpt.mpy and write the loader, returns both paths"""
+    lib = os.path.join(out_dir, "lib")
+    apps = os.path.join(out_dir, "apps")
+    os.makedirs(lib, exist_ok=True)
+    os.makedirs(apps, exist_ok=True)
+
+    mpy = os.path.join(lib, "picogpt.mpy")
+    command = find_mpy_cross(mpy_cross) + ["-s", "picogpt.py", "-o", mpy]
+    if arch:
+        command.append("-march=" + arch)
+    if opt is not None:
+        command.append("-O{}".format(opt))
+    command.append(source)
+    subprocess.run(command, check=True)
+
+    loader = os.path.join(apps, "PicoGPT.py")
+    with open(loader, "w") as f:
+        f.write(LOADER)
+    return mpy, loader
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompile PicoGPT.py with mpy-cross")
+    parser.add_argument("--source", default=os.path.join(HERE, "PicoGPT.py"))
+    parser.add_argument("--out", default=os.path.join(HERE, "build"), help="output directory")
+    parser.add_argument("--arch", help="native code architecture, like armv6m (RP2040) or armv7emsp (RP2350)")
+    parser.add_argument("--opt", type=int, choices=range(4), help="mpy-cross optimisation level")
+    parser.add_argument("--mpy-cross", help="path of the mpy-cross executable")
+    args = parser.parse_args()
+
+    mpy, loader = build(args.source, args.out, args.arch, args.opt, args.mpy_cross)
+    print("{}: {} bytes (source {} bytes)".format(mpy, os.path.getsize(mpy), os.path.getsize(args.source)))
+    print("{}: loader".format(loader))
+    print("Copy them to /lib/ and /apps/ on the PicoCalc, replacing /apps/PicoGPT.py")
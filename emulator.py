@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# emulator.py
+# Headless Picoware stand-in that runs PicoGPT's start/run/stop on CPython
+#
+# A scripted session drives a fake view_manager (recording draw, scripted
+# input manager, fake wifi) against mock_server.py, measuring every run()
+# frame: time, heap allocations, draw calls and flash writes. Example:
+#
+#   python3 emulator.py --script "idle:50 CENTER CENTER reply DOWN UP idle:50 LEFT"
+#
+# Script steps are button names (UP DOWN LEFT RIGHT CENTER BACK), idle:N for
+# N frames without input, reply to run frames until the request is done and
+# wifi:on / wifi:off to connect or drop WiFi.
+
+import argparse
+import builtins
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import host_shims
+import mock_server
+
+BUTTONS = {
+    "BACK": 1,
+    "LEFT": 2,
+    "RIGHT": 3,
+    "CENTER": 4,
+    "UP": 5,
+    "DOWN": 6,
+}
+
+DEFAULT_SCRIPT = (
+    "idle:50 CENTER idle:5 CENTER reply idle:20 DOWN idle:5 UP idle:50 "
+    "CENTER idle:5 DOWN idle:50 LEFT idle:20 LEFT"
+)
+
+
+class Vector:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class Draw:
+    """Records draw calls, counted per frame"""
+
+    def __init__(self, width=320, height=320):
+        self.size = Vector(width, height)
+        self.counts = {"clear": 0, "text": 0, "swap": 0}
+        self.texts = []  # Text on the buffer being drawn, as (y, x, text)
+        self.screen = []  # Text shown by the last swap
+
+    def clear(self, position, size, color=0):
+        self.counts["clear"] += 1
+        # Text drawn from inside the cleared area is gone, the rest stays
+        right = position.x + size.x
+        bottom = position.y + size.y
+        self.texts = [t for t in self.texts if not (position.x <= t[1] < right and position.y <= t[0] < bottom)]
+
+    def text(self, position, text, color=0xFFFF):
+        self.counts["text"] += 1
+        self.texts.append((position.y, position.x, text))
+
+    def swap(self):
+        self.counts["swap"] += 1
+        self.screen = sorted(self.texts)
+
+
+class InputManager:
+    """Like Picoware's, the last button stays pressed until reset()"""
+
+    def __init__(self):
+        self.button = None
+
+    def press(self, button):
+        self.button = button
+
+    def get_last_button(self):
+        return self.button
+
+    def reset(self):
+        self.button = None
+
+
+class Wifi:
+    def __init__(self, connected=True):
+        self.connected = connected
+
+    def is_connected(self):
+        return self.connected
+
+
+class ViewManager:
+    def __init__(self, wifi=True):
+        self.draw = Draw()
+        self.input_manager = InputManager()
+        self.wifi = Wifi() if wifi else None
+        self.exited = False
+
+    def get_draw(self):
+        return self.draw
+
+    def get_input_manager(self):
+        return self.input_manager
+
+    def get_wifi(self):
+        return self.wifi
+
+    def get_foreground_color(self):
+        return 0xFFFF
+
+    def get_background_color(self):
+        return 0x0000
+
+    def back(self):
+        self.exited = True
+
+
+class Alert:
+    def __init__(self, draw, text, foreground, background):
+        self.draw_target = draw
+        self.text = text
+
+    def draw(self, title):
+        self.draw_target.text(Vector(0, 0), title + ": " + self.text)
+        self.draw_target.swap()
+
+
+def install():
+    """Register host_shims and fake picoware modules, call before importing PicoGPT"""
+    host_shims.install()
+    for name in ("picoware", "picoware.system", "picoware.gui", "picoware.applications", "picoware.applications.wifi"):
+        host_shims._module(name)
+    host_shims._module("picoware.system.vector", Vector=Vector)
+    host_shims._module("picoware.system.buttons", **{"BUTTON_" + k: v for k, v in BUTTONS.items()})
+    host_shims._module("picoware.gui.alert", Alert=Alert)
+    host_shims._module("picoware.applications.wifi.utils", connect_to_saved_wifi=lambda view_manager: None)
+
+
+class Meter:
+    """Per-frame measurements of one run() call"""
+
+    def __init__(self, app, memory=True):
+        self.app = app
+        self.memory = memory
+        self.writes = {"log": 0, "flash": 0}
+        self.slept = 0.0
+
+        # Count files the app opens for writing, the log among them
+        def counting_open(path, mode="r", *args, **kwargs):
+            if "w" in mode or "a" in mode:
+                self.writes["flash"] += 1
+                if path.startswith(app.LOG_PATH):
+                    self.writes["log"] += 1
+            return builtins.open(path, mode, *args, **kwargs)
+
+        app.open = counting_open
+
+        # Time spent in utime.sleep_ms is reported apart from busy time
+        utime = sys.modules["utime"]
+        sleep_ms = utime.sleep_ms
+
+        def counting_sleep_ms(ms):
+            self.slept += ms / 1000
+            sleep_ms(ms)
+
+        utime.sleep_ms = counting_sleep_ms
+
+        # Blocks the measurement itself leaves behind, subtracted from every frame
+        self.overhead = 0
+        self.overhead = self._blocks(lambda: None)
+
+    def _blocks(self, call):
+        blocks = sys.getallocatedblocks()
+        call()
+        return sys.getallocatedblocks() - blocks - self.overhead
+
+    def frame(self, view_manager, step):
+        draw = view_manager.draw
+        before = dict(draw.counts)
+        writes = dict(self.writes)
+        self.slept = 0.0
+        if self.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        blocks = self._blocks(lambda: self.app.run(view_manager))
+        elapsed = time.perf_counter() - started
+        return {
+            "step": step,
+            "ms": elapsed * 1000,
+            "busy_ms": (elapsed - self.slept) * 1000,
+            "peak": tracemalloc.get_traced_memory()[1] - base if self.memory else 0,
+            "blocks": blocks,
+            "draws": sum(draw.counts[k] - before[k] for k in draw.counts),
+            "swaps": draw.counts["swap"] - before["swap"],
+            "log_writes": self.writes["log"] - writes["log"],
+            "flash_writes": self.writes["flash"] - writes["flash"],
+        }
+
+
+def run_session(app, view_manager, meter, script, frame_ms=0, reply_timeout=60):
+    """Run the script, returns one measurement dict per frame"""
+    frames = []
+    for index, step in enumerate(script.split()):
+        if view_manager.exited:
+            break
+        if step.startswith("idle:"):
+            count = int(step[5:])
+        elif step == "reply":
+            count = None
+        elif step in ("wifi:on", "wifi:off"):
+            view_manager.wifi.connected = step == "wifi:on"
+            count = 1
+        elif step.upper() in BUTTONS:
+            view_manager.input_manager.press(BUTTONS[step.upper()])
+            count = 1
+        else:
+            raise ValueError("Unknown script step " + step)
+
+        deadline = time.monotonic() + reply_timeout
+        done = 0
+        while count is None or done < count:
+            frame = meter.frame(view_manager, step)
+            frame["index"] = index
+            frames.append(frame)
+            done += 1
+            if count is None and (app._chat_request is None and app._chat_drain is None or time.monotonic() > deadline):
+                break
+            if frame_ms:
+                time.sleep(frame_ms / 1000)
+    return frames
+
+
+def report(frames):
+    """Print a summary line per script step and for the whole session"""
+    print("{:<12} {:>6} {:>8} {:>8} {:>8} {:>8} {:>7} {:>7} {:>6} {:>6} {:>6}".format(
+        "step", "frames", "ms avg", "ms max", "busy avg", "KB peak", "blocks", "draws/f", "swaps", "log w", "flash w"))
+    groups = []
+    for frame in frames:
+        if not groups or groups[-1][1][0]["index"] != frame["index"]:
+            groups.append((frame["step"], []))
+        groups[-1][1].append(frame)
+    groups.append(("total", frames))
+    for step, group in groups:
+        n = len(group)
+        print("{:<12} {:>6} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.1f} {:>7} {:>7.1f} {:>6} {:>6} {:>6}".format(
+            step[:12],
+            n,
+            sum(f["ms"] for f in group) / n,
+            max(f["ms"] for f in group),
+            sum(f["busy_ms"] for f in group) / n,
+            max(f["peak"] for f in group) / 1024,
+            sum(f["blocks"] for f in group),
+            sum(f["draws"] for f in group) / n,
+            sum(f["swaps"] for f in group),
+            sum(f["log_writes"] for f in group),
+            sum(f["flash_writes"] for f in group),
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run PicoGPT headless and profile its frames")
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="session steps, see the top of this file")
+    parser.add_argument("--frame-ms", type=float, default=5, help="pause between frames, like the Picoware loop")
+    parser.add_argument("--url", help="use a running server at this base URL instead of starting the mock")
+    parser.add_argument("--no-wifi", action="store_true", help="start without wifi")
+    parser.add_argument("--offline", action="store_true", help="start with wifi not connected")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, it slows frames down")
+    parser.add_argument("--debug", action="store_true", help="log at LOG_DEBUG")
+    parser.add_argument("--trace", action="store_true", help="print every frame and the final screen")
+    parser.add_argument("--keep", action="store_true", help="keep the log, cache and chat files instead of removing them")
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    proc = None
+    base = args.url
+    if base is None:
+        proc, base = mock_server.spawn(args)
+
+    install()
+    import PicoGPT
+
+    scratch = tempfile.mkdtemp(prefix="picogpt-emu-")
+    PicoGPT.LOG_PATH = os.path.join(scratch, "log.txt")
+    PicoGPT.CACHE_DIR = os.path.join(scratch, "cache")
+    PicoGPT.API_BASE = base.rstrip("/") + "/v1"
+    PicoGPT.BACKEND_CACHE = os.path.join(scratch, "backend.json")
+    PicoGPT.QUEUE_PATH = os.path.join(scratch, "queue.txt")
+    PicoGPT.ANSWERS_PATH = os.path.join(scratch, "answers.txt")
+    PicoGPT.CHAT_LOG_PATH = os.path.join(scratch, "chat.log")
+    if args.debug:
+        PicoGPT.LOG_LEVEL = PicoGPT.LOG_DEBUG
+
+    view_manager = ViewManager(not args.no_wifi)
+    if args.offline:
+        view_manager.wifi.connected = False
+    meter = Meter(PicoGPT, not args.no_memory)
+    if not args.no_memory:
+        tracemalloc.start()
+    try:
+        if not PicoGPT.start(view_manager):
+            print("start() returned False")
+        else:
+            frames = run_session(PicoGPT, view_manager, meter, args.script, args.frame_ms)
+            if args.trace:
+                for i, f in enumerate(frames):
+                    print("{:5} {:<8} {:7.2f}ms {:6}B draws={} log={}".format(
+                        i, f["step"][:8], f["ms"], f["peak"], f["draws"], f["log_writes"]))
+                for y, x, text in view_manager.draw.screen:
+                    print("| " + text)
+            report(frames)
+    finally:
+        PicoGPT.stop(view_manager)
+        PicoGPT._close_session()
+        if proc is not None:
+            print("mock: " + mock_server.stop(proc))
+        if args.keep:
+            print("log: " + PicoGPT.LOG_PATH)
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+# gateway.py
+# LAN gateway between PicoGPT devices and the OpenAI API
+#
+# Devices talk plain HTTP to the gateway, which holds the API key and a
+# pool of kept-alive TLS connections to the API, so a device does no TLS
+# handshake and keeps no key. Replies come back as bare text, markdown
+# stripped and wrapped to the device's reply view. Example:
+#
+#   OPENAI_API_KEY=sk-... python3 gateway.py --host 0.0.0.0 --token <secret>
+#
+# It only listens on 127.0.0.1 by default. Anyone who can reach it spends
+# the API key, so it refuses any other --host without a --token, which
+# devices then send as their OPENAI_API_KEY. On the device:
+#
+#   API_BASE = "http://<this computer>:8090/v1"
+#   API_BACKEND = "gateway"  # "auto" finds it too
+#
+# Any number of devices are served at once on asyncio, requests to the
+# API share --pool connections.
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import ssl
+import time
+import traceback
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+
+class Options:
+    upstream = "https://api.openai.com/v1"
+    key = None  # API key sent upstream
+    model = None  # Model asked for instead of the device's
+    token = None  # Bearer token devices must send, None lets any device in
+    pool = 4  # Connections to the API
+    timeout = 60  # Seconds to wait for the API
+    verbose = False
+
+
+MAX_COLS = 200  # Widest reply view a device may ask to wrap to
+
+stats = {"requests": 0, "upstream_requests": 0, "upstream_connections": 0, "errors": 0}
+
+
+class UpstreamResponse:
+    """Response from the API, holding its pooled connection until close()"""
+
+    def __init__(self, pool, conn, status, headers):
+        self._pool = pool
+        self._conn = conn
+        self.status = status
+        self.headers = headers
+        self._done = False
+
+    async def chunks(self):
+        """Yield the body as it arrives, for chunked, sized and close-delimited bodies"""
+        reader = self._conn[0]
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            while True:
+                size = int((await self._line()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while (await self._line()).strip():
+                        pass  # Trailers
+                    break
+                data = await self._wait(reader.readexactly(size))
+                await self._line()
+                yield data
+        elif "content-length" in self.headers:
+            left = int(self.headers["content-length"])
+            while left > 0:
+                data = await self._wait(reader.read(min(left, 16384)))
+                if not data:
+                    raise ConnectionError("API closed the connection mid-body")
+                left -= len(data)
+                yield data
+        else:
+            while True:
+                data = await self._wait(reader.read(16384))
+                if not data:
+                    break
+                yield data
+            self.headers["connection"] = "close"
+        self._done = True
+
+    async def read(self):
+        return b"".join([data async for data in self.chunks()])
+
+    async def _line(self):
+        return await self._wait(self._conn[0].readline())
+
+    async def _wait(self, call):
+        return await asyncio.wait_for(call, Options.timeout)
+
+    def close(self):
+        """Give the connection back to the pool, or drop it if the body wasn't read"""
+        if self._conn is None:
+            return
+        reusable = self._done and self.headers.get("connection", "").lower() != "close"
+        self._pool.release(self._conn if reusable else None)
+        if not reusable:
+            self._conn[1].close()
+        self._conn = None
+
+
+class UpstreamPool:
+    """Kept-alive HTTP/1.1 connections to the API, at most size at a time"""
+
+    def __init__(self, base, size):
+        parts = urlsplit(base)
+        self.tls = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.tls else 80)
+        self.prefix = parts.path.rstrip("/")
+        self._ssl = ssl.create_default_context() if self.tls else None
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        stats["upstream_connections"] += 1
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self._ssl, server_hostname=self.host if self.tls else None),
+            Options.timeout,
+        )
+
+    def release(self, conn):
+        if conn is not None:
+            self._idle.append(conn)
+        self._slots.release()
+
+    async def post(self, path, body):
+        """POST body to path under the base URL, returns an UpstreamResponse to close()"""
+        head = (
+            "POST {}/{} HTTP/1.1\r\nHost: {}\r\nAuthorization: Bearer {}\r\n"
+            "Content-Type: application/json\r\nContent-Length: {}\r\nConnection: keep-alive\r\n\r\n"
+        ).format(self.prefix, path, self.host, Options.key, len(body)).encode()
+        await self._slots.acquire()
+        try:
+            while True:
+                conn = None
+                while self._idle and conn is None:
+                    conn = self._idle.pop()
+                    if conn[0].at_eof():
+                        conn[1].close()  # Closed by the API while idle
+                        conn = None
+                reused = conn is not None
+                if conn is None:
+                    conn = await self._connect()
+                try:
+                    conn[1].write(head + body)
+                    await conn[1].drain()
+                    status, headers = await asyncio.wait_for(_read_head(conn[0]), Options.timeout)
+                    break
+                except (OSError, EOFError, asyncio.IncompleteReadError, ValueError):
+                    conn[1].close()
+                    if not reused:
+                        raise
+        except BaseException:
+            self._slots.release()
+            raise
+        stats["upstream_requests"] += 1
+        return UpstreamResponse(self, conn, int(status.split()[1]), headers)
+
+
+async def _read_head(reader):
+    """Status or request line and lower-cased headers, EOFError if the peer closed"""
+    line = await reader.readline()
+    if not line:
+        raise EOFError()
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if not header.strip():
+            break
+        key, _, value = header.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return line.decode("latin-1").strip(), headers
+
+
+class Wrapper:
+    """
+    Reply text with markdown marks stripped, wrapped to cols columns as
+    the device's reply view would. Fed the reply in pieces as it streams
+    in, a word is held back until it's known to be whole.
+    """
+
+    def __init__(self, cols=0, col=0):
+        self.cols = cols  # 0 leaves lines as they are
+        self.col = col  # Column the next word goes to
+        self._word = ""
+        self._line_start = True  # No word on this line yet
+        self._fence = False  # This line is a code fence, dropped whole
+
+    def feed(self, text):
+        out = []
+        for char in text:
+            if char == " " or char == "\n":
+                self._emit(out)
+                if char == "\n":
+                    if not self._fence:
+                        out.append("\n")
+                        self.col = 0
+                    self._line_start = True
+                    self._fence = False
+            else:
+                self._word += char
+        return "".join(out)
+
+    def flush(self):
+        out = []
+        self._emit(out)
+        return "".join(out)
+
+    def _emit(self, out):
+        word = self._strip(self._word)
+        self._word = ""
+        if not word:
+            return
+        gap = 0 if self._line_start else 1
+        if self.col and self.cols and self.col + gap + len(word) > self.cols:
+            out.append("\n")
+            self.col = 0
+        elif gap:
+            out.append(" ")
+            self.col += 1
+        # Words longer than a line are split like the device splits them
+        while self.cols and len(word) > self.cols - self.col:
+            out.append(word[:self.cols - self.col] + "\n")
+            word = word[self.cols - self.col:]
+            self.col = 0
+        out.append(word)
+        self.col += len(word)
+        self._line_start = False
+
+    def _strip(self, word):
+        if self._line_start:
+            if word.startswith("```"):
+                self._fence = True
+                return ""
+            if word.strip("#") == "" or word == ">":
+                return ""  # Heading or quote mark
+            if word in ("*", "+"):
+                return "-"
+        return word.replace("**", "").replace("__", "").replace("`", "")
+
+
+def _reason(status):
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return "Error"  # Like Cloudflare's 520s
+
+
+def _wrap_args(query):
+    """
+    cols and col of a chat request's query string, cols at most MAX_COLS
+    and col within cols. ValueError unless both are whole numbers.
+    """
+    values = []
+    for name in ("cols", "col"):
+        value = query.get(name, ["0"])[0]
+        try:
+            number = int(value)
+        except ValueError:
+            number = -1
+        if number < 0:
+            raise ValueError("{} must be a whole number, not {!r}".format(name, value[:20]))
+        values.append(number)
+    cols = min(values[0], MAX_COLS)
+    return cols, min(values[1], cols)
+
+
+def _upstream_body(body):
+    """The device's request as the API wants it"""
+    if Options.model:
+        body["model"] = Options.model
+    if "max_tokens" in body and urlsplit(Options.upstream).hostname == "api.openai.com":
+        body["max_completion_tokens"] = body.pop("max_tokens")
+    if body.get("stream"):
+        body["stream_options"] = {"include_usage": True}
+    return json.dumps(body).encode()
+
+
+class DeviceHandler:
+    """One device connection, serving its requests one after another"""
+
+    def __init__(self, pool, reader, writer):
+        self.pool = pool
+        self.reader = reader
+        self.writer = writer
+        self.peer = (writer.get_extra_info("peername") or ("?",))[0]
+        self.answering = False  # The response head of this request went out
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    line, headers = await _read_head(self.reader)
+                except EOFError:
+                    break
+                started = time.monotonic()
+                stats["requests"] += 1
+                self.answering = False
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.send_error(400, "Bad Content-Length", "invalid_request_error")
+                    break  # Where the next request starts is unknown
+                body = await self.reader.readexactly(length)
+                try:
+                    status = await self.serve(line, headers, body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    # A bug or an API reply the gateway didn't expect, the device still gets an answer
+                    stats["errors"] += 1
+                    print("{} {} failed:".format(self.peer, line))
+                    traceback.print_exc()
+                    if self.answering:
+                        break  # Mid-reply, closing is the only way to tell the device
+                    status = await self.send_error(500, "Gateway error: {}: {}".format(type(e).__name__, e), "server_error")
+                if Options.verbose:
+                    print("{} {} {} {:.0f}ms".format(self.peer, line, status, (time.monotonic() - started) * 1000))
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def serve(self, line, headers, body):
+        """Answer one request, returns the status sent"""
+        method, target = line.split()[:2]
+        url = urlsplit(target)
+        if url.path.endswith("/picogpt/health"):
+            return await self.send_json(200, {"ok": True, "stats": stats})
+        if not url.path.endswith("/picogpt/chat") or method != "POST":
+            return await self.send_error(404, "Unknown endpoint " + url.path, "invalid_request_error")
+        if Options.token and headers.get("authorization") != "Bearer " + Options.token:
+            return await self.send_error(401, "Wrong or missing gateway token", "invalid_api_key")
+        try:
+            request = json.loads(body)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            return await self.send_error(400, "Request body isn't a JSON object", "invalid_request_error")
+        try:
+            wrapper = Wrapper(*_wrap_args(parse_qs(url.query)))
+        except ValueError as e:
+            return await self.send_error(400, str(e), "invalid_request_error")
+
+        try:
+            resp = await self.pool.post("chat/completions", _upstream_body(request))
+        except (OSError, EOFError, asyncio.TimeoutError, ValueError) as e:
+            stats["errors"] += 1
+            return await self.send_error(502, "API unreachable: {}".format(e), "upstream_unreachable")
+        try:
+            if resp.status != 200:
+                # API errors go to the device as they are, it knows what to retry
+                stats["errors"] += 1
+                extra = {}
+                if "retry-after" in resp.headers:
+                    extra["Retry-After"] = resp.headers["retry-after"]
+                return await self.send(resp.status, "application/json", await resp.read(), extra)
+            if request.get("stream"):
+                return await self.stream(resp, wrapper)
+            reply = json.loads(await resp.read())
+            choice = (reply.get("choices") or [{}])[0]
+            content = (choice.get("message") or {}).get("content") or ""
+            return await self.send_json(200, {
+                "content": wrapper.feed(content) + wrapper.flush(),
+                "finish_reason": choice.get("finish_reason"),
+                "usage": reply.get("usage"),
+            })
+        finally:
+            resp.close()
+
+    async def stream(self, resp, wrapper):
+        """Pass a streamed reply on as {"delta"} events of wrapped text"""
+        self.answering = True
+        self.writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+        )
+        pending = b""
+        async for data in resp.chunks():
+            pending += data
+            events = []
+            while b"\n" in pending:
+                line, pending = pending.split(b"\n", 1)
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    events.append({"delta": wrapper.flush()})
+                    continue
+                event = json.loads(data)
+                if "error" in event:
+                    events.append({"error": event["error"]})
+                if event.get("usage"):
+                    events.append({"usage": event["usage"]})
+                for choice in event.get("choices") or []:
+                    text = wrapper.feed((choice.get("delta") or {}).get("content") or "")
+                    if text:
+                        events.append({"delta": text})
+                    if choice.get("finish_reason"):
+                        events.append({"finish_reason": choice["finish_reason"]})
+            # One write per upstream chunk, so the device gets whole events
+            out = b"".join(b"data: " + json.dumps(e).encode() + b"\n\n" for e in events if e.get("delta") != "")
+            if out:
+                await self.write_chunk(out)
+        await self.write_chunk(b"data: [DONE]\n\n")
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+        return 200
+
+    async def write_chunk(self, data):
+        self.writer.write(b"%x\r\n" % len(data) + data + b"\r\n")
+        await self.writer.drain()
+
+    async def send(self, status, content_type, payload, extra=None):
+        head = "HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n".format(
+            status, _reason(status), content_type, len(payload))
+        for key, value in (extra or {}).items():
+            head += "{}: {}\r\n".format(key, value)
+        self.answering = True
+        self.writer.write(head.encode() + b"Connection: keep-alive\r\n\r\n" + payload)
+        await self.writer.drain()
+        return status
+
+    async def send_json(self, status, obj):
+        return await self.send(status, "application/json", json.dumps(obj).encode())
+
+    async def send_error(self, status, message, kind, code=None):
+        return await self.send_json(status, {"error": {"message": message, "type": kind, "code": code}})
+
+
+def _loopback(host):
+    """True if host only accepts connections from this computer"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+async def serve(host, port):
+    """Run the gateway until cancelled"""
+    pool = UpstreamPool(Options.upstream, Options.pool)
+
+    async def on_connect(reader, writer):
+        await DeviceHandler(pool, reader, writer).run()
+
+    server = await asyncio.start_server(on_connect, host, port)
+    address = server.sockets[0].getsockname()
+    print("PicoGPT gateway on http://{}:{}/v1 for {}".format(address[0], address[1], Options.upstream))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LAN gateway between PicoGPT devices and the OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on, others than loopback need --token")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--upstream", default=Options.upstream, help="base URL of the API")
+    parser.add_argument("--key", default=os.environ.get("OPENAI_API_KEY"), help="API key, defaults to $OPENAI_API_KEY")
+    parser.add_argument("--model", help="model to use whatever the device asks for")
+    parser.add_argument("--token", help="bearer token devices must send (their OPENAI_API_KEY)")
+    parser.add_argument("--pool", type=int, default=Options.pool, help="connections to the API")
+    parser.add_argument("--timeout", type=float, default=Options.timeout, help="seconds to wait for the API")
+    parser.add_argument("--verbose", "-v", action="store_true", help="print every request")
+    args = parser.parse_args()
+    if not args.token and not _loopback(args.host):
+        parser.error("--host {} lets anyone on the network use the API key, also pass --token".format(args.host))
+
+    Options.upstream = args.upstream.rstrip("/")
+    Options.key = args.key or "none"
+    Options.model = args.model
+    Options.token = args.token
+    Options.pool = args.pool
+    Options.timeout = args.timeout
+    Options.verbose = args.verbose
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
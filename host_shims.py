@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# host_shims.py
+# MicroPython modules used by PicoGPT.py, implemented on CPython so the real
+# app code can run on a desktop (bench.py, test_urequests.py)
+
+import binascii
+import hashlib
+import json
+import os
+import select
+import socket
+import ssl
+import sys
+import time
+import types
+import zlib
+
+# Bytes written to and read from shimmed sockets, and into and out of
+# DeflateIO, reset freely by callers
+traffic = {"sent": 0, "received": 0, "connections": 0, "inflated_in": 0, "inflated_out": 0}
+
+_started = time.monotonic()
+
+
+class Socket:
+    """
+    Stream socket with MicroPython semantics: read(n) and readline() block
+    until they have n bytes, a full line or EOF.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._buf = b""
+        self.closed = False
+
+    def _more(self):
+        data = self._sock.recv(4096)
+        traffic["received"] += len(data)
+        self._buf += data
+        return bool(data)
+
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def setblocking(self, flag):
+        self._sock.setblocking(flag)
+
+    def connect(self, addr):
+        self._sock.connect(addr)
+        traffic["connections"] += 1
+
+    def write(self, data):
+        self._sock.sendall(data)
+        traffic["sent"] += len(data)
+        return len(data)
+
+    def read(self, size=-1):
+        while (size < 0 or len(self._buf) < size) and self._more():
+            pass
+        if size < 0:
+            size = len(self._buf)
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+    def readinto(self, buf, nbytes=-1):
+        data = self.read(len(buf) if nbytes < 0 else min(nbytes, len(buf)))
+        buf[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        while b"\n" not in self._buf and self._more():
+            pass
+        end = self._buf.find(b"\n") + 1 or len(self._buf)
+        line, self._buf = self._buf[:end], self._buf[end:]
+        return line
+
+    def pending(self):
+        """Bytes readable without touching the network"""
+        pending = len(self._buf)
+        if isinstance(self._sock, ssl.SSLSocket):
+            pending += self._sock.pending()
+        return pending
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def close(self):
+        self.closed = True
+        self._sock.close()
+
+
+class Poll:
+    """uselect.poll for Socket objects, counting buffered data as readable"""
+
+    def __init__(self):
+        self._socks = []
+
+    def register(self, sock, mask=None):
+        self._socks.append(sock)
+
+    def unregister(self, sock):
+        self._socks.remove(sock)
+
+    def poll(self, timeout=-1):
+        ready = [s for s in self._socks if s.closed or s.pending()]
+        if not ready:
+            wait = None if timeout < 0 else timeout / 1000
+            live = [s for s in self._socks if not s.closed]
+            readable = select.select(live, [], [], wait)[0] if live else []
+            ready = [s for s in self._socks if s in readable]
+        return [(s, 1) for s in ready]
+
+
+class DeflateIO:
+    """
+    MicroPython's deflate.DeflateIO, reading only: pulls compressed bytes from
+    stream.readinto as needed and never more than a read asks for
+    """
+
+    AUTO, RAW, ZLIB, GZIP = 0, 1, 2, 3
+
+    def __init__(self, stream, format=AUTO, wbits=0, close=False):
+        bits = {self.AUTO: 47, self.RAW: -15, self.ZLIB: 15, self.GZIP: 31}[format]
+        self._stream = stream
+        self._inflater = zlib.decompressobj(bits)
+        self._out = b""
+        self._eof = False
+        self._byte = bytearray(1)
+
+    def _more(self):
+        """Inflate one more byte of input, like uzlib does"""
+        if self._inflater.eof or not self._stream.readinto(self._byte):
+            self._eof = True
+            return
+        traffic["inflated_in"] += 1
+        out = self._inflater.decompress(bytes(self._byte))
+        traffic["inflated_out"] += len(out)
+        self._out += out
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._out) < size):
+            self._more()
+        if size < 0:
+            size = len(self._out)
+        data, self._out = self._out[:size], self._out[size:]
+        return data
+
+    def readline(self, size=-1):
+        while not self._eof and b"\n" not in self._out and (size < 0 or len(self._out) < size):
+            self._more()
+        end = self._out.find(b"\n") + 1 or len(self._out)
+        if size >= 0:
+            end = min(end, size)
+        data, self._out = self._out[:end], self._out[end:]
+        return data
+
+
+def _wrap_socket(sock, server_hostname=None):
+    context = ssl.create_default_context()
+    wrapped = Socket(context.wrap_socket(sock._sock, server_hostname=server_hostname))
+    wrapped.closed = sock.closed
+    return wrapped
+
+
+def _ilistdir(path="."):
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        kind = 0x4000 if os.path.isdir(full) else 0x8000
+        yield name, kind, 0, os.path.getsize(full)
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def ticks_ms():
+    return int((time.monotonic() - _started) * 1000)
+
+
+def ticks_us():
+    return int((time.monotonic() - _started) * 1000000)
+
+
+def install():
+    """Register the shims in sys.modules, call before importing PicoGPT"""
+    _module(
+        "ujson",
+        dumps=lambda obj: json.dumps(obj, ensure_ascii=False),
+        loads=json.loads,
+    )
+    _module(
+        "utime",
+        localtime=time.localtime,
+        time=time.time,
+        sleep=time.sleep,
+        sleep_ms=lambda ms: time.sleep(ms / 1000),
+        sleep_us=lambda us: time.sleep(us / 1000000),
+        ticks_ms=ticks_ms,
+        ticks_us=ticks_us,
+        ticks_diff=lambda a, b: a - b,
+        ticks_add=lambda a, b: a + b,
+    )
+    _module(
+        "usocket",
+        getaddrinfo=socket.getaddrinfo,
+        SOCK_STREAM=socket.SOCK_STREAM,
+        socket=lambda *args: Socket(socket.socket(*args)),
+    )
+    _module("ussl", wrap_socket=_wrap_socket)
+    _module("uselect", poll=Poll, POLLIN=1, POLLOUT=4, POLLERR=8, POLLHUP=16)
+    _module(
+        "uos",
+        stat=os.stat,
+        remove=os.remove,
+        rename=os.rename,
+        mkdir=os.mkdir,
+        rmdir=os.rmdir,
+        listdir=os.listdir,
+        ilistdir=_ilistdir,
+    )
+    _module(
+        "deflate",
+        DeflateIO=DeflateIO,
+        AUTO=DeflateIO.AUTO,
+        RAW=DeflateIO.RAW,
+        ZLIB=DeflateIO.ZLIB,
+        GZIP=DeflateIO.GZIP,
+    )
+    _module("uhashlib", sha256=hashlib.sha256)
+    _module("ubinascii", hexlify=binascii.hexlify, unhexlify=binascii.unhexlify)
+
+
+def reset_traffic():
+    for key in traffic:
+        traffic[key] = 0
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# mock_server.py
+# Local stand-in for the OpenAI API, for testing and benchmarking offline
+#
+# Serves /v1/chat/completions and /v1/responses, plain and streaming, and
+# /v1/models over keep-alive HTTP/1.1, gzip or deflate compressed when the
+# client accepts it. Latency, chunking, reply size, errors and which
+# endpoints exist are set on the command line, run with --help.
+
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER = (
+    "The quick brown fox jumps over the lazy dog while a small calculator "
+    "counts the seconds and hums a tune about prime numbers"
+).split()
+
+ERROR_MESSAGES = {
+    401: ("Incorrect API key provided", "invalid_request_error", "invalid_api_key"),
+    429: ("Rate limit reached for requests", "requests", "rate_limit_exceeded"),
+    500: ("The server had an error while processing your request", "server_error", None),
+    503: ("The engine is currently overloaded, please try again later", "server_error", None),
+}
+
+
+class Options:
+    """Behaviour of the mock, shared by all handler threads"""
+
+    latency = 0.0  # Seconds before the response head is sent
+    chunk = 0  # Bytes per write of the body, 0 writes it at once
+    chunk_delay = 0.0  # Seconds between body writes
+    words = 20  # Words in each reply
+    fail_every = 0  # Every nth request fails with fail_status, 0 never
+    fail_rate = 0.0  # Chance of any request failing with fail_status
+    fail_status = 429
+    retry_after = 1  # Retry-After seconds sent with 429 and 503
+    seed = None
+    models = ["gpt-4o-mini"]  # Served by /v1/models
+    endpoints = ["chat", "responses"]  # Others answer 404, like a server without them
+    compress = True  # Compress replies for clients sending Accept-Encoding
+    cache_min = 1024  # Prompt tokens a shared prefix needs before it counts as cached
+
+
+# Counters for the whole run, printed on exit where stop() reads them back
+stats = {"requests": 0, "failed": 0, "connections": 0, "bytes_in": 0, "bytes_out": 0}
+_stats_lock = threading.Lock()
+_random = random.Random()
+_recent = []  # Bodies of the latest requests, for cached prompt tokens
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        stats[key] += n
+        return stats[key]
+
+
+def make_reply(prompt):
+    """Deterministic reply text of Options.words words for a prompt"""
+    words = ["Mock", "reply", "to", "'{}'.".format(prompt[:40])]
+    i = len(prompt)
+    while len(words) < Options.words:
+        words.append(FILLER[i % len(FILLER)])
+        i += 7
+    return " ".join(words[:max(Options.words, 1)])
+
+
+def _last_user_text(body):
+    """The newest user message of a chat/completions or responses request"""
+    messages = body.get("messages") or body.get("input") or ""
+    if isinstance(messages, str):
+        return messages
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content", "")
+            if isinstance(content, list):
+                content = " ".join(part.get("text", "") for part in content)
+            return content
+    return ""
+
+
+def cached_tokens(raw):
+    """
+    Prompt tokens of a request body served from the prompt cache: its
+    longest prefix shared with a recent body, counted like OpenAI does in
+    steps of 128 tokens from Options.cache_min up
+    """
+    with _stats_lock:
+        shared = max([len(os.path.commonprefix([raw, old])) for old in _recent] or [0])
+        _recent.append(raw)
+        del _recent[:-16]
+    tokens = shared // 4
+    return tokens // 128 * 128 if tokens >= Options.cache_min else 0
+
+
+def _usage(body, reply, cached, responses=False):
+    prompt_tokens = len(json.dumps(body.get("messages") or body.get("input") or "")) // 4
+    completion_tokens = len(reply) // 4 + 1
+    cached = min(cached, prompt_tokens)
+    if responses:
+        return {
+            "input_tokens": prompt_tokens,
+            "input_tokens_details": {"cached_tokens": cached},
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached},
+    }
+
+
+def _pieces(text):
+    """Split a reply into streamed deltas of a word or so"""
+    pieces = []
+    start = 0
+    while start < len(text):
+        end = text.find(" ", start + 1)
+        end = len(text) if end < 0 else end
+        pieces.append(text[start:end])
+        start = end
+    return pieces
+
+
+def _sse(data, event=None):
+    line = "data: " + (data if isinstance(data, str) else json.dumps(data)) + "\n\n"
+    if event:
+        line = "event: " + event + "\n" + line
+    return line.encode()
+
+
+def chat_completion(body, reply, cached=0, cut=False):
+    created = int(time.time())
+    if not body.get("stream"):
+        return json.dumps({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": created,
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "length" if cut else "stop",
+            }],
+            "usage": _usage(body, reply, cached),
+        }).encode()
+
+    def chunk(delta, finish=None):
+        return _sse({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        })
+
+    events = [chunk({"role": "assistant", "content": ""})]
+    events += [chunk({"content": piece}) for piece in _pieces(reply)]
+    events.append(chunk({}, "length" if cut else "stop"))
+    if (body.get("stream_options") or {}).get("include_usage"):
+        events.append(_sse({"id": "chatcmpl-mock", "choices": [], "usage": _usage(body, reply, cached)}))
+    events.append(_sse("[DONE]"))
+    return b"".join(events)
+
+
+def response(body, reply, cached=0, cut=False):
+    result = {
+        "id": "resp-mock",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "incomplete" if cut else "completed",
+        "model": body.get("model", "mock"),
+        "output": [{
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": reply}],
+        }],
+        "usage": _usage(body, reply, cached, True),
+    }
+    if not body.get("stream"):
+        return json.dumps(result).encode()
+
+    events = [_sse({"type": "response.created", "response": dict(result, status="in_progress", output=[])}, "response.created")]
+    for piece in _pieces(reply):
+        events.append(_sse({"type": "response.output_text.delta", "delta": piece}, "response.output_text.delta"))
+    events.append(_sse({"type": "response.output_text.done", "text": reply}, "response.output_text.done"))
+    done = "response.incomplete" if cut else "response.completed"
+    events.append(_sse({"type": done, "response": result}, done))
+    return b"".join(events)
+
+
+ENDPOINTS = {
+    "/v1/chat/completions": ("chat", chat_completion),
+    "/v1/responses": ("responses", response),
+}
+
+
+def _model(model_id):
+    return {"id": model_id, "object": "model", "created": 0, "owned_by": "mock"}
+
+
+def _compressor(encoding):
+    return zlib.compressobj(wbits=31 if encoding == "gzip" else 15)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        _count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        _count("requests")
+        path = self.path.split("?")[0]
+        if path == "/v1/models":
+            return self._json(200, {"object": "list", "data": [_model(m) for m in Options.models]})
+        if path.startswith("/v1/models/") and path[len("/v1/models/"):] in Options.models:
+            return self._json(200, _model(path[len("/v1/models/"):]))
+        return self._error(404, "Unknown model or endpoint " + self.path, "invalid_request_error", "model_not_found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        n = _count("requests")
+        _count("bytes_in", len(raw))
+
+        name, endpoint = ENDPOINTS.get(self.path.split("?")[0], (None, None))
+        if name not in Options.endpoints:
+            return self._error(404, "Unknown endpoint " + self.path, "invalid_request_error")
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            return self._error(400, "We could not parse the JSON body of your request", "invalid_request_error")
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._error(401, *ERROR_MESSAGES[401])
+
+        if Options.latency:
+            time.sleep(Options.latency)
+        failing = Options.fail_every and n % Options.fail_every == 0
+        if failing or (Options.fail_rate and _random.random() < Options.fail_rate):
+            _count("failed")
+            status = Options.fail_status
+            return self._error(status, *ERROR_MESSAGES.get(status, ("Mock failure", "server_error", None)))
+
+        reply = make_reply(_last_user_text(body))
+        limit = body.get("max_tokens") or body.get("max_completion_tokens") or body.get("max_output_tokens")
+        words = reply.split(" ")
+        cut = bool(limit) and len(words) > limit
+        if cut:
+            # A word per token, close enough to show shorter replies finishing sooner
+            reply = " ".join(words[:limit])
+        payload = endpoint(body, reply, cached_tokens(raw), cut)
+        encoding = self._encoding()
+        self.send_response(200)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if body.get("stream"):
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self._write_body(payload, True, encoding)
+        else:
+            if encoding:
+                compressor = _compressor(encoding)
+                payload = compressor.compress(payload) + compressor.flush()
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self._write_body(payload, False)
+
+    def _encoding(self):
+        """gzip or deflate if the client accepts it, None for plain bodies"""
+        if not Options.compress:
+            return None
+        accepted = [e.split(";")[0].strip() for e in self.headers.get("Accept-Encoding", "").split(",")]
+        for encoding in ("gzip", "deflate"):
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def _write_body(self, payload, chunked, encoding=None):
+        """
+        Write payload Options.chunk bytes at a time, as HTTP chunks if chunked.
+        With an encoding each write is compressed and flushed on its own, like
+        a server streaming events.
+        """
+        compressor = _compressor(encoding) if encoding else None
+        size = Options.chunk or len(payload)
+        for start in range(0, len(payload), size):
+            if start and Options.chunk_delay:
+                time.sleep(Options.chunk_delay)
+            part = payload[start:start + size]
+            if compressor:
+                part = compressor.compress(part) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._write_part(part, chunked)
+        if compressor:
+            self._write_part(compressor.flush(), chunked)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _write_part(self, part, chunked):
+        if chunked:
+            part = b"%x\r\n" % len(part) + part + b"\r\n"
+        self.wfile.write(part)
+        self.wfile.flush()
+        _count("bytes_out", len(part))
+
+    def _error(self, status, message, kind, code=None):
+        self._json(status, {"error": {"message": message, "type": kind, "param": None, "code": code}})
+
+    def _json(self, status, obj):
+        payload = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if status in (429, 503):
+            self.send_header("Retry-After", str(Options.retry_after))
+        self.end_headers()
+        self.wfile.write(payload)
+        _count("bytes_out", len(payload))
+
+
+def serve(host="127.0.0.1", port=0):
+    """Start the mock on a background thread and return the server"""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    """Mock options as command line arguments, shared with bench.py"""
+    parser.add_argument("--latency", type=float, default=0, help="ms before each response starts")
+    parser.add_argument("--chunk", type=int, default=0, help="bytes per body write (default: all at once)")
+    parser.add_argument("--chunk-delay", type=float, default=0, help="ms between body writes")
+    parser.add_argument("--words", type=int, default=Options.words, help="words per reply")
+    parser.add_argument("--fail-every", type=int, default=0, help="fail every nth request")
+    parser.add_argument("--fail-rate", type=float, default=0, help="chance of a request failing")
+    parser.add_argument("--fail-status", type=int, default=429, help="HTTP status of failures")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds on 429/503")
+    parser.add_argument("--seed", type=int, help="random seed for --fail-rate")
+    parser.add_argument("--no-compress", action="store_true", help="ignore Accept-Encoding, send plain bodies")
+    parser.add_argument("--cache-min", type=int, default=Options.cache_min,
+                        help="prompt tokens a shared prefix needs to count as cached")
+    parser.add_argument("--models", default=",".join(Options.models), help="comma separated models to serve")
+    parser.add_argument("--endpoints", default=",".join(Options.endpoints),
+                        help="comma separated APIs to serve, chat and/or responses")
+
+
+def configure(args):
+    Options.latency = args.latency / 1000
+    Options.chunk = args.chunk
+    Options.chunk_delay = args.chunk_delay / 1000
+    Options.words = args.words
+    Options.fail_every = args.fail_every
+    Options.fail_rate = args.fail_rate
+    Options.fail_status = args.fail_status
+    Options.retry_after = args.retry_after
+    Options.compress = not args.no_compress
+    Options.cache_min = args.cache_min
+    Options.models = args.models.split(",")
+    Options.endpoints = args.endpoints.split(",")
+    _random.seed(args.seed)
+
+
+def option_args(args):
+    """Command line for a mock_server.py process with the same options as args"""
+    return [
+        "--latency", str(args.latency),
+        "--chunk", str(args.chunk),
+        "--chunk-delay", str(args.chunk_delay),
+        "--words", str(args.words),
+        "--fail-every", str(args.fail_every),
+        "--fail-rate", str(args.fail_rate),
+        "--fail-status", str(args.fail_status),
+        "--retry-after", str(args.retry_after),
+        "--models", args.models,
+        "--endpoints", args.endpoints,
+        "--cache-min", str(args.cache_min),
+    ] + (["--no-compress"] if args.no_compress else []) + (["--seed", str(args.seed)] if args.seed is not None else [])
+
+
+def spawn(args):
+    """Run mock_server.py in its own process on a free port, returns (process, base url)"""
+    script = os.path.abspath(__file__)
+    proc = subprocess.Popen(
+        [sys.executable, script, "--port", "0"] + option_args(args),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    line = proc.stdout.readline()
+    if not line.startswith("Listening on "):
+        proc.kill()
+        raise RuntimeError("mock_server.py did not start: " + line)
+    proc.stdout.readline()
+    return proc, line.split()[-1]
+
+
+def stop(proc):
+    """Stop a spawned mock and return its stats line"""
+    proc.send_signal(signal.SIGINT)
+    out = proc.communicate(timeout=5)[0]
+    for line in out.splitlines():
+        if line.startswith("Stats: "):
+            return line[len("Stats: "):]
+    return ""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    host, port = server.server_address[:2]
+    print("Listening on http://{}:{}".format(host, port), flush=True)
+    print("Set API_BASE in PicoGPT.py to http://<this machine>:{}/v1".format(port), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stats: " + json.dumps(stats), flush=True)
+        sys.exit(0)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# replay.py
+# Replay real sessions from /error_log.txt against a mock API or gateway
+#
+# Reads device logs (the current "[time] L msg" lines and the older
+# "[time] msg" ones), splits them into sessions at the STATS line the app
+# logs on exit or at long pauses, and asks each session's questions with
+# the app's own request steps, history carried, in the gaps the user left
+# between them. Like on the device, a step runs once per frame, so idle
+# workers sleep instead of spinning. --speed compresses time (0 asks as fast as replies come
+# back). Every log file is taken as one device, all starting together,
+# with its sessions as far apart as logged up to --max-idle, and sessions
+# run in --parallel worker processes. Each session starts the app afresh,
+# with its own files, so breaker, backend and caches don't carry over
+# from the session the worker ran before. Reports throughput, latency
+# percentiles and error rates next to what the log itself recorded.
+# Example:
+#
+#   python3 replay.py error_log.txt --speed 60 --parallel 16 --copies 4 --latency 300
+#   python3 replay.py logs/*.txt --url http://192.168.1.20:8090 --backend gateway
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import mock_server
+from bench import percentile
+
+# "[2025-01-02 03:04:05] I msg", "[2025-01-02 03:04:05] msg" or "[unknown] ..."
+LINE = re.compile(r"\[([^\]]*)\] (?:([DIWE]) )?(.*)")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class Question:
+    def __init__(self, at, text):
+        self.at = at  # Seconds since the session started
+        self.text = text
+        self.statuses = []  # RESPONSE statuses logged for it, one per attempt
+        self.error = None  # First ERROR or EXCEPTION logged for it
+        self.payload = False
+
+
+class Session:
+    def __init__(self, source, start, offset):
+        self.source = source  # "file:line" of the first line
+        self.start = start  # Epoch seconds
+        self.offset = offset  # Seconds from the start of its log, idle time capped
+        self.questions = []
+
+
+def _epoch(stamp, last):
+    try:
+        return time.mktime(time.strptime(stamp, TIME_FORMAT))
+    except ValueError:
+        return last  # "unknown", the clock wasn't readable
+
+
+def parse_logs(paths, gap=900, max_idle=3600):
+    """Sessions in the log files, split at STATS lines and pauses over gap seconds"""
+    sessions = []
+    for path in paths:
+        session = None
+        last = None
+        clock = 0  # Replay time of the last line
+        with open(path, errors="replace") as f:
+            for number, line in enumerate(f, 1):
+                match = LINE.match(line.rstrip("\n"))
+                if not match:
+                    continue  # Traceback lines of an EXCEPTION DETAILS
+                stamp, _, msg = match.groups()
+                now = _epoch(stamp, last)
+                if now is None:
+                    now = 0
+                if last is not None:
+                    clock += min(max(now - last, 0), max_idle)
+                # Devices without NTP restart their clock at boot, so time going back is a new session too
+                if session is None or (last is not None and (now - last > gap or now < last)):
+                    session = Session("{}:{}".format(path, number), now, clock)
+                    sessions.append(session)
+                last = now
+                _parse_message(session, now, msg)
+                if msg.startswith("STATS "):
+                    session = None
+    return [s for s in sessions if s.questions]
+
+
+def _parse_message(session, now, msg):
+    """Add what one log message says to session"""
+    questions = session.questions
+    if msg.startswith("SUBMIT: Sending question: "):
+        questions.append(Question(now - session.start, msg[len("SUBMIT: Sending question: "):]))
+    elif msg.startswith("REQUEST: Payload="):
+        if questions and not questions[-1].payload:
+            questions[-1].payload = True
+            return
+        # Asked without a SUBMIT line, like test_urequests.py runs, the question is the last user message
+        try:
+            payload = json.loads(msg[len("REQUEST: Payload="):])
+            messages = payload.get("messages") or payload.get("input") or []
+            text = [m["content"] for m in messages if m.get("role") == "user"][-1]
+        except (ValueError, KeyError, IndexError, AttributeError, TypeError):
+            return
+        questions.append(Question(now - session.start, text))
+        questions[-1].payload = True
+    elif not questions:
+        return
+    elif msg.startswith("RESPONSE: Status="):
+        try:
+            questions[-1].statuses.append(int(msg.split("=", 1)[1]))
+        except ValueError:
+            pass
+    elif msg.startswith(("ERROR: ", "EXCEPTION: ")) and questions[-1].error is None:
+        questions[-1].error = msg.split(": ", 1)[1][:80]
+
+
+# Worker processes, each importing PicoGPT anew per session since the app keeps its state in globals
+_options = None
+
+
+def _init_worker(options):
+    global _options
+    import host_shims
+
+    host_shims.install()
+    _options = options
+
+
+def _load_app(scratch):
+    """PicoGPT as on a fresh launch, its files in scratch"""
+    sys.modules.pop("PicoGPT", None)
+    import PicoGPT
+
+    PicoGPT.LOG_PATH = os.path.join(scratch, "log.txt")
+    PicoGPT.CACHE_DIR = os.path.join(scratch, "cache")
+    PicoGPT.BACKEND_CACHE = os.path.join(scratch, "backend.json")
+    PicoGPT.QUEUE_PATH = os.path.join(scratch, "queue.txt")
+    PicoGPT.ANSWERS_PATH = os.path.join(scratch, "answers.txt")
+    PicoGPT.CHAT_LOG_PATH = os.path.join(scratch, "chat.log")
+    PicoGPT.CACHE_ENABLED = _options["cache"]
+    PicoGPT.API_BASE = _options["base"]
+    PicoGPT.API_BACKEND = _options["backend"]
+    return PicoGPT
+
+
+def _replay_session(job):
+    """Ask one session's questions on its schedule, returns a result dict per question"""
+    with tempfile.TemporaryDirectory(prefix="picogpt-replay-") as scratch:
+        return _replay_questions(_load_app(scratch), *job)
+
+
+def _replay_questions(app, texts, offsets, begin, stream, frame):
+    """Ask texts with app, each at begin plus its offset"""
+    history = app._History()
+    results = []
+    for text, offset in zip(texts, offsets):
+        due = begin + offset
+        wait = due - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        first = []
+
+        def on_delta(fragment):
+            if not first:
+                first.append(time.perf_counter())
+
+        error = None
+        late = max(0.0, time.time() - due) * 1000
+        started = time.perf_counter()
+        try:
+            for _ in app._ask_steps(text, history, on_delta if stream else None):
+                time.sleep(frame)
+        except Exception as e:
+            error = type(e).__name__ + (" {}".format(e.status) if hasattr(e, "status") else "")
+        done = time.perf_counter()
+        results.append({
+            "latency": (done - started) * 1000,
+            "first": ((first[0] if first else done) - started) * 1000,
+            "late": late,
+            "error": error,
+        })
+    app._close_session()
+    app.log_flush()
+    return results
+
+
+def schedule(sessions, speed, copies):
+    """(texts, offsets, start) per replayed session, offsets and starts in seconds from the run's start"""
+    scale = 1.0 / speed if speed else 0.0
+    jobs = []
+    for copy in range(copies):
+        for s in sessions:
+            jobs.append(([q.text for q in s.questions], [q.at * scale for q in s.questions], s.offset * scale))
+    jobs.sort(key=lambda job: job[2])
+    return jobs
+
+
+def _line(name, values):
+    return "  {:<13} p50 {:8.1f}  p90 {:8.1f}  p95 {:8.1f}  p99 {:8.1f}  max {:8.1f}".format(
+        name, percentile(values, 50), percentile(values, 90), percentile(values, 95),
+        percentile(values, 99), max(values) if values else 0)
+
+
+def report(sessions, results, wall, args):
+    questions = [q for s in sessions for q in s.questions]
+    logged_errors = sum(1 for q in questions if q.error)
+    logged_retries = sum(max(0, len(q.statuses) - 1) for q in questions)
+    print("log: {} sessions, {} questions, {} failed ({:.1f}%), {} retried attempts".format(
+        len(sessions), len(questions), logged_errors, logged_errors * 100 / len(questions), logged_retries))
+
+    ok = [r for r in results if not r["error"]]
+    failed = len(results) - len(ok)
+    print("replay: {} sessions, {} questions in {:.1f}s, {:.2f} questions/s, {} failed ({:.1f}%)".format(
+        len(sessions) * args.copies, len(results), wall, len(results) / wall if wall else 0,
+        failed, failed * 100 / len(results) if results else 0))
+    print(_line("latency ms", [r["latency"] for r in ok]))
+    if not args.plain:
+        print(_line("first text ms", [r["first"] for r in ok]))
+    # Questions asked later than scheduled, because a worker was busy or the previous reply took long
+    print(_line("late ms", [r["late"] for r in results]))
+    for error, count in Counter(r["error"] for r in results if r["error"]).most_common(5):
+        print("  error: {} x{}".format(error, count))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay sessions from PicoGPT logs against a mock API or gateway")
+    parser.add_argument("logs", nargs="+", help="error_log.txt files copied from devices")
+    parser.add_argument("--speed", type=float, default=1, help="time compression, 60 replays an hour in a minute, 0 doesn't wait")
+    parser.add_argument("--parallel", "-p", type=int, default=8, help="worker processes, sessions running at once")
+    parser.add_argument("--copies", type=int, default=1, help="replay every session this many times, for more load")
+    parser.add_argument("--gap", type=float, default=900, help="seconds of silence that end a session")
+    parser.add_argument("--max-idle", type=float, default=3600, help="longest wait between sessions of one log")
+    parser.add_argument("--url", help="use a running server (mock or gateway.py) at this base URL instead of starting the mock")
+    parser.add_argument("--backend", choices=["auto", "chat", "responses", "gateway"], default="auto", help="API_BACKEND to use")
+    parser.add_argument("--plain", action="store_true", help="don't stream replies")
+    parser.add_argument("--frame-ms", type=float, default=5, help="pause between request steps, like the Picoware loop")
+    parser.add_argument("--cache", action="store_true", help="leave the reply cache enabled, within each session")
+    parser.add_argument("--list", action="store_true", help="print the sessions found and exit")
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    sessions = parse_logs(args.logs, args.gap, args.max_idle)
+    if not sessions:
+        raise SystemExit("No questions found in " + ", ".join(args.logs))
+    if args.list:
+        for s in sessions:
+            print("{} at +{:.0f}s, {} questions over {:.0f}s".format(
+                s.source, s.offset, len(s.questions), s.questions[-1].at))
+            for q in s.questions:
+                print("  +{:5.0f}s {} {}".format(q.at, q.statuses or "", q.text[:60]))
+        raise SystemExit()
+
+    proc = None
+    base = args.url
+    if base is None:
+        proc, base = mock_server.spawn(args)
+    options = {"base": base.rstrip("/") + "/v1", "backend": args.backend, "cache": args.cache}
+    print("PicoGPT replay against {}, speed {:g}, {} workers".format(options["base"], args.speed, args.parallel))
+
+    try:
+        with multiprocessing.Pool(args.parallel, _init_worker, (options,)) as pool:
+            begin = time.time() + 0.5  # Time for the workers to start
+            jobs = [(texts, offsets, begin + start, not args.plain, args.frame_ms / 1000)
+                    for texts, offsets, start in schedule(sessions, args.speed, args.copies)]
+            results = [r for session in pool.imap_unordered(_replay_session, jobs) for r in session]
+            wall = time.time() - begin
+        report(sessions, results, wall, args)
+    finally:
+        if proc is not None:
+            print("mock: " + mock_server.stop(proc))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# startup_bench.py
+# Time PicoGPT's cold start: import, start() and the first run() frame
+#
+# Every run is a fresh interpreter, so nothing is imported already. By
+# default it runs CPython with emulator.py's fake Picoware, which shows
+# what start() itself costs. With --micropython it runs the unix port of
+# MicroPython instead, importing PicoGPT.py as source and, when --mpy is
+# given, the build from build_mpy.py (built without --arch). Example:
+#
+#   python3 startup_bench.py --runs 10
+#   python3 build_mpy.py && python3 startup_bench.py --micropython micropython --mpy build/lib/picogpt.mpy
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Run by each CPython child, prints one JSON line
+CPYTHON_CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {here!r})
+import emulator
+emulator.install()
+t0 = time.perf_counter()
+import PicoGPT as app
+t1 = time.perf_counter()
+scratch = {scratch!r}
+app.LOG_PATH = os.path.join(scratch, "log.txt")
+app.CACHE_DIR = os.path.join(scratch, "cache")
+app.BACKEND_CACHE = os.path.join(scratch, "backend.json")
+app.QUEUE_PATH = os.path.join(scratch, "queue.txt")
+app.ANSWERS_PATH = os.path.join(scratch, "answers.txt")
+app.CHAT_LOG_PATH = os.path.join(scratch, "chat.log")
+view_manager = emulator.ViewManager()
+app.start(view_manager)
+t2 = time.perf_counter()
+app.run(view_manager)
+t3 = time.perf_counter()
+app.stop(view_manager)
+print(json.dumps({{"import": (t1 - t0) * 1000, "start": (t2 - t1) * 1000, "frame": (t3 - t2) * 1000}}))
+"""
+
+# Picoware stand-ins for the unix port, path relative to the temp dir
+MICROPYTHON_MODULES = {
+    "picoware/__init__.py": "",
+    "picoware/system/__init__.py": "",
+    "picoware/system/vector.py": (
+        "class Vector:\n"
+        "    def __init__(self, x, y):\n"
+        "        self.x = x\n"
+        "        self.y = y\n"
+    ),
+    "picoware/system/buttons.py": (
+        "BUTTON_BACK = 1\nBUTTON_LEFT = 2\nBUTTON_RIGHT = 3\n"
+        "BUTTON_CENTER = 4\nBUTTON_UP = 5\nBUTTON_DOWN = 6\n"
+    ),
+    "picoware/gui/__init__.py": "",
+    "picoware/gui/alert.py": (
+        "class Alert:\n"
+        "    def __init__(self, *args):\n"
+        "        pass\n"
+        "    def draw(self, title):\n"
+        "        pass\n"
+    ),
+    "picoware/applications/__init__.py": "",
+    "picoware/applications/wifi/__init__.py": "",
+    "picoware/applications/wifi/utils.py": "def connect_to_saved_wifi(view_manager):\n    pass\n",
+}
+
+# Run by each MicroPython child, prints one RESULT line
+MICROPYTHON_CHILD = """
+import gc, sys, time
+sys.path.insert(0, {root!r})
+from picoware.system.vector import Vector
+
+class Draw:
+    def __init__(self):
+        self.size = Vector(320, 320)
+    def clear(self, *args):
+        pass
+    def text(self, *args):
+        pass
+    def swap(self):
+        pass
+
+class InputManager:
+    def get_last_button(self):
+        return None
+    def reset(self):
+        pass
+
+class Wifi:
+    def is_connected(self):
+        return True
+
+class ViewManager:
+    def __init__(self):
+        self.draw = Draw()
+        self.input_manager = InputManager()
+        self.wifi = Wifi()
+    def get_draw(self):
+        return self.draw
+    def get_input_manager(self):
+        return self.input_manager
+    def get_wifi(self):
+        return self.wifi
+    def get_foreground_color(self):
+        return 0xFFFF
+    def get_background_color(self):
+        return 0
+    def back(self):
+        pass
+
+gc.collect()
+free = gc.mem_free()
+t0 = time.ticks_us()
+import {module} as app
+t1 = time.ticks_us()
+heap = free - gc.mem_free()
+scratch = {scratch!r}
+app.LOG_PATH = scratch + "/log.txt"
+app.CACHE_DIR = scratch + "/cache"
+app.BACKEND_CACHE = scratch + "/backend.json"
+app.QUEUE_PATH = scratch + "/queue.txt"
+app.ANSWERS_PATH = scratch + "/answers.txt"
+app.CHAT_LOG_PATH = scratch + "/chat.log"
+view_manager = ViewManager()
+app.start(view_manager)
+t2 = time.ticks_us()
+app.run(view_manager)
+t3 = time.ticks_us()
+app.stop(view_manager)
+print("RESULT", time.ticks_diff(t1, t0), time.ticks_diff(t2, t1), time.ticks_diff(t3, t2), heap)
+"""
+
+
+def run_cpython():
+    """One cold start under CPython, returns ms per phase"""
+    scratch = tempfile.mkdtemp(prefix="picogpt-startup-")
+    try:
+        code = CPYTHON_CHILD.format(here=HERE, scratch=scratch)
+        out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def run_micropython(binary, app_file, module):
+    """One cold start under the unix port, returns ms per phase and import heap bytes"""
+    root = tempfile.mkdtemp(prefix="picogpt-startup-")
+    try:
+        for path, text in MICROPYTHON_MODULES.items():
+            full = os.path.join(root, path)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            with open(full, "w") as f:
+                f.write(text)
+        shutil.copy(app_file, os.path.join(root, os.path.basename(app_file)))
+        scratch = os.path.join(root, "scratch")
+        os.mkdir(scratch)
+        code = MICROPYTHON_CHILD.format(root=root, module=module, scratch=scratch)
+        out = subprocess.run([binary, "-c", code], check=True, capture_output=True, text=True).stdout
+        for line in out.splitlines():
+            if line.startswith("RESULT "):
+                us = [int(v) for v in line.split()[1:]]
+                return {"import": us[0] / 1000, "start": us[1] / 1000, "frame": us[2] / 1000, "heap": us[3]}
+        raise RuntimeError("no result from " + binary + ": " + out)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def report(name, results):
+    print(name + " ({} runs)".format(len(results)))
+    for phase in ("import", "start", "frame"):
+        values = [r[phase] for r in results]
+        print("  {:<7} ms  min {:8.2f}  avg {:8.2f}  max {:8.2f}".format(
+            phase, min(values), sum(values) / len(values), max(values)))
+    if "heap" in results[0]:
+        print("  import heap  {:8.0f} bytes".format(sum(r["heap"] for r in results) / len(results)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time PicoGPT's cold start")
+    parser.add_argument("--runs", "-n", type=int, default=5, help="fresh interpreters per mode")
+    parser.add_argument("--micropython", metavar="BIN", help="run the MicroPython unix port instead of CPython")
+    parser.add_argument("--mpy", help="picogpt.mpy from build_mpy.py, compared with the source (needs --micropython)")
+    args = parser.parse_args()
+
+    if args.micropython is None:
+        report("cpython source", [run_cpython() for _ in range(args.runs)])
+    else:
+        source = os.path.join(HERE, "PicoGPT.py")
+        report("micropython source", [run_micropython(args.micropython, source, "PicoGPT") for _ in range(args.runs)])
+        if args.mpy:
+            report("micropython mpy", [run_micropython(args.micropython, args.mpy, "picogpt") for _ in range(args.runs)])
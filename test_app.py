@@ -0,0 +1,1016 @@
+#!/usr/bin/env python3
+# test_app.py
+# Unit tests for PicoGPT.py's parsers, buffers and requests, run on your Mac
+#
+# Like test_urequests.py this imports the real app through host_shims.py,
+# with emulator.py's fake Picoware modules for tests that run start().
+# Tests that make requests run mock_server.py in a thread. Runs with
+# python3 -m unittest or pytest:
+#
+#   python3 test_app.py
+
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+import zlib
+from http.server import ThreadingHTTPServer
+
+import emulator
+import gateway
+import mock_server
+
+emulator.install()
+import PicoGPT  # noqa: E402 - needs the shims in place
+
+# Log lines go here instead of the device's log, removed at exit
+_scratch = tempfile.TemporaryDirectory(prefix="picogpt-test-")
+PicoGPT.LOG_PATH = os.path.join(_scratch.name, "log.txt")
+
+
+def pick(chunks, fields=PicoGPT._CHAT_FIELDS):
+    picker = PicoGPT._JsonPicker(fields)
+    for chunk in chunks:
+        picker.feed(chunk)
+    return picker.found
+
+
+def splits(data):
+    """data cut in two at every position"""
+    for i in range(len(data) + 1):
+        yield [data[:i], data[i:]]
+
+
+def run(steps):
+    """Run one of the app's generators to the end, returns its value"""
+    try:
+        while True:
+            next(steps)
+    except StopIteration as e:
+        return e.value
+
+
+_mock = None
+
+
+def mock_base():
+    """API_BASE of mock_server.py, started in a thread on first use"""
+    global _mock
+    if _mock is None:
+        _mock = ThreadingHTTPServer(("127.0.0.1", 0), mock_server.MockHandler)
+        _mock.daemon_threads = True
+        threading.Thread(target=_mock.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{}/v1".format(_mock.server_address[1])
+
+
+class AppTest(unittest.TestCase):
+    """
+    The app asking mock_server.py, with its files in a temporary directory.
+    The app's globals and the mock's options are put back after each test.
+    """
+
+    FILES = {
+        "LOG_PATH": "log.txt", "CACHE_DIR": "cache", "BACKEND_CACHE": "backend.json",
+        "QUEUE_PATH": "queue.txt", "ANSWERS_PATH": "answers.txt", "CHAT_LOG_PATH": "chat.log",
+    }
+
+    def setUp(self):
+        self.state = dict(vars(PicoGPT))
+        self.options = {k: v for k, v in vars(mock_server.Options).items() if not k.startswith("__")}
+        self.dir = tempfile.TemporaryDirectory()
+        for name, file in self.FILES.items():
+            setattr(PicoGPT, name, os.path.join(self.dir.name, file))
+        PicoGPT.API_BASE = mock_base()
+        PicoGPT.API_BACKEND = "chat"
+        PicoGPT.CACHE_ENABLED = False
+
+    def tearDown(self):
+        PicoGPT._close_session()
+        PicoGPT.log_flush()  # Into the temporary directory, not the device's log
+        vars(PicoGPT).update(self.state)
+        for name, value in self.options.items():
+            setattr(mock_server.Options, name, value)
+        self.dir.cleanup()
+
+    def requests(self):
+        """Requests the mock has had"""
+        return mock_server.stats["requests"]
+
+    def ask(self, text, history=None, stream=False):
+        """ask_model's reply and the fragments it streamed"""
+        deltas = []
+        reply = PicoGPT.ask_model(text, history, deltas.append if stream else None)
+        return reply, deltas
+
+
+class JsonPickerTest(unittest.TestCase):
+    BODY = json.dumps({
+        "id": "chatcmpl-1",
+        "meta": {"choices": [{"message": {"content": "not this one"}}], "list": [1, [2, {"x": None}]]},
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": "Hi \"there\"\\ \n café ☃"},
+             "finish_reason": "stop"},
+            {"index": 1, "message": {"content": "second choice"}, "finish_reason": "length"},
+        ],
+        "usage": {"prompt_tokens": 9, "completion_tokens": 3, "prompt_tokens_details": {"cached_tokens": 0}},
+    }, ensure_ascii=False).encode()
+    EXPECTED = {
+        "content": "Hi \"there\"\\ \n café ☃",
+        "finish_reason": "stop",
+        "usage": {"prompt_tokens": 9, "completion_tokens": 3, "prompt_tokens_details": {"cached_tokens": 0}},
+    }
+
+    def test_whole_body(self):
+        self.assertEqual(pick([self.BODY]), self.EXPECTED)
+
+    def test_every_split(self):
+        # Cuts land inside keys, escapes, numbers and multi-byte characters
+        for chunks in splits(self.BODY):
+            self.assertEqual(pick(chunks), self.EXPECTED, chunks)
+
+    def test_byte_at_a_time(self):
+        self.assertEqual(pick([self.BODY[i:i + 1] for i in range(len(self.BODY))]), self.EXPECTED)
+
+    def test_escaped_unicode(self):
+        body = b'{"choices":[{"message":{"content":"\\u00e9\\ud83d\\ude00\\t\\/"}}]}'
+        for chunks in splits(body):
+            self.assertEqual(pick(chunks)["content"], "é\U0001F600\t/")
+
+    def test_error_body(self):
+        body = b'{"error": {"message": "Bad key", "type": "invalid_request_error", "code": "invalid_api_key"}}'
+        self.assertEqual(pick([body]), {"error": "Bad key", "error_code": "invalid_api_key"})
+
+    def test_responses_fields(self):
+        body = json.dumps({
+            "status": "completed",
+            "output": [{"type": "reasoning", "summary": []}, {"content": [{"type": "output_text", "text": "Done"}]}],
+        }).encode()
+        for chunks in splits(body):
+            found = pick(chunks, PicoGPT._RESPONSES_FIELDS)
+            self.assertEqual((found["content"], found["finish_reason"]), ("Done", "completed"))
+
+
+class HistoryTest(unittest.TestCase):
+    def body(self, history):
+        body = PicoGPT._BodyBuffer(1024)
+        body.write(b'[{"role":"system","content":"s"}')
+        history.write_to(body)
+        body.write(b"]")
+        return json.loads(bytes(body.body()))[1:]
+
+    def contents(self, history):
+        return [(history.role(i), history.text(i)) for i in range(len(history))]
+
+    def test_wraparound(self):
+        history = PicoGPT._History(size=64, slots=4)
+        sent = []
+        for n in range(20):
+            role = "user" if n % 2 == 0 else "assistant"
+            text = "message {} {}".format(n, "x" * (n % 7))
+            history.append(role, text)
+            sent.append((role, text))
+            kept = sent[-len(history):]
+            self.assertEqual(self.contents(history), kept)
+            self.assertEqual(self.body(history), [{"role": r, "content": t} for r, t in kept])
+        self.assertLessEqual(len(history), 4)
+
+    def test_appendleft_across_the_start(self):
+        history = PicoGPT._History(size=48, slots=4)
+        history.append("user", "first")
+        history.appendleft("system", "summary before the start of the buffer")
+        self.assertEqual(self.contents(history), [("system", "summary before the start of the buffer"), ("user", "first")])
+        self.assertEqual(self.body(history)[0]["content"], "summary before the start of the buffer")
+
+    def test_message_longer_than_buffer(self):
+        history = PicoGPT._History(size=32, slots=4)
+        history.append("user", "y" * 100)
+        self.assertEqual(len(history), 1)
+        self.assertTrue(history.text(0).endswith("..."))
+        self.assertLess(history.nbytes(0), 32)
+
+    def test_shrink_in_place(self):
+        history = PicoGPT._History(size=64, slots=4)
+        history.append("assistant", "a long reply that gets clipped")
+        history.append("user", "next")
+        history.shrink(0, "a long...")
+        self.assertEqual(self.contents(history), [("assistant", "a long..."), ("user", "next")])
+        self.assertEqual(history.tokens(0), PicoGPT._estimate_tokens("a long..."))
+
+
+class CompactHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = {name: getattr(PicoGPT, name) for name in (
+            "HISTORY_TOKEN_BUDGET", "HISTORY_KEEP_FULL", "HISTORY_CLIP_CHARS", "HISTORY_SUMMARY_CHARS")}
+        PicoGPT.HISTORY_TOKEN_BUDGET = 100
+        PicoGPT.HISTORY_KEEP_FULL = 2
+        PicoGPT.HISTORY_CLIP_CHARS = 40
+        PicoGPT.HISTORY_SUMMARY_CHARS = 120
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(PicoGPT, name, value)
+
+    def make(self, turns, reply="r" * 30, slots=32):
+        history = PicoGPT._History(size=4096, slots=slots)
+        for n in range(turns):
+            history.append("user", "question {}".format(n))
+            history.append("assistant", "{} {}".format(reply, n))
+        return history
+
+    def tokens(self, history):
+        return sum(history.tokens(i) for i in range(len(history)))
+
+    def test_at_budget_is_left_alone(self):
+        history = self.make(3)
+        PicoGPT.HISTORY_TOKEN_BUDGET = self.tokens(history)
+        before = [history.text(i) for i in range(len(history))]
+        PicoGPT._compact_history(history, PicoGPT.HISTORY_TOKEN_BUDGET)
+        self.assertEqual([history.text(i) for i in range(len(history))], before)
+
+    def test_one_token_over_budget_compacts(self):
+        history = self.make(3, reply="r" * 38)
+        PicoGPT.HISTORY_TOKEN_BUDGET = self.tokens(history) - 1
+        PicoGPT._compact_history(history, PicoGPT.HISTORY_TOKEN_BUDGET)
+        self.assertLessEqual(self.tokens(history), PicoGPT.HISTORY_TOKEN_BUDGET)
+        self.assertEqual(history.role(0), "system")
+
+    def test_fold_that_saves_nothing_is_skipped(self):
+        # Short messages cost more in the summary than as they are
+        history = self.make(3)
+        before = [history.text(i) for i in range(len(history))]
+        PicoGPT.HISTORY_TOKEN_BUDGET = self.tokens(history) - 1
+        PicoGPT._compact_history(history, PicoGPT.HISTORY_TOKEN_BUDGET)
+        self.assertEqual([history.text(i) for i in range(len(history))], before)
+
+    def test_target_below_budget_waits_for_the_budget(self):
+        history = self.make(3)
+        total = self.tokens(history)
+        PicoGPT.HISTORY_TOKEN_BUDGET = total
+        PicoGPT._compact_history(history, total // 2)
+        self.assertEqual(self.tokens(history), total)
+
+    def test_clipping_alone_can_be_enough(self):
+        history = self.make(2, reply="r" * 60)
+        PicoGPT.HISTORY_TOKEN_BUDGET = self.tokens(history) - 1
+        PicoGPT._compact_history(history, PicoGPT.HISTORY_TOKEN_BUDGET)
+        self.assertEqual(history.role(0), "user")  # Nothing folded
+        self.assertEqual(len(history.text(1)), PicoGPT.HISTORY_CLIP_CHARS)
+        self.assertEqual(history.text(3), "r" * 60 + " 1")  # Newest kept full
+
+    def test_folds_into_summary(self):
+        history = self.make(8)
+        newest = [history.text(i) for i in range(len(history) - 2, len(history))]
+        PicoGPT._compact_history(history, 60)
+        self.assertEqual(history.role(0), "system")
+        # Capped at HISTORY_SUMMARY_CHARS, the summary keeps the latest folded turns
+        self.assertTrue(history.text(0).startswith(PicoGPT._SUMMARY_PREFIX + "..."))
+        self.assertTrue(history.text(0).endswith("User: question 6; You: " + "r" * 30 + " 6"))
+        self.assertEqual([history.text(i) for i in range(len(history) - 2, len(history))], newest)
+
+    def test_summary_is_merged_and_capped(self):
+        history = self.make(8)
+        for _ in range(4):
+            PicoGPT._compact_history(history, 60)
+            history.append("user", "more")
+            history.append("assistant", "r" * 30)
+        self.assertEqual([history.role(i) for i in range(len(history))].count("system"), 1)
+        summary = history.text(0)[len(PicoGPT._SUMMARY_PREFIX):]
+        self.assertLessEqual(len(summary), PicoGPT.HISTORY_SUMMARY_CHARS)
+        self.assertTrue(summary.startswith("..."))
+
+    def test_keeps_newest_even_over_target(self):
+        history = self.make(1, reply="r" * 400)
+        PicoGPT._compact_history(history, 10)
+        self.assertEqual(len(history), 2)
+
+    def test_full_slots_fold_under_budget(self):
+        PicoGPT.HISTORY_TOKEN_BUDGET = 10000
+        history = self.make(4, reply="ok", slots=8)
+        PicoGPT._compact_history(history, PicoGPT.HISTORY_TOKEN_BUDGET)
+        self.assertEqual(history.role(0), "system")
+        self.assertLessEqual(len(history), 8 // 2 + 1)
+
+
+class ChatLogTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = {name: getattr(PicoGPT, name) for name in (
+            "CHAT_LOG_PATH", "CHAT_LOG_MAX_BYTES", "HISTORY_TOKEN_BUDGET", "HISTORY_KEEP_FULL", "HISTORY_CLIP_CHARS")}
+        self.dir = tempfile.TemporaryDirectory()
+        PicoGPT.CHAT_LOG_PATH = os.path.join(self.dir.name, "chat.log")
+        PicoGPT.HISTORY_TOKEN_BUDGET = 100
+        PicoGPT.HISTORY_KEEP_FULL = 2
+        PicoGPT.HISTORY_CLIP_CHARS = 40
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(PicoGPT, name, value)
+        self.dir.cleanup()
+
+    def contents(self, history):
+        return [(history.role(i), history.text(i)) for i in range(len(history))]
+
+    def chat(self, log, history, turns, target=PicoGPT.HISTORY_TOKEN_BUDGET, first=0):
+        """Turns like _ask_steps and _poll_request take them, replies of varied length"""
+        for n in range(first, first + turns):
+            question = "question {}".format(n)
+            reply = "{} {}".format("r" * (n * 37 % 120), n)
+            history.append("user", question)
+            history.append("assistant", reply)
+            PicoGPT._compact_history(history, target)
+            log.append("user", question)
+            log.append("assistant", reply)
+            log.save_summary(history)
+
+    def restored(self, slots=8, target=PicoGPT.HISTORY_TOKEN_BUDGET):
+        """The history start() resumes with"""
+        history = PicoGPT._History(size=4096, slots=slots)
+        log = PicoGPT._ChatLog()
+        log.restore(history, target)
+        PicoGPT._compact_history(history, target)
+        log.save_summary(history)
+        return self.contents(history)
+
+    def test_index_entries(self):
+        log = PicoGPT._ChatLog()
+        log.append("user", "hi")
+        log.append("assistant", "hello")
+        self.assertEqual(os.path.getsize(PicoGPT.CHAT_LOG_PATH + ".idx"), 2 * PicoGPT._LOG_ENTRY_SIZE)
+        self.assertEqual(log.read(0, 2), [(0, "user", "hi"), (0, "assistant", "hello")])
+
+    def test_resume_without_summary(self):
+        history = PicoGPT._History(size=4096, slots=8)
+        self.chat(PicoGPT._ChatLog(), history, 1)
+        self.assertEqual(self.restored(), self.contents(history))
+
+    def test_resume_keeps_the_summary(self):
+        summaries = 0
+        for turns in range(1, 12):
+            PicoGPT.CHAT_LOG_PATH = os.path.join(self.dir.name, "chat{}.log".format(turns))
+            history = PicoGPT._History(size=4096, slots=8)
+            self.chat(PicoGPT._ChatLog(), history, turns)
+            summaries += history.role(0) == "system"
+            self.assertEqual(self.restored(), self.contents(history), turns)
+        self.assertGreater(summaries, 5)
+
+    def test_resume_matches_live(self):
+        for slots in (6, 8, 12):
+            for target in (PicoGPT.HISTORY_TOKEN_BUDGET, PicoGPT.HISTORY_TOKEN_BUDGET // 2):
+                PicoGPT.CHAT_LOG_PATH = os.path.join(self.dir.name, "chat{}-{}.log".format(slots, target))
+                log = PicoGPT._ChatLog()
+                history = PicoGPT._History(size=4096, slots=slots)
+                for turn in range(20):
+                    self.chat(log, history, 1, target, turn)
+                    self.assertEqual(self.restored(slots, target), self.contents(history), (slots, target, turn))
+
+    def test_log_compaction_keeps_the_resume(self):
+        PicoGPT.CHAT_LOG_MAX_BYTES = 800
+        for slots in (6, 8, 12):
+            PicoGPT.CHAT_LOG_PATH = os.path.join(self.dir.name, "chat{}.log".format(slots))
+            log = PicoGPT._ChatLog()
+            history = PicoGPT._History(size=4096, slots=slots)
+            for turn in range(30):
+                self.chat(log, history, 1, PicoGPT.HISTORY_TOKEN_BUDGET, turn)
+                self.assertEqual(self.restored(slots), self.contents(history), (slots, turn))
+                # Restarting after a compaction resumes the same conversation too
+                log = PicoGPT._ChatLog()
+            self.assertLess(log.count, 60)
+            self.assertLess(os.path.getsize(PicoGPT.CHAT_LOG_PATH), 2 * PicoGPT.CHAT_LOG_MAX_BYTES)
+
+    def test_new_conversation_has_no_summary(self):
+        log = PicoGPT._ChatLog()
+        self.chat(log, PicoGPT._History(size=4096, slots=8), 6)
+        log.new_conversation()
+        log.append("user", "fresh")
+        self.assertEqual(self.restored(), [("user", "fresh")])
+
+
+class SimilarIndexTest(unittest.TestCase):
+    PREFIX = "prefix"
+
+    def setUp(self):
+        self.saved = PicoGPT.CACHE_DIR
+        self.dir = tempfile.TemporaryDirectory()
+        PicoGPT.CACHE_DIR = self.dir.name
+
+    def tearDown(self):
+        PicoGPT.CACHE_DIR = self.saved
+        self.dir.cleanup()
+
+    def find(self, stored, asked, prefix=PREFIX):
+        index = PicoGPT._SimilarIndex()
+        index.add(stored, "key", self.PREFIX)
+        return index.find(asked, prefix)
+
+    def test_rewordings_match(self):
+        for stored, asked in (
+            ("What is 2+2?", "whats 2 + 2"),
+            ("What is the capital of France?", "whats the capital of france"),
+            ("Is coffee good for you?", "is coffee good for you please"),
+        ):
+            match = self.find(stored, asked)
+            self.assertIsNotNone(match, asked)
+            self.assertEqual(match[:2], ("key", stored))
+
+    def test_different_questions_dont_match(self):
+        for stored, asked in (
+            ("Tell me more about this", "Tell me more about that"),
+            ("Is coffee good for you?", "Is coffee not good for you?"),
+            ("Is coffee good for you?", "Isn't coffee good for you?"),
+            ("Convert 100 celsius to fahrenheit", "Convert 100 fahrenheit to celsius"),
+            ("When did World War II end?", "When did World War I end?"),
+            ("What is 12 times 7?", "What is 12 times 8?"),
+        ):
+            self.assertIsNone(self.find(stored, asked), asked)
+
+    def test_other_model_or_system_prompt_doesnt_match(self):
+        self.assertIsNone(self.find("What is 2+2?", "whats 2 + 2", "other prefix"))
+
+    def test_entries_survive_a_reload(self):
+        index = PicoGPT._SimilarIndex()
+        index.add("What is the capital of France?", "key", self.PREFIX)
+        index.save()
+        self.assertEqual(PicoGPT._SimilarIndex().find("whats the capital of france", self.PREFIX)[0], "key")
+
+
+class TextViewTest(unittest.TestCase):
+    TEXT = "You: hi\n\nAI: " + "word " * 30 + "averyveryverylongwordthatneedssplitting end"
+
+    def test_wraps_to_cols(self):
+        view = PicoGPT._TextView()
+        view.layout(self.TEXT, 16)
+        self.assertTrue(all(len(line) <= 16 for line in view.lines))
+        # Breaks only drop the space they're at, a long word is split without losing characters
+        self.assertEqual("".join(view.lines).replace(" ", ""), self.TEXT.replace(" ", "").replace("\n", ""))
+        self.assertIn("averyveryverylon", view.lines)
+
+    def test_growing_text_matches_full_layout(self):
+        full = PicoGPT._TextView()
+        full.layout(self.TEXT, 16)
+        view = PicoGPT._TextView()
+        for end in range(0, len(self.TEXT) + 1, 7):
+            view.layout(self.TEXT[:end], 16)
+        view.layout(self.TEXT, 16)
+        self.assertEqual(view.lines, full.lines)
+
+    def test_changed_from(self):
+        view = PicoGPT._TextView()
+        view.layout("line one\nline two", 20)
+        view.layout("line one\nline two and more", 20)
+        self.assertEqual(view.changed_from, 1)
+        view.layout("line one\nline two and more", 20)
+        self.assertEqual(view.changed_from, len(view.lines))
+
+    def test_scroll_bounds(self):
+        view = PicoGPT._TextView()
+        view.layout("\n".join(str(n) for n in range(10)), 20)
+        self.assertFalse(view.scroll(-1, 4))
+        self.assertTrue(view.scroll(100, 4))
+        self.assertEqual(view.offset, 6)
+        self.assertTrue(view.at_end(4))
+
+
+class FakeResponse:
+    """An _HttpResponse whose body arrives as the given chunks"""
+
+    def __init__(self, chunks):
+        self.chunks = [chunk for chunk in chunks if chunk]  # b"" is the end of the body
+
+    def wait(self):
+        return iter(())
+
+    def read(self):
+        return self.chunks.pop(0) if self.chunks else b""
+
+
+def sse(events):
+    return b"".join(b"data: " + json.dumps(e, ensure_ascii=False).encode() + b"\n\n" for e in events) + b"data: [DONE]\n\n"
+
+
+class StreamTest(AppTest):
+    PIECES = ["Caf", "é ☃ ", "日本語", " 🙂 ok"]
+
+    def test_events_split_anywhere(self):
+        # Cuts land inside events, "data:" and multi-byte characters
+        body = sse([{"choices": [{"delta": {"content": piece}}]} for piece in self.PIECES])
+        backend = PicoGPT._ChatBackend("m")
+        for chunks in splits(body):
+            deltas = []
+            reply = run(PicoGPT._read_stream_reply(FakeResponse(chunks), deltas.append, backend))
+            self.assertEqual(reply, "".join(self.PIECES))
+            self.assertEqual(deltas, self.PIECES)
+
+    def test_streamed_reply_matches_plain(self):
+        mock_server.Options.chunk = 7
+        mock_server.Options.chunk_delay = 0.001
+        question = "café ☃ 日本語 🙂"
+        plain, _ = self.ask(question)
+        streamed, deltas = self.ask(question, stream=True)
+        self.assertIn(question, plain)
+        self.assertEqual(streamed, plain)
+        self.assertEqual("".join(deltas), streamed)
+        self.assertGreater(len(deltas), 1)
+
+
+class ResponseCacheTest(AppTest):
+    def test_least_recently_used_is_evicted(self):
+        PicoGPT.CACHE_MAX_BYTES = 30
+        cache = PicoGPT._ResponseCache()
+        for key in ("a", "b", "c"):
+            cache.put(key, key * 10)
+        self.assertEqual(cache.get("a"), "a" * 10)  # Now used after b and c
+        cache.put("d", "d" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual([cache.get(key) for key in "acd"], ["a" * 10, "c" * 10, "d" * 10])
+        self.assertNotIn("b", os.listdir(PicoGPT.CACHE_DIR))
+
+    def test_order_survives_a_reload(self):
+        PicoGPT.CACHE_MAX_BYTES = 30
+        cache = PicoGPT._ResponseCache()
+        for key in ("a", "b", "c"):
+            cache.put(key, key * 10)
+        cache.get("a")
+        cache.save()
+        cache = PicoGPT._ResponseCache()
+        cache.put("d", "d" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "a" * 10)
+
+    def test_expired_reply_is_dropped(self):
+        PicoGPT.CACHE_TTL = 60
+        cache = PicoGPT._ResponseCache()
+        cache.put("old", "stale reply")
+        cache.put("new", "fresh reply")
+        cache._index["old"][1] -= 61  # Created a minute ago
+        self.assertIsNone(cache.get("old"))
+        self.assertEqual(cache.get("new"), "fresh reply")
+        self.assertNotIn("old", os.listdir(PicoGPT.CACHE_DIR))
+
+    def test_reply_too_big_isnt_kept(self):
+        PicoGPT.CACHE_MAX_BYTES = 10
+        cache = PicoGPT._ResponseCache()
+        cache.put("big", "x" * 11)
+        self.assertIsNone(cache.get("big"))
+
+    def test_repeated_question_is_answered_from_flash(self):
+        PicoGPT.CACHE_ENABLED = True
+        first, _ = self.ask("what is a cache for")
+        asked = self.requests()
+        PicoGPT._chat_cache = None  # Like after a restart
+        self.assertEqual(self.ask("what is a cache for")[0], first)
+        self.assertEqual(self.requests(), asked)
+
+
+class RetryTest(AppTest):
+    def setUp(self):
+        super().setUp()
+        PicoGPT.RETRY_BASE_MS = 10
+        mock_server.Options.retry_after = 0
+        mock_server.Options.fail_status = 503
+
+    def test_transient_failure_is_retried(self):
+        mock_server.Options.fail_every = self.requests() + 1  # Only the next request
+        asked = self.requests()
+        reply, _ = self.ask("are you there")
+        self.assertIn("are you there", reply)
+        self.assertEqual(self.requests() - asked, 2)
+        self.assertEqual(PicoGPT._breaker_failures, 0)
+
+    def test_gives_up_after_the_retries(self):
+        mock_server.Options.fail_rate = 1.0
+        asked = self.requests()
+        with self.assertRaises(PicoGPT.HttpError) as caught:
+            self.ask("are you there")
+        self.assertEqual(caught.exception.status, 503)
+        self.assertEqual(self.requests() - asked, PicoGPT.RETRY_ATTEMPTS + 1)
+
+    def test_lasting_error_isnt_retried(self):
+        mock_server.Options.fail_rate = 1.0
+        mock_server.Options.fail_status = 401
+        asked = self.requests()
+        self.assertRaises(PicoGPT.HttpError, self.ask, "are you there")
+        self.assertEqual(self.requests() - asked, 1)
+        self.assertEqual(PicoGPT._breaker_failures, 0)
+
+    def test_breaker_fails_fast_then_closes(self):
+        PicoGPT.RETRY_ATTEMPTS = 0
+        mock_server.Options.fail_rate = 1.0
+        for _ in range(PicoGPT.BREAKER_FAILURES):
+            self.assertRaises(PicoGPT.HttpError, self.ask, "are you there")
+        asked = self.requests()
+        self.assertRaises(PicoGPT.ApiUnreachable, self.ask, "are you there")
+        self.assertEqual(self.requests(), asked)
+        # Past the cooldown one question goes through and a reply closes it
+        mock_server.Options.fail_rate = 0.0
+        PicoGPT._breaker_until = PicoGPT.ticks_ms()
+        self.assertIn("are you there", self.ask("are you there")[0])
+        self.assertEqual(PicoGPT._breaker_failures, 0)
+
+
+class ProbeTest(AppTest):
+    def setUp(self):
+        super().setUp()
+        PicoGPT.API_BACKEND = "auto"
+
+    def backend(self):
+        PicoGPT._chat_backend = None
+        return run(PicoGPT._get_backend())
+
+    def test_finds_the_endpoint_and_model(self):
+        mock_server.Options.endpoints = ["responses"]
+        mock_server.Options.models = ["other-model"]
+        backend = self.backend()
+        self.assertEqual((backend.name, backend.model), ("responses", "other-model"))
+        self.assertIn("which api is this", self.ask("which api is this")[0])
+        with open(PicoGPT.BACKEND_CACHE) as f:
+            saved = json.load(f)
+        self.assertEqual(saved["backend"], "responses")
+        self.assertEqual(saved["model"], "other-model")
+
+    def test_answer_is_kept_per_base(self):
+        self.assertEqual(self.backend().name, "chat")
+        asked = self.requests()
+        self.assertEqual(self.backend().name, "chat")
+        self.assertEqual(self.requests(), asked)
+        PicoGPT.API_BASE += "/"  # Another server probes again
+        self.backend()
+        self.assertGreater(self.requests(), asked)
+
+    def test_no_api_at_all(self):
+        mock_server.Options.endpoints = []
+        self.assertRaises(RuntimeError, self.backend)
+        self.assertFalse(os.path.exists(PicoGPT.BACKEND_CACHE))
+
+
+class FakeWifi:
+    def __init__(self, up):
+        self.up = up
+
+    def is_connected(self):
+        return self.up
+
+
+class FakeViewManager:
+    def __init__(self, up):
+        self.wifi = FakeWifi(up)
+
+    def get_wifi(self):
+        return self.wifi
+
+
+class RequestQueueTest(AppTest):
+    QUESTIONS = ["first queued question", "second queued question"]
+
+    def restart(self):
+        """A queue loaded from flash, like in start()"""
+        PicoGPT._chat_queue = PicoGPT._RequestQueue()
+        return PicoGPT._chat_queue
+
+    def poll(self, view_manager, tries=5):
+        """Run _poll_queue like run() does, without its once a second wait between questions"""
+        for _ in range(tries):
+            PicoGPT._chat_queue_wait = PicoGPT.ticks_ms()
+            PicoGPT._poll_queue(view_manager)
+            while PicoGPT._chat_drain is not None:
+                PicoGPT._poll_queue(view_manager)
+
+    def queue(self):
+        queue = self.restart()
+        for question in self.QUESTIONS:
+            queue.push(question)
+        return self.restart()
+
+    def test_questions_survive_a_restart(self):
+        self.assertEqual(self.queue().pending, self.QUESTIONS)
+
+    def test_offline_asks_nothing(self):
+        self.queue()
+        asked = self.requests()
+        self.poll(FakeViewManager(False))
+        self.assertEqual(self.requests(), asked)
+        self.assertEqual(PicoGPT._chat_queue.pending, self.QUESTIONS)
+
+    def test_replayed_once_online(self):
+        self.queue()
+        self.poll(FakeViewManager(True))
+        queue = self.restart()
+        self.assertEqual(queue.pending, [])
+        self.assertFalse(os.path.exists(PicoGPT.QUEUE_PATH))
+        self.assertEqual(queue.answers, 2)
+        answers = queue._read_answers()
+        self.assertEqual([entry["q"] for entry in answers], self.QUESTIONS)
+        for entry in answers:
+            self.assertIn(entry["q"], entry["a"])
+        self.assertLess(queue.answers_text().index("second"), queue.answers_text().index("first"))
+
+    def test_transient_failure_stays_queued(self):
+        PicoGPT.RETRY_ATTEMPTS = 0
+        mock_server.Options.fail_rate = 1.0
+        mock_server.Options.fail_status = 503
+        self.queue()
+        self.poll(FakeViewManager(True), 1)
+        self.assertEqual(self.restart().pending, self.QUESTIONS)
+        self.assertEqual(PicoGPT._chat_queue.answers, 0)
+
+    def test_lasting_failure_is_filed(self):
+        mock_server.Options.fail_rate = 1.0
+        mock_server.Options.fail_status = 401
+        self.queue()
+        self.poll(FakeViewManager(True))
+        answers = self.restart()._read_answers()
+        self.assertEqual(len(answers), 2)
+        self.assertIn("401", answers[0]["e"])
+
+
+class InflateTest(AppTest):
+    BODY = b"".join(b"data: {\"n\": %d, \"text\": \"the quick brown fox\"}\n\n" % n for n in range(50))
+
+    def inflate(self, data, encoding):
+        """Lines the inflater reads from data"""
+        inflate = PicoGPT._inflater(io.BytesIO(data), encoding)
+        lines = []
+        while True:
+            line = inflate.readline(512)
+            if not line:
+                return lines
+            lines.append(line)
+
+    def test_gzip_and_deflate(self):
+        for encoding, wbits in (("gzip", 31), ("deflate", 15)):
+            packer = zlib.compressobj(wbits=wbits)
+            lines = self.inflate(packer.compress(self.BODY) + packer.flush(), encoding)
+            self.assertEqual(b"".join(lines), self.BODY)
+            self.assertTrue(all(line.endswith(b"\n") for line in lines))
+
+    def compare(self, stream):
+        """Reply and bytes the mock sent with and without compression"""
+        results = []
+        for compression in (True, False):
+            PicoGPT.HTTP_COMPRESSION = compression
+            PicoGPT._close_session()
+            sent = mock_server.stats["bytes_out"]
+            reply, deltas = self.ask("compress this reply please", stream=stream)
+            if stream:
+                self.assertEqual("".join(deltas), reply)
+            results.append((reply, mock_server.stats["bytes_out"] - sent))
+        return results
+
+    def test_compressed_reply_matches_plain(self):
+        mock_server.Options.words = 200
+        for stream in (False, True):
+            (packed, packed_bytes), (plain, plain_bytes) = self.compare(stream)
+            self.assertEqual(packed, plain)
+            self.assertEqual(plain, mock_server.make_reply("compress this reply please"))
+            self.assertLess(packed_bytes, plain_bytes)
+
+
+class ReplyBudgetTest(AppTest):
+    def setUp(self):
+        super().setUp()
+        self.heap = 0
+        PicoGPT._mem_free = lambda: self.heap
+
+    def fits(self, tokens, reserve=0):
+        """Heap that holds a reply of tokens past the reserves"""
+        return PicoGPT.HEAP_RESERVE + reserve + tokens * PicoGPT.REPLY_HEAP_PER_TOKEN
+
+    def test_budget(self):
+        self.assertEqual(PicoGPT._reply_budget(), PicoGPT.REPLY_MAX_TOKENS)  # Heap unknown
+        self.heap = self.fits(100)
+        self.assertEqual(PicoGPT._reply_budget(), 100)
+        self.assertEqual(PicoGPT._reply_budget(10 * PicoGPT.REPLY_HEAP_PER_TOKEN), 90)
+        PicoGPT._chat_screen_chars = 40
+        self.assertEqual(PicoGPT._reply_budget(), 40 * PicoGPT.REPLY_MAX_SCREENS // 4)
+
+    def test_short_heap_asks_for_a_plain_reply(self):
+        self.heap = self.fits(PicoGPT.REPLY_MIN_TOKENS, PicoGPT.INFLATE_WINDOW) - 1
+        reply, _ = self.ask("little room here")
+        self.assertIn("little room here", reply)
+        self.assertFalse(PicoGPT._get_session(PicoGPT.API_BASE).compress)
+
+    def test_no_room_for_a_reply(self):
+        self.heap = self.fits(PicoGPT.REPLY_MIN_TOKENS) - 1
+        asked = self.requests()
+        self.assertRaises(PicoGPT.LowMemory, self.ask, "no room at all")
+        self.assertEqual(self.requests(), asked)
+
+    def test_room_made_after_the_lookup(self):
+        PicoGPT.CACHE_ENABLED = True
+        self.heap = self.fits(PicoGPT.REPLY_MIN_TOKENS) - 1
+        free_heap = PicoGPT._free_heap
+
+        def freed():
+            free_heap()
+            self.heap += PicoGPT.REPLY_MIN_TOKENS * PicoGPT.REPLY_HEAP_PER_TOKEN
+
+        PicoGPT._free_heap = freed
+        self.assertIn("squeezed in", self.ask("squeezed in")[0])
+        self.assertIsNone(PicoGPT._chat_cache)
+        # A reply limited by the heap isn't kept
+        asked = self.requests()
+        self.ask("squeezed in")
+        self.assertEqual(self.requests(), asked + 1)
+
+    def test_cut_reply_isnt_cached(self):
+        PicoGPT.CACHE_ENABLED = True
+        PicoGPT.REPLY_MAX_TOKENS = 10
+        mock_server.Options.words = 20
+        asked = self.requests()
+        for _ in range(2):
+            self.assertEqual(len(self.ask("a long answer please")[0].split(" ")), 10)
+        self.assertEqual(self.requests(), asked + 2)
+        mock_server.Options.words = 4
+        for _ in range(2):
+            self.ask("a short answer please")
+        self.assertEqual(self.requests(), asked + 3)
+
+
+def wrap(text, cols=0, col=0):
+    wrapper = gateway.Wrapper(cols, col)
+    return wrapper.feed(text) + wrapper.flush()
+
+
+class WrapperTest(unittest.TestCase):
+    MARKDOWN = "# Title\n**bold** and `code`\n* item\n```py\nx = 1\n```\n> quoted\nend"
+
+    def test_wraps_to_the_columns(self):
+        self.assertEqual(wrap("the quick brown fox jumps", 10), "the quick\nbrown fox\njumps")
+        self.assertEqual(wrap("the quick brown fox jumps"), "the quick brown fox jumps")
+        self.assertEqual(wrap("line one\nline two", 20), "line one\nline two")
+
+    def test_starts_at_col(self):
+        self.assertEqual(wrap("hello there", 10, 4), "hello\nthere")
+        self.assertEqual(wrap("hello", 10, 8), "\nhello")
+
+    def test_long_words_are_split(self):
+        self.assertEqual(wrap("abcdefghij", 4), "abcd\nefgh\nij")
+        self.assertEqual(wrap("ab cdefghij", 4), "ab\ncdef\nghij")
+
+    def test_markdown_is_stripped(self):
+        self.assertEqual(wrap(self.MARKDOWN), "Title\nbold and code\n- item\nx = 1\nquoted\nend")
+
+    def test_streamed_in_pieces(self):
+        text = self.MARKDOWN + " " + mock_server.make_reply("a longer streamed reply to wrap")
+        whole = wrap(text, 12, 4)
+        for size in (1, 2, 5, 13):
+            wrapper = gateway.Wrapper(12, 4)
+            parts = [wrapper.feed(text[i:i + size]) for i in range(0, len(text), size)]
+            self.assertEqual("".join(parts) + wrapper.flush(), whole)
+        self.assertTrue(all(len(line) <= 12 for line in whole.split("\n")))
+
+
+_gateway_base = None
+
+
+def gateway_base():
+    """URL of a gateway to the mock API, started on first use"""
+    global _gateway_base
+    if _gateway_base is None:
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        async def start():
+            pool = gateway.UpstreamPool(mock_base(), gateway.Options.pool)
+
+            async def on_connect(reader, writer):
+                await gateway.DeviceHandler(pool, reader, writer).run()
+
+            return await asyncio.start_server(on_connect, "127.0.0.1", 0)
+
+        server = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        _gateway_base = "http://127.0.0.1:{}/v1".format(server.sockets[0].getsockname()[1])
+    return _gateway_base
+
+
+class GatewayTest(AppTest):
+    def setUp(self):
+        super().setUp()
+        PicoGPT.API_BASE = gateway_base()
+        PicoGPT.API_BACKEND = "gateway"
+        PicoGPT._chat_screen_cols = 20
+
+    def test_reply_comes_wrapped(self):
+        mock_server.Options.words = 40
+        for stream in (False, True):
+            reply, deltas = self.ask("through the gateway", stream=stream)
+            self.assertEqual(reply, wrap(mock_server.make_reply("through the gateway"), 20, 4))
+            if stream:
+                self.assertEqual("".join(deltas), reply)
+
+    def post(self, conn, query, body=b'{"messages": [{"role": "user", "content": "hi"}]}'):
+        """Status and error message of a chat request on conn"""
+        conn.request("POST", "/v1/picogpt/chat" + query, body, {"Authorization": "Bearer test"})
+        resp = conn.getresponse()
+        data = json.loads(resp.read())
+        return resp.status, (data.get("error") or {}).get("message")
+
+    def connect(self):
+        conn = http.client.HTTPConnection(gateway_base().split("/")[2], timeout=10)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_bad_wrap_args_are_refused(self):
+        conn = self.connect()
+        for query in ("?cols=abc", "?cols=20&col=-4", "?col=4.5"):
+            status, message = self.post(conn, query)
+            self.assertEqual(status, 400, query)
+            self.assertIn("whole number", message)
+        self.assertEqual(self.post(conn, "?cols=20&col=4")[0], 200)
+
+    def test_wrap_args_are_clamped(self):
+        self.assertEqual(gateway._wrap_args({"cols": ["100000"], "col": ["4"]}), (gateway.MAX_COLS, 4))
+        self.assertEqual(gateway._wrap_args({"cols": ["20"], "col": ["50"]}), (20, 20))
+        self.assertEqual(gateway._wrap_args({}), (0, 0))
+
+    def test_body_must_be_an_object(self):
+        self.assertEqual(self.post(self.connect(), "", b"[1, 2]")[0], 400)
+
+    def test_unexpected_error_answers_500(self):
+        def broken(body):
+            raise KeyError("model")
+
+        upstream_body = gateway._upstream_body
+        gateway._upstream_body = broken
+        self.addCleanup(setattr, gateway, "_upstream_body", upstream_body)
+        conn = self.connect()
+        errors = gateway.stats["errors"]
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            status, message = self.post(conn, "")
+        self.assertEqual(status, 500)
+        self.assertIn("KeyError", message)
+        self.assertIn("Traceback", out.getvalue())
+        self.assertEqual(gateway.stats["errors"], errors + 1)
+        # The connection stays usable
+        gateway._upstream_body = upstream_body
+        self.assertEqual(self.post(conn, "")[0], 200)
+
+
+class EmulatorDrawTest(unittest.TestCase):
+    def test_clear_drops_only_the_text_inside(self):
+        draw = emulator.Draw(320, 320)
+        for y in (0, 20, 40):
+            draw.text(emulator.Vector(8, y), "row {}".format(y))
+        draw.text(emulator.Vector(200, 40), "right")
+        draw.clear(emulator.Vector(0, 20), emulator.Vector(100, 300))
+        draw.swap()
+        self.assertEqual(draw.screen, [(0, 8, "row 0"), (40, 200, "right")])
+        draw.clear(emulator.Vector(0, 0), draw.size)
+        draw.swap()
+        self.assertEqual(draw.screen, [])
+
+
+class RedrawTest(AppTest):
+    def test_partial_redraw_keeps_the_rows_above(self):
+        view_manager = emulator.ViewManager()
+        self.assertTrue(PicoGPT.start(view_manager))
+        self.addCleanup(PicoGPT.stop, view_manager)
+        text = "\n".join("line {}".format(n) for n in range(5))
+        PicoGPT._draw_text_view(view_manager, text, "footer")
+        PicoGPT._draw_text_view(view_manager, text + " more", "footer")
+        shown = [t[2] for t in view_manager.draw.screen]
+        self.assertEqual([line for line in shown if line.startswith("line")], ["line {}".format(n) for n in range(4)] + ["line 4 more"])
+
+
+class ResumeTest(AppTest):
+    """Questions asked like run() asks them, between start() and stop()"""
+
+    def setUp(self):
+        super().setUp()
+        PicoGPT.CACHE_ENABLED = True
+        self.view_manager = emulator.ViewManager()
+        self.assertTrue(PicoGPT.start(self.view_manager))
+        self.addCleanup(PicoGPT.stop, self.view_manager)
+
+    def restart(self):
+        PicoGPT.stop(self.view_manager)
+        self.assertTrue(PicoGPT.start(self.view_manager))
+
+    def question(self, text):
+        """Ask text and wait for the reply, returns the similar question that answered it"""
+        PicoGPT._chat_user_input = text
+        PicoGPT._chat_request = PicoGPT._ask_steps(text, PicoGPT._chat_history)
+        while PicoGPT._chat_request is not None:
+            PicoGPT._poll_request()
+        self.assertTrue(PicoGPT._chat_displaying_result)
+        return PicoGPT._chat_last_match
+
+    def test_first_question_after_a_restart_matches(self):
+        self.assertIsNone(self.question("What is the capital of France?"))
+        self.restart()
+        self.assertEqual(len(PicoGPT._chat_history), 2)  # Resumed from the chat log
+        asked = self.requests()
+        match = self.question("whats the capital of france")
+        self.assertEqual(match[0], "What is the capital of France?")
+        self.assertEqual(self.requests(), asked)
+        # Later questions depend on what was said before them
+        self.assertIsNone(self.question("what's the capital of france"))
+        self.assertEqual(self.requests(), asked + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()